@@ -0,0 +1,137 @@
+class trackedList(list):
+
+    # a list that counts the changes made to it (items set, added or
+    # removed, or the list sorted or reversed in place), so that any
+    # index built over its contents can tell whether it is out of date
+
+    version = 0
+
+    def changed(self):
+        self.version += 1
+
+    def __setitem__(self, *args):
+        list.__setitem__(self, *args)
+        self.changed()
+
+    def __delitem__(self, *args):
+        list.__delitem__(self, *args)
+        self.changed()
+
+    def __iadd__(self, other):
+        result = list.__iadd__(self, other)
+        self.changed()
+        return result
+
+    def __imul__(self, n):
+        result = list.__imul__(self, n)
+        self.changed()
+        return result
+
+    def append(self, *args):
+        list.append(self, *args)
+        self.changed()
+
+    def extend(self, *args):
+        list.extend(self, *args)
+        self.changed()
+
+    def insert(self, *args):
+        list.insert(self, *args)
+        self.changed()
+
+    def pop(self, *args):
+        item = list.pop(self, *args)
+        self.changed()
+        return item
+
+    def remove(self, *args):
+        list.remove(self, *args)
+        self.changed()
+
+    def clear(self):
+        list.clear(self)
+        self.changed()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self.changed()
+
+    def reverse(self):
+        list.reverse(self)
+        self.changed()
+
+
+def isCurrentList(atoms=[], indexedList=[], version=0, numAtoms=0):
+
+    # whether an index built over 'indexedList' (at change count
+    # 'version', holding 'numAtoms' atoms) is still valid for 'atoms'
+
+    return (atoms is indexedList and len(atoms) == numAtoms and
+            getattr(atoms, 'version', 0) == version)
+
+
+class atomLookup(object):
+
+    # hashed indices of a list of atoms by chain, residue type,
+    # residue number and atom type, mapping each value of a field to
+    # the positions of the atoms with that value. A query on several
+    # fields intersects the matching positions for each, and a query
+    # on all four fields is a single lookup of the combined key
+
+    fields = ['chaintype', 'basetype', 'residuenum', 'atomtype']
+
+    def __init__(self,
+                 atoms=[]):
+
+        # the indexed list itself, so that changes to it are detected
+        self.atomList = atoms
+        self.version = getattr(atoms, 'version', 0)
+        self.atoms = list(atoms)
+
+        self.index = {field: {} for field in self.fields}
+        self.combined = {}
+        for i, atom in enumerate(self.atoms):
+            key = tuple(getattr(atom, field) for field in self.fields)
+            for field, val in zip(self.fields, key):
+                self.index[field].setdefault(val, []).append(i)
+            self.combined.setdefault(key, []).append(i)
+
+    def isCurrent(self,
+                  atoms=[]):
+
+        # whether the index is still valid for the list 'atoms'
+
+        return isCurrentList(atoms=atoms, indexedList=self.atomList,
+                             version=self.version, numAtoms=len(self.atoms))
+
+    def find(self,
+             chain='', restype='', resnum='', atomtype=''):
+
+        # get the atoms matching all specified fields, in list order.
+        # A field given as '' matches any value
+
+        query = [chain, restype, resnum, atomtype]
+        try:
+            if all(val != '' for val in query):
+                return [self.atoms[i]
+                        for i in self.combined.get(tuple(query), [])]
+        except TypeError:
+            # an unhashable value (e.g. a list) matches no atom
+            return []
+
+        found = None
+        for field, val in zip(self.fields, query):
+            if val == '':
+                continue
+            try:
+                matches = self.index[field].get(val, [])
+            except TypeError:
+                return []
+            if found is None:
+                found = set(matches)
+            else:
+                found.intersection_update(matches)
+
+        if found is None:
+            return list(self.atoms)
+        return [self.atoms[i] for i in sorted(found)]
@@ -0,0 +1,131 @@
+from mapHeader import readMapHeader
+from errors import error
+import numpy as np
+import hashlib
+import os
+
+# bump this whenever the layout of the cache files changes,
+# so that any older cache files are ignored and rewritten
+CACHE_VERSION = 3
+
+# ending of the cache file name, written next to the atom-tagged map
+CACHE_SUFFIX = '_index.npz'
+
+
+def getCacheName(mapName='untitled_atoms.map'):
+
+    # the name of the voxel index cache file for an atom-tagged map
+
+    return os.path.splitext(mapName)[0] + CACHE_SUFFIX
+
+
+def hashFile(fileName='', blockSize=2**24):
+
+    # compute a hash of the full contents of a file, reading
+    # it in large blocks so that memory use stays bounded
+
+    h = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def saveAtomMapCache(mapName='', atomMap=None, atomInds=[],
+                     atomTagScale=100, log=''):
+
+    # write the atom-tagged voxel indices, the atom number of each
+    # of these voxels and the permutation that groups the voxels
+    # by atom number to a cache file next to the atom-tagged map.
+    # The cache is keyed by the map file size, modification time,
+    # content hash and atom tag scale, and stores the raw map header
+    # to be checked against when loaded. The grouping permutation is
+    # returned
+
+    atomNums = np.asarray(atomMap.vxls_val)
+    order = np.argsort(atomNums, kind='stable')
+
+    stats = os.stat(mapName)
+    cacheName = getCacheName(mapName)
+    tmpName = cacheName + '.tmp'
+
+    try:
+        with open(tmpName, 'wb') as f:
+            np.savez(f,
+                     version=CACHE_VERSION,
+                     fileSize=stats.st_size,
+                     mtime=stats.st_mtime,
+                     contentHash=hashFile(mapName),
+                     atomTagScale=atomTagScale,
+                     header=np.frombuffer(atomMap.header.tobytes(),
+                                          dtype=np.uint8),
+                     atomIndices=atomInds,
+                     atomNums=atomNums,
+                     order=order)
+        os.replace(tmpName, cacheName)
+    except (IOError, OSError):
+        error(text='Unable to write atom-tagged map index cache ' +
+                   '"{}". Continuing without cache'.format(cacheName),
+              log=log, type='warning')
+        if os.path.exists(tmpName):
+            os.remove(tmpName)
+    else:
+        log.writeToLog(
+            str='Atom-tagged map voxel index cached to "{}"'.format(
+                cacheName))
+
+    return order
+
+
+def loadAtomMapCache(mapName='', atomTagScale=100, log=''):
+
+    # load the voxel index cache for an atom-tagged map, if present
+    # and still valid for the current map file (and the atom tag
+    # scale by which its atom numbers were found). Returns a MapInfo
+    # object (as from readMap, filled from the map header), the
+    # atom-tagged voxel indices and the grouping permutation, or
+    # None if the map must be read in full
+
+    cacheName = getCacheName(mapName)
+    if not os.path.exists(cacheName):
+        return None
+
+    def stale(reason=''):
+        log.writeToLog(
+            str='Atom-tagged map index cache "{}" not used: {}'.format(
+                cacheName, reason))
+        return None
+
+    try:
+        cache = np.load(cacheName, allow_pickle=False)
+    except (IOError, OSError, ValueError):
+        return stale('cache file could not be read')
+
+    with cache:
+        if int(cache['version']) != CACHE_VERSION:
+            return stale('cache written by a different RIDL version')
+
+        if float(cache['atomTagScale']) != atomTagScale:
+            return stale('atom tag scale has changed')
+
+        stats = os.stat(mapName)
+        if (int(cache['fileSize']) != stats.st_size or
+                float(cache['mtime']) != stats.st_mtime):
+            return stale('map file size or modification time has changed')
+
+        rho = readMapHeader(mapName=mapName, log=log)
+        if cache['header'].tobytes() != rho.header.tobytes():
+            return stale('map header has changed')
+
+        if str(cache['contentHash']) != hashFile(mapName):
+            return stale('map file contents have changed')
+
+        atomInds = cache['atomIndices']
+        rho.vxls_val = cache['atomNums']
+        order = cache['order']
+
+    log.writeToLog(
+        str='Atom-tagged map voxel index read from cache "{}"'.format(
+            cacheName))
+
+    return rho, atomInds, order
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def selectTopN(vals=[], n=25, largest=True, keepTies=False):
+
+    # positions of the n largest (or smallest) values of 'vals',
+    # ordered best first, found by partitioning about the nth value
+    # rather than sorting all values. Nan values are never selected.
+    # Equal values are ordered by position (as for a stable sort).
+    # Where values are tied with the nth, the first by position are
+    # taken, or all of them if 'keepTies'. 'n' is integer or 'all'
+
+    vals = np.asarray(vals, dtype=float)
+    rows = np.flatnonzero(~np.isnan(vals))
+    key = -vals[rows] if largest else vals[rows]
+
+    if n == 'all':
+        m = len(rows)
+    else:
+        m = min(int(n), len(rows))
+    if m <= 0:
+        return np.zeros(0, dtype=int)
+
+    if m < len(rows):
+        kth = key[np.argpartition(key, m-1)[m-1]]
+        better = key < kth
+        tied = key == kth
+        if not keepTies:
+            tied &= np.cumsum(tied) <= m - np.count_nonzero(better)
+        chosen = better | tied
+        rows, key = rows[chosen], key[chosen]
+
+    return rows[np.lexsort((rows, key))]
+
+
+def rankTopN(vals=[], n=25, largest=True, include=None, keepTies=False):
+
+    # the top n atoms for each dataset, where 'vals' is an array of
+    # metric values of shape (atoms, datasets) (or (atoms,) for a
+    # single dataset) and 'include' marks the atoms (or (atom,
+    # dataset) values) that may be ranked, e.g. atoms present within
+    # each dataset or of given residue types.
+    # Returns a list with an array of atom positions per dataset,
+    # ordered best first (see selectTopN)
+
+    vals = np.array(vals, dtype=float)
+    vals = vals.reshape(len(vals), -1)
+    if include is not None:
+        include = np.broadcast_to(
+            np.asarray(include, dtype=bool).reshape(
+                len(vals), -1), vals.shape)
+        vals[~include] = np.nan
+
+    return [selectTopN(vals=vals[:, d], n=n, largest=largest,
+                       keepTies=keepTies) for d in range(vals.shape[1])]
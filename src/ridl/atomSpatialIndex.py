@@ -0,0 +1,134 @@
+from atomLookup import isCurrentList
+from scipy.spatial import cKDTree
+import numpy as np
+
+
+def getAtomCoords(atoms=[]):
+
+    # the (x, y, z) coordinates of a list of atoms, as an array
+    # of shape (atoms, 3)
+
+    return np.array([[atm.X_coord, atm.Y_coord, atm.Z_coord]
+                     for atm in atoms], dtype=float).reshape(-1, 3)
+
+
+class atomSpatialIndex(object):
+
+    # a k-d tree over the coordinates of a list of atoms, built once
+    # and then used for radius, nearest-atom and all-pairs-within-
+    # distance queries, rather than computing the distance from each
+    # query atom to every other atom. Atoms are referred to by their
+    # position in the indexed list. Each atom is also given integer
+    # codes for its residue and atom ID, so that atoms of the same
+    # residue (or the same atom) can be excluded from query results
+
+    def __init__(self,
+                 atoms=[]):
+
+        # the indexed list itself, so that changes to it are detected
+        self.atomList = atoms
+        self.version = getattr(atoms, 'version', 0)
+        self.atoms = list(atoms)
+
+        self.coords = getAtomCoords(self.atoms)
+        self.tree = cKDTree(self.coords)
+
+        self.atomIDs = [atm.getAtomID() for atm in self.atoms]
+        self.resIDs = [tuple(ID.split('-')[:-1]) for ID in self.atomIDs]
+        self.resCodes = self.getCodes(self.resIDs)
+        self.atomCodes = self.getCodes(self.atomIDs)
+
+    def getCodes(self,
+                 keys=[]):
+
+        # an integer code per key, equal for equal keys
+
+        codes = {}
+        return np.array([codes.setdefault(k, len(codes)) for k in keys],
+                        dtype=int)
+
+    def isCurrent(self,
+                  atoms=[]):
+
+        # whether the index is still valid for the list 'atoms'
+
+        return isCurrentList(atoms=atoms, indexedList=self.atomList,
+                             version=self.version, numAtoms=len(self.atoms))
+
+    def getSameMask(self,
+                    atom='', inds=[], ignoreSame='res'):
+
+        # for indexed atoms 'inds', whether each is in the same
+        # residue as 'atom' (ignoreSame='res'), or is 'atom' itself
+        # (ignoreSame='atom'). No atoms are matched otherwise
+
+        ID = atom.getAtomID()
+        if ignoreSame == 'res':
+            resID = tuple(ID.split('-')[:-1])
+            same = [self.resIDs[i] == resID for i in inds]
+        elif ignoreSame == 'atom':
+            same = [self.atomIDs[i] == ID for i in inds]
+        else:
+            same = [False]*len(inds)
+        return np.array(same, dtype=bool)
+
+    def withinDist(self,
+                   atom='', distLimMax=4, distLimMin=0, ignoreSame='res'):
+
+        # find the indexed atoms strictly between 'distLimMin' and
+        # 'distLimMax' angstroms of 'atom', excluding atoms of the
+        # same residue or the atom itself (see getSameMask). Returns
+        # their positions (in indexed list order) and distances
+
+        xyz = getAtomCoords([atom])[0]
+        inds = np.sort(np.array(
+            self.tree.query_ball_point(xyz, distLimMax), dtype=int))
+        dists = np.linalg.norm(self.coords[inds] - xyz, axis=1)
+
+        keep = (dists < distLimMax) & (dists > distLimMin)
+        inds, dists = inds[keep], dists[keep]
+
+        keep = ~self.getSameMask(atom=atom, inds=inds, ignoreSame=ignoreSame)
+        return inds[keep], dists[keep]
+
+    def pairsWithinDist(self,
+                        distLimMax=4, distLimMin=0, ignoreSame='res'):
+
+        # find all pairs of indexed atoms strictly between 'distLimMin'
+        # and 'distLimMax' angstroms apart, excluding pairs within the
+        # same residue (ignoreSame='res') or of the same atom ID
+        # (ignoreSame='atom'). Returns an array of (i, j) positions,
+        # with i < j, and the distance between each pair
+
+        pairs = self.tree.query_pairs(distLimMax, output_type='ndarray')
+        pairs = pairs.reshape(-1, 2)
+        dists = np.linalg.norm(
+            self.coords[pairs[:, 0]] - self.coords[pairs[:, 1]], axis=1)
+
+        keep = (dists < distLimMax) & (dists > distLimMin)
+        if ignoreSame == 'res':
+            keep &= self.resCodes[pairs[:, 0]] != self.resCodes[pairs[:, 1]]
+        elif ignoreSame == 'atom':
+            keep &= self.atomCodes[pairs[:, 0]] != self.atomCodes[pairs[:, 1]]
+        return pairs[keep], dists[keep]
+
+    def maxDist(self,
+                atom=''):
+
+        # the distance from 'atom' to the furthest indexed atom
+
+        xyz = getAtomCoords([atom])[0]
+        if len(self.coords) == 0:
+            return 0
+        return np.max(np.linalg.norm(self.coords - xyz, axis=1))
+
+
+def nearestAtoms(atoms=[], otherAtoms=[]):
+
+    # for each atom in 'atoms', find the nearest atom of 'otherAtoms'
+    # (e.g. all atoms of a given type). Returns the position of the
+    # nearest atom within 'otherAtoms' and its distance, per atom
+
+    tree = cKDTree(getAtomCoords(otherAtoms))
+    dists, inds = tree.query(getAtomCoords(atoms), k=1)
+    return inds, dists
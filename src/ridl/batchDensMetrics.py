@@ -0,0 +1,259 @@
+from __future__ import division
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# per-atom percentiles calculated, as (attribute name, percentile)
+PERCENTILES = [('min90tile', 10), ('max90tile', 90),
+               ('min95tile', 5), ('max95tile', 95)]
+
+# per-atom metrics derived using an Fcalc map to weight each voxel
+FC_METRICS = ['densityWeightedMean', 'densityWeightedMin',
+              'densityWeightedMax', 'fracOfMaxAtomDensAtMin',
+              'densityWeightedMeanPosOnly', 'densityWeightedMeanNegOnly']
+
+
+def segmentedPercentile(sortedVals=[], starts=[], counts=[], q=50):
+
+    # the q-th percentile of each segment of an array in which each
+    # segment is sorted in ascending order. The linear interpolation
+    # used matches np.percentile. Every segment must be non-empty
+
+    starts = np.asarray(starts)
+    counts = np.asarray(counts)
+
+    virtualInds = (counts - 1)*(q/100)
+    prevInds = np.floor(virtualInds)
+    gamma = virtualInds - prevInds
+    prevInds = prevInds.astype(np.intp)
+    nextInds = prevInds + 1
+
+    atEnd = virtualInds >= counts - 1
+    prevInds[atEnd] = counts[atEnd] - 1
+    nextInds[atEnd] = counts[atEnd] - 1
+
+    a = sortedVals[starts + prevInds]
+    b = sortedVals[starts + nextInds]
+    diff = b - a
+    vals = a + diff*gamma
+    upper = gamma >= 0.5
+    vals[upper] = (b - diff*(1 - gamma))[upper]
+
+    # as np.percentile, any NaN (sorted to the segment end) gives NaN
+    vals[np.isnan(sortedVals[starts + counts - 1])] = np.nan
+
+    return vals
+
+
+def segmentedMedian(sortedVals=[], starts=[], counts=[]):
+
+    # the median of each segment of an array in which each segment
+    # is sorted in ascending order, calculated as for np.median
+
+    starts = np.asarray(starts)
+    counts = np.asarray(counts)
+
+    upper = sortedVals[starts + counts//2]
+    lower = sortedVals[starts + (counts - 1)//2]
+    vals = np.where(counts % 2 == 1, upper, (lower + upper)/2)
+    vals[np.isnan(sortedVals[starts + counts - 1])] = np.nan
+
+    return vals
+
+
+def sortWithinSegments(vals=[], counts=[]):
+
+    # sort the values within each segment of a grouped array
+    # (segments laid out one after another, of lengths 'counts')
+
+    segIds = np.repeat(np.arange(len(counts)), counts)
+    return vals[np.lexsort((vals, segIds))]
+
+
+def fillByAtom(atoms=[], atomVals=[], maxAtomNum=0,
+               dtype=np.float64, default=np.nan):
+
+    # spread per-atom values (one per atom in 'atoms') into an array
+    # indexed by atom number, large enough to hold atom 'maxAtomNum'
+
+    n = max(maxAtomNum, np.max(atoms) if len(atoms) != 0 else 0) + 1
+    arr = np.full(n, default, dtype=dtype)
+    arr[atoms] = atomVals
+    return arr
+
+
+def segmentedArgmin(vals=[], starts=[], counts=[]):
+
+    # the index (into 'vals') of the minimum of each segment of a
+    # grouped array, taking the first occurrence on ties and the
+    # first NaN if a segment contains any, as for np.argmin
+
+    mins = np.minimum.reduceat(vals, starts)
+    segMins = np.repeat(mins, counts)
+    isMin = np.where(np.isnan(segMins), np.isnan(vals), vals == segMins)
+    inds = np.where(isMin, np.arange(len(vals)), len(vals))
+    return np.minimum.reduceat(inds, starts)
+
+
+def shardSegments(counts=[], numShards=1):
+
+    # split the segments of a grouped array into (at most) numShards
+    # contiguous ranges of segments holding similar numbers of values,
+    # returned as the index of the first segment of each range
+    # followed by the total number of segments
+
+    cumCounts = np.cumsum(counts)
+    targets = cumCounts[-1]*np.arange(1, numShards)/numShards
+    bounds = np.searchsorted(cumCounts, targets, side='right')
+    return np.unique(np.concatenate(([0], bounds, [len(counts)])))
+
+
+def calcShardedMetrics(segmentMetrics=None, grouping=None, groupedVals=[],
+                       numThreads=1):
+
+    # apply a function calculating metrics per segment of a grouped
+    # array to contiguous shards of the segments (i.e. ranges of
+    # atom numbers) over a pool of threads, joining the per-segment
+    # results of the shards back together in order. As each segment
+    # is calculated on its own, the result is the same as for a
+    # single call over all segments. 'groupedVals' is a list of the
+    # grouped arrays that segmentMetrics takes as its first arguments
+
+    starts = grouping.starts
+    counts = grouping.counts
+
+    if numThreads <= 1 or len(counts) < 2*numThreads:
+        return segmentMetrics(*(groupedVals + [starts, counts]))
+
+    bounds = shardSegments(counts, numThreads)
+
+    def calcShard(i):
+        first, last = bounds[i], bounds[i+1]
+        offset = starts[first]
+        end = starts[last - 1] + counts[last - 1]
+        return segmentMetrics(*([v[offset:end] for v in groupedVals] +
+                                [starts[first:last] - offset,
+                                 counts[first:last]]))
+
+    with ThreadPoolExecutor(max_workers=numThreads) as pool:
+        shards = list(pool.map(calcShard, range(len(bounds) - 1)))
+
+    return {name: np.concatenate([shard[name] for shard in shards])
+            for name in shards[0]}
+
+
+def calcSegmentDensMetrics(vals=[], starts=[], counts=[]):
+
+    # the density metrics of each (non-empty) segment
+    # of a grouped array of voxel values
+
+    metrics = {}
+
+    mean = np.add.reduceat(vals, starts)/counts
+    dev = vals - np.repeat(mean, counts)
+    metrics['meandensity'] = mean
+    metrics['stddensity'] = np.sqrt(np.add.reduceat(dev*dev, starts)/counts)
+    metrics['mindensity'] = np.minimum.reduceat(vals, starts)
+    metrics['maxdensity'] = np.maximum.reduceat(vals, starts)
+
+    sortedVals = sortWithinSegments(vals, counts)
+    metrics['mediandensity'] = segmentedMedian(sortedVals, starts, counts)
+    for name, q in PERCENTILES:
+        metrics[name] = segmentedPercentile(sortedVals, starts, counts, q)
+
+    for name, sel in (('meanPosOnly', vals > 0), ('meanNegOnly', vals < 0)):
+        selCount = np.add.reduceat(sel.astype(np.int64), starts)
+        selSum = np.add.reduceat(np.where(sel, vals, 0), starts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            metrics[name] = np.where(selCount > 0, selSum/selCount, 0)
+
+    return metrics
+
+
+def calcSegmentFCMetrics(vals=[], FCvals=[], starts=[], counts=[]):
+
+    # the Fcalc-weighted density metrics of each (non-empty) segment
+    # of grouped arrays of voxel values and Fcalc map values
+
+    FCvals = np.clip(FCvals, 0, None)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        FCmax = np.maximum.reduceat(FCvals, starts)
+        weights = FCvals/np.repeat(FCmax, counts)
+        weighted = vals*weights
+
+        metrics = {
+            'densityWeightedMean': np.add.reduceat(weighted, starts)/counts,
+            'densityWeightedMin': np.minimum.reduceat(weighted, starts),
+            'densityWeightedMax': np.maximum.reduceat(weighted, starts),
+            'fracOfMaxAtomDensAtMin': weights[
+                segmentedArgmin(vals, starts, counts)]}
+
+        for name, sel in (('densityWeightedMeanPosOnly', weighted > 0),
+                          ('densityWeightedMeanNegOnly', weighted < 0)):
+            selCount = np.add.reduceat(sel.astype(np.int64), starts)
+            valsSum = np.add.reduceat(np.where(sel, weighted, 0), starts)
+            weightsSum = np.add.reduceat(np.where(sel, weights, 0), starts)
+            metrics[name] = np.where(selCount > 0, valsSum/weightsSum, 0)
+
+    return metrics
+
+
+def calcBatchDensMetrics(grouping=None, groupedVals=[], maxAtomNum=0,
+                         numThreads=1):
+
+    # calculate the per-atom density metrics of
+    # maps2DensMetrics.calcDensMetricsForAtom for every atom at once,
+    # using segmented reductions over a grouped array of voxel values
+    # (see voxelGrouping), optionally sharded by atom number over
+    # numThreads threads. Metrics are returned as arrays indexed by
+    # atom number. Atoms with no voxels are NaN, with numvoxels 0
+
+    atoms = grouping.atoms.astype(np.intp)
+
+    def fill(atomVals, dtype=np.float64, default=np.nan):
+        return fillByAtom(atoms, atomVals, maxAtomNum, dtype, default)
+
+    metrics = {'numvoxels': fill(grouping.counts, dtype=np.int64, default=0)}
+    if len(atoms) == 0:
+        for name in ['meandensity', 'mediandensity', 'mindensity',
+                     'maxdensity', 'stddensity', 'meanPosOnly',
+                     'meanNegOnly'] + [p[0] for p in PERCENTILES]:
+            metrics[name] = fill([])
+        return metrics
+
+    segMetrics = calcShardedMetrics(
+        segmentMetrics=calcSegmentDensMetrics, grouping=grouping,
+        groupedVals=[np.asarray(groupedVals, dtype=np.float64)],
+        numThreads=numThreads)
+
+    for name, vals in segMetrics.items():
+        metrics[name] = fill(vals)
+
+    return metrics
+
+
+def calcBatchFCMetrics(grouping=None, groupedVals=[], groupedFCvals=[],
+                       maxAtomNum=0, numThreads=1):
+
+    # calculate the Fcalc-weighted per-atom density metrics of
+    # maps2DensMetrics.calcFCMetricsForAtom for every atom at once,
+    # optionally sharded by atom number over numThreads threads.
+    # As there, Fcalc values are clipped at zero and normalised by
+    # the per-atom maximum to give a weight for each voxel. Metrics
+    # are returned as arrays indexed by atom number, NaN for atoms
+    # with no voxels
+
+    atoms = grouping.atoms.astype(np.intp)
+
+    if len(atoms) == 0:
+        return {name: fillByAtom(atoms, [], maxAtomNum)
+                for name in FC_METRICS}
+
+    segMetrics = calcShardedMetrics(
+        segmentMetrics=calcSegmentFCMetrics, grouping=grouping,
+        groupedVals=[np.asarray(groupedVals, dtype=np.float64),
+                     np.asarray(groupedFCvals, dtype=np.float64)],
+        numThreads=numThreads)
+
+    return {name: fillByAtom(atoms, vals, maxAtomNum)
+            for name, vals in segMetrics.items()}
@@ -0,0 +1,196 @@
+from scipy.optimize import curve_fit
+import numpy as np
+
+
+def decayModel(x=[], params=[], offset=0):
+
+    # exponential decay a*exp(-k*x) + c evaluated at doses 'x' for
+    # each row of 'params' (columns a, k and optionally c). If 'params'
+    # has no c column, the fixed end density 'offset' is used
+
+    params = np.atleast_2d(params)
+    c = params[:, 2:3] if params.shape[1] == 3 else offset
+    return params[:, 0:1]*np.exp(-params[:, 1:2]*x) + c
+
+
+def decayJacobian(x=[], params=[]):
+
+    # derivatives of decayModel with respect to each fitted parameter,
+    # as an array of shape (rows, doses, parameters)
+
+    decay = np.exp(-params[:, 1:2]*x)
+    derivs = [decay, -params[:, 0:1]*x*decay]
+    if params.shape[1] == 3:
+        derivs.append(np.ones_like(decay))
+    return np.stack(derivs, axis=2)
+
+
+def batchPinv(A=[]):
+
+    # pseudo-inverse of each matrix in the stack 'A', giving nans
+    # for any matrix with non-finite entries
+
+    inv = np.full(A.shape, np.nan)
+    finite = np.all(np.isfinite(A), axis=(1, 2))
+    if np.any(finite):
+        inv[finite] = np.linalg.pinv(A[finite])
+    return inv
+
+
+def fitDecays(x=[], y=[], initParams=[], offset=0, maxIter=200, tol=1e-10):
+
+    # Levenberg-Marquardt least-squares fit of decayModel to every row
+    # of 'y' (shape (atoms, doses)) at once. Each row has its own
+    # damping factor and stops once its sum of squared residuals no
+    # longer improves (relative to 'tol'). Returns the fitted
+    # parameters, sum of squared residuals and whether each row
+    # converged within 'maxIter' iterations
+
+    params = np.array(initParams, dtype=float)
+    numParams = params.shape[1]
+    damping = np.full(len(y), 1e-3)
+
+    with np.errstate(all='ignore'):
+        resid = decayModel(x, params, offset) - y
+        ssr = np.sum(resid**2, 1)
+
+    # rows that cannot be fitted (missing values or unusable
+    # initial guesses) are never marked as converged
+    active = np.isfinite(ssr) & np.all(np.isfinite(params), 1)
+    converged = active & (ssr == 0)
+
+    for i in range(maxIter):
+        rows = np.flatnonzero(active & ~converged)
+        if len(rows) == 0:
+            break
+
+        with np.errstate(all='ignore'):
+            jac = decayJacobian(x, params[rows])
+            JTJ = np.einsum('mni,mnj->mij', jac, jac)
+            grad = np.einsum('mni,mn->mi', jac, resid[rows])
+
+            # scale the diagonal by the damping factor (Marquardt)
+            A = JTJ.copy()
+            diag = np.arange(numParams)
+            A[:, diag, diag] *= 1 + damping[rows, None]
+
+            step = -np.einsum('mij,mj->mi', batchPinv(A), grad)
+            newParams = params[rows] + step
+            newResid = decayModel(x, newParams, offset) - y[rows]
+            newSsr = np.sum(newResid**2, 1)
+
+        better = newSsr < ssr[rows]
+        improvement = ssr[rows] - newSsr
+
+        # accept improving steps and relax the damping for those
+        # rows, otherwise increase the damping and try again
+        accepted = rows[better]
+        damping[accepted] /= 10
+        damping[rows[~better]] *= 10
+        converged[accepted] = improvement[better] <= tol*ssr[accepted]
+        params[accepted] = newParams[better]
+        resid[accepted] = newResid[better]
+        ssr[accepted] = newSsr[better]
+
+        # a row whose damping has grown this large is at a minimum if
+        # its gradient vanishes, and has otherwise stalled
+        stalled = rows[damping[rows] > 1e16]
+        if len(stalled) > 0:
+            stalledGrad = np.abs(grad[np.searchsorted(rows, stalled)])
+            atMinimum = np.all(stalledGrad <= tol*(1 + ssr[stalled, None]), 1)
+            converged[stalled[atMinimum]] = True
+            active[stalled[~atMinimum]] = False
+
+    return params, ssr, converged
+
+
+def fitDecayForAtom(x=[], y=[], initParams=[], offset=0):
+
+    # fall-back fit of decayModel to the values for a single atom with
+    # scipy.optimize.curve_fit. Returns the fitted parameters and sum
+    # of squared residuals, or None if the fit does not converge
+
+    if len(initParams) == 3:
+        func = lambda x, a, k, c: a*np.exp(-k*x) + c
+    else:
+        func = lambda x, a, k: a*np.exp(-k*x) + offset
+
+    try:
+        popt = curve_fit(func, x, y, initParams)[0]
+    except (RuntimeError, ValueError, TypeError):
+        return None
+
+    return popt, np.sum((func(x, *popt) - y)**2)
+
+
+def fitHalfDoses(doses=[], values=[], doseFraction=0.5,
+                 shiftedHalfDose=True, zeroOffset='y'):
+
+    # fit an exponential decay of density metric with dose for every
+    # atom at once (see halfDoseCalc for the single atom version).
+    # 'values' is an array of shape (atoms, datasets). 'zeroOffset' is
+    # 'y' to fit the end density, or a number for a fixed end density.
+    # If 'shiftedHalfDose' the half-dose is the dose for the density
+    # to reach doseFraction of the way from the initial density to
+    # the end density, otherwise the dose for the density to reach
+    # doseFraction of the initial density. Atoms whose fit does not
+    # converge are refitted individually. Returns a dictionary of
+    # arrays (one value per atom, nan where no fit was found)
+
+    x = np.asarray(doses, dtype=float)
+    y = np.atleast_2d(np.asarray(values, dtype=float))
+    fitOffset = zeroOffset == 'y'
+    offset = 0 if fitOffset else zeroOffset
+
+    # initial parameter guesses from the first two datasets
+    with np.errstate(all='ignore'):
+        a = y[:, 0]
+        k = (y[:, 1]-y[:, 0])/(a*(x[0]-x[1]))
+    initParams = [a, k] + ([np.zeros(len(y))] if fitOffset else [])
+    initParams = np.column_stack(initParams)
+
+    params, ssr, converged = fitDecays(
+        x=x, y=y, initParams=initParams, offset=offset)
+
+    # refit rows that did not converge (rows with missing
+    # values are not refitted, and have no fit)
+    failed = ~converged & np.all(np.isfinite(y), 1)
+    for i in np.flatnonzero(failed):
+        fit = fitDecayForAtom(x=x, y=y[i], initParams=initParams[i],
+                              offset=offset)
+        if fit is not None:
+            params[i], ssr[i] = fit
+            converged[i] = True
+    params[~converged] = np.nan
+    ssr[~converged] = np.nan
+
+    # parameter standard errors, from the covariance matrix estimated
+    # at the fitted parameters (as returned by curve_fit)
+    numParams = params.shape[1]
+    with np.errstate(all='ignore'):
+        jac = decayJacobian(x, params)
+        cov = batchPinv(np.einsum('mni,mnj->mij', jac, jac))
+        if len(x) > numParams:
+            cov *= (ssr/(len(x) - numParams))[:, None, None]
+        else:
+            cov[:] = np.inf
+        errors = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+
+        a, k = params[:, 0], params[:, 1]
+        c = params[:, 2] if fitOffset else np.where(
+            converged, float(offset), np.nan)
+
+        if shiftedHalfDose:
+            halfDose = -np.log(doseFraction)/k
+        else:
+            halfDose = -np.log(doseFraction*(1 - c/a))/k
+
+        certainty = np.prod(params/errors, 1)
+
+    return {'Half-dose': np.round(halfDose, 2),
+            'Residuals': ssr,
+            'Certainty': certainty,
+            'Initial density': a,
+            'End density': c,
+            'init decay rate': np.round(a*k, 2),
+            'converged': converged}
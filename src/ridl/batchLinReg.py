@@ -0,0 +1,61 @@
+from scipy import stats
+import numpy as np
+
+# small constant to avoid division by zero for perfect correlations,
+# as used by scipy.stats.linregress
+TINY = 1.0e-20
+
+
+def batchLinRegress(x=[], y=[]):
+
+    # least-squares linear regression of each row of 'y' (an array of
+    # shape (atoms, points)) against the common x values 'x', computed
+    # in closed form for all rows at once. Returns the slope,
+    # intercept, r value, two-sided p value and standard error of the
+    # slope for each row, as arrays, matching the values returned by
+    # scipy.stats.linregress per row. Rows containing nans (e.g. for
+    # atoms not present in all datasets) give nan results
+
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+
+    if x.size == 0 or y.size == 0:
+        raise ValueError('Inputs must not be empty.')
+    if np.amax(x) == np.amin(x) and len(x) > 1:
+        raise ValueError('Cannot calculate a linear regression ' +
+                         'if all x values are identical')
+
+    n = len(x)
+    xmean = np.mean(x)
+    ymean = np.mean(y, 1)
+    xdev = x - xmean
+    ydev = y - ymean[:, None]
+
+    ssxm = np.mean(xdev**2)
+    ssym = np.mean(ydev**2, 1)
+    ssxym = np.dot(ydev, xdev)/n
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.clip(ssxym/np.sqrt(ssxm*ssym), -1.0, 1.0)
+        degenerate = (ssym == 0.0) | (ssxm == 0.0)
+        r[degenerate] = np.where(ssxym[degenerate] == 0, np.nan, 0.0)
+
+        slope = ssxym/ssxm
+        intercept = ymean - slope*xmean
+
+        if n == 2:
+            prob = np.where(y[:, 0] == y[:, 1], 1.0, 0.0)
+            stderr = np.zeros(len(y))
+        else:
+            df = n - 2
+            t = r*np.sqrt(df/((1.0 - r + TINY)*(1.0 + r + TINY)))
+            prob = 2*stats.t.sf(np.abs(t), df)
+            stderr = np.sqrt((1 - r**2)*ssym/ssxm/df)
+
+    # as for scipy.stats.linregress, any nan input gives nan results
+    missing = np.isnan(y).any(1)
+    results = [slope, intercept, r, prob, stderr]
+    for result in results:
+        result[missing] = np.nan
+
+    return results
@@ -1,5 +1,7 @@
-from combinedAtomList import combinedAtomList
-from savevariables import retrieve_objectlist, save_objectlist
+from combinedAtomList import combinedAtomList, SING_DIM_ATTRS
+from combinedAtomList import MULTI_DIM_ATTRS, FC_MULTI_DIM_ATTRS
+from savevariables import retrieveAtomDataset, save_atomtable
+from savevariables import getAtomColumns, atomTable
 from savevariables import saveGenericObject
 from PDBFileManipulation import PDBtoList
 from mapsToDensityMetrics import maps2DensMetrics
@@ -28,7 +30,10 @@ class calculateMetrics(object):
                  inclFCmets=True, densMapList=[], atomMapList=[],
                  pdbFileList=[], FcMapList=[],
                  normSet=[['', 'CA']], RIDLinputFile='untitled.txt',
-                 sepPDBperDataset=False):
+                 sepPDBperDataset=False, compactMaps=False,
+                 verifyCompact=False, streamMaps=False, numProcesses=1,
+                 numThreads=1, prefetchMaps=True, writeCheckpoints=False,
+                 atomTagScale=100, slabQuantiles='exact'):
 
         # the input map file directory
         self.mapDir = mapDir
@@ -88,6 +93,47 @@ class calculateMetrics(object):
         # whether to use a separate pdb file for each datasets' atom map
         self.sepPDBperDataset = sepPDBperDataset
 
+        # whether to hold density map values in compact (float16) form
+        self.compactMaps = compactMaps
+
+        # whether to check compact map values (and atom numbers)
+        # against the full precision values read from each map
+        self.verifyCompact = verifyCompact
+
+        # whether to stream maps slab by slab rather than reading
+        # them into memory (for very large unit cells)
+        self.streamMaps = streamMaps
+
+        # when streaming maps, whether per-atom percentiles are 'exact'
+        # (memory scaling with the number of atom-tagged voxels) or
+        # estimated from a per-atom histogram 'sketch' (memory scaling
+        # with the number of atoms only, see slabDensAccumulator)
+        self.slabQuantiles = slabQuantiles
+
+        # number of worker processes over which to spread the
+        # density maps of the series (1 to process them in turn)
+        self.numProcesses = numProcesses
+
+        # number of threads over which to shard the atoms of
+        # a single dataset when calculating per-atom metrics
+        self.numThreads = numThreads
+
+        # whether to read the next density map in the background
+        # while metrics are calculated for the current dataset
+        self.prefetchMaps = prefetchMaps
+
+        # whether to write per-dataset atom table files to disk when
+        # post_processing follows map_processing in the same run (the
+        # per-dataset metrics are otherwise passed on in memory)
+        self.writeCheckpoints = writeCheckpoints
+
+        # factor by which atom numbers are scaled to give the voxel
+        # values of the atom-tagged maps (100 for SFALL maps)
+        self.atomTagScale = atomTagScale
+
+        # in-memory per-dataset atom tables from map_processing
+        self.datasetTables = []
+
         # if number of initial datasets given doesn't match
         # number of later datasets, assume same initial dataset
         # used for every later dataset (fix as first one given)
@@ -120,7 +166,8 @@ class calculateMetrics(object):
         self.setOutputDirs()
 
         if map_process:
-            self.map_processing()
+            self.map_processing(
+                saveToDisk=self.writeCheckpoints or not post_process)
         else:
             self.logFile.writeToLog(str='Map processing task not chosen...')
         self.fillerLine()
@@ -179,7 +226,8 @@ class calculateMetrics(object):
         if len(self.pklFiles) != 0:
             self.pklFiles = [self.pklFileDir+f for f in self.pklFiles]
 
-    def map_processing(self):
+    def map_processing(self,
+                       saveToDisk=True):
 
         # combine the density map and atom-tagged map for a given dataset,
         # to calculate per-atom density metrics for each refined atom
@@ -198,19 +246,50 @@ class calculateMetrics(object):
         self.makeOutputDir(dirName=self.outputDataDir)
         self.makeOutputDir(dirName=self.pklFileDir)
 
-        pklFileNames = []
+        self.pklFiles = []
+        self.datasetTables = []
 
         # set up the class to calculate metrics from maps
         maps2DensMets = maps2DensMetrics(
             filesIn=self.mapDir, filesOut=self.outputDataDir,
             pdbName=self.pdbFileList[0], atomTagMap=self.atomMapList[0],
-            logFile=self.logFile, calcFCmap=self.inclFCmets)
+            logFile=self.logFile, calcFCmap=self.inclFCmets,
+            compactDensity=self.compactMaps,
+            verifyCompact=self.verifyCompact, streamMaps=self.streamMaps,
+            slabQuantiles=self.slabQuantiles, numThreads=self.numThreads,
+            atomTagScale=self.atomTagScale)
 
         # only add Fcalc map if it exists. Note, will cause error if
         # FcMapList = [] but inclFCmets = True
         if self.inclFCmets:
             maps2DensMets.FCmapIn = self.FcMapList[0]
 
+        # the density maps can only be fanned out to worker processes
+        # (or read ahead in the background) when all datasets share
+        # the same atom-tagged map
+        sharedAtomMap = (len(self.densMapList) > 1 and
+                         not self.sepPDBperDataset and not self.streamMaps)
+        atomLists = None
+        if sharedAtomMap and self.numProcesses > 1:
+            atomLists = maps2DensMets.parallelMaps2atmdensity(
+                densMapList=self.densMapList, numProcesses=self.numProcesses)
+        elif sharedAtomMap and self.prefetchMaps:
+            atomLists = maps2DensMets.pipelinedMaps2atmdensity(
+                densMapList=self.densMapList)
+
+        if atomLists is not None:
+            # each dataset is logged as it starts, as below, since the
+            # next dataset is only processed once it is asked for
+            for i, densMapName in enumerate(self.densMapList):
+                self.logFile.writeToLog(
+                    str='\n---------------------------------\n' +
+                        'Higher dose dataset {} starts here'.format(i))
+                self.keepDataset(
+                    PDBarray=next(atomLists), densMapName=densMapName,
+                    saveToDisk=saveToDisk)
+            atomLists.close()
+            return
+
         for i in range(len(self.densMapList)):
 
             if i == 0:
@@ -234,18 +313,29 @@ class calculateMetrics(object):
 
             maps2DensMets.maps2atmdensity(mapsAlreadyRead)
 
-            # save list of atom objects to a .pkl file
-            tag = self.densMapList[i].replace('_density.map', '')
+            self.keepDataset(
+                PDBarray=maps2DensMets.PDBarray,
+                densMapName=self.densMapList[i], saveToDisk=saveToDisk)
+
+    def keepDataset(self,
+                    PDBarray=[], densMapName='', saveToDisk=True):
+
+        # keep the per-atom metrics for a dataset as an in-memory
+        # atom table (the atom objects themselves are reused for the
+        # next dataset), and optionally also save the table to file
 
-            pklFileName = save_objectlist(maps2DensMets.PDBarray, tag)
+        columns = getAtomColumns(PDBarray)
+        self.datasetTables.append(atomTable(columns=columns))
+
+        if saveToDisk:
+            tag = densMapName.replace('_density.map', '')
+
+            pklFileName = save_atomtable(PDBarray, tag, columns=columns)
 
             move(pklFileName,
                  '{}{}'.format(self.pklFileDir, pklFileName))
 
-            pklFileNames.append(
-                '{}{}'.format(self.pklFileDir, pklFileName))
-
-        self.pklFiles = pklFileNames
+            self.pklFiles.append('{}{}'.format(self.pklFileDir, pklFileName))
 
     def post_processing(self):
 
@@ -255,10 +345,12 @@ class calculateMetrics(object):
             str='Combining density metric information for each dataset ' +
                 'together within the damage series')
 
-        txt = 'Input pkl files for post processing chosen from input file:'
-        for file in self.pklFiles:
-            txt += '\n\t{}'.format(file.replace(self.outDir, ""))
-        self.logFile.writeToLog(str=txt)
+        if self.datasetTables == []:
+            txt = 'Input pkl files for post processing chosen from ' + \
+                  'input file:'
+            for file in self.pklFiles:
+                txt += '\n\t{}'.format(file.replace(self.outDir, ""))
+            self.logFile.writeToLog(str=txt)
 
         # next read in the pdb structure file as list of atom objects
         initialPDBlist = PDBtoList(pdbFileName=self.get1stDsetPDB())
@@ -267,18 +359,31 @@ class calculateMetrics(object):
         ln = '\nReading in pkl files for higher dataset structures...'
         self.logFile.writeToLog(str=ln)
 
-        dList = []
-        for pkl_filename in self.pklFiles:
-            ln = 'Damage file number: {}'.format(len(dList)+1)
-            self.logFile.writeToLog(str=ln)
-            PDB_ret = retrieve_objectlist(
-                fileName=pkl_filename, logFile=self.logFile)
-
-            # remove pkl file since no longer needed
-            remove(pkl_filename)
+        # only the attributes combined over the series are read
+        fields = SING_DIM_ATTRS + MULTI_DIM_ATTRS
+        if self.inclFCmets:
+            fields += FC_MULTI_DIM_ATTRS
 
-            # add new retrieved damage set list to dList
-            dList.append(PDB_ret)
+        dList = []
+        if self.datasetTables != []:
+            # metrics handed over in memory from map_processing. Any
+            # files also written by map_processing are kept as checkpoints
+            for table in self.datasetTables:
+                dList.append(table.toAtomList(fields=fields))
+            self.datasetTables = []
+        else:
+            for pkl_filename in self.pklFiles:
+                ln = 'Damage file number: {}'.format(len(dList)+1)
+                self.logFile.writeToLog(str=ln)
+                PDB_ret = retrieveAtomDataset(
+                    fileName=pkl_filename, fields=fields,
+                    logFile=self.logFile)
+
+                # remove pkl file since no longer needed
+                remove(pkl_filename)
+
+                # add new retrieved damage set list to dList
+                dList.append(PDB_ret)
 
         # create a list of atom objects with attributes as lists varying over
         # dose range, only including atoms present in ALL damage datasets
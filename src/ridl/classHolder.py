@@ -316,10 +316,56 @@ class MapInfo:
                         'mean': meandensity}
         self.vxls_val = vxls_val
 
+        # map rms deviation from mean density, byte order of the
+        # file ('<' little endian, '>' big endian) and the raw
+        # header record, as set by setHeaderInfo()
+        self.rms = 0
+        self.byteOrder = '<'
+        self.header = None
+
         # specify params for conversion from fractional
         # unit cell indices to xyz coordinates here
         # so not computed for each individual voxel
 
+    def setHeaderInfo(self,
+                      header=None, byteOrder='<'):
+
+        # fill map information from a structured header
+        # record (as decoded in mapHeader.readMapHeader)
+
+        self.header = header
+        self.byteOrder = byteOrder
+        self.type = int(header['mode'])
+
+        for key in ('nx', 'ny', 'nz'):
+            self.nxyz[key] = int(header[key])
+
+        for key, field in zip(('fast', 'med', 'slow'),
+                              ('nxstart', 'nystart', 'nzstart')):
+            self.start[key] = int(header[field])
+
+        for key, field in zip(('1', '2', '3'), ('mx', 'my', 'mz')):
+            self.gridsamp[key] = int(header[field])
+
+        for i, key in enumerate(('a', 'b', 'c', 'alpha', 'beta', 'gamma')):
+            self.celldims[key] = float(header['cell'][i])
+
+        for key, field in zip(('fast', 'med', 'slow'),
+                              ('mapc', 'mapr', 'maps')):
+            self.axis[key] = int(header[field])
+
+        for key, field in zip(('min', 'max', 'mean'),
+                              ('dmin', 'dmax', 'dmean')):
+            self.density[key] = float(header[field])
+
+        self.rms = float(header['rms'])
+
+    def getNumVoxels(self):
+
+        # total number of voxels within the map
+
+        return self.nxyz['nx']*self.nxyz['ny']*self.nxyz['nz']
+
     def curateSymOps(self,
                      strIn=''):
 
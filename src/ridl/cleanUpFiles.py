@@ -73,7 +73,8 @@ class cleanUpFinalFiles():
         # remove file if it is an 'atom-tagged' map
 
         if not self.keepAtomTagMap:
-            if fName.endswith('_atoms.map'):
+            if (fName.endswith('_atoms.map') or
+                    fName.endswith('_atoms_index.npz')):
                 os.remove(self.mapDir+fName)
 
     def removeDensityMap(self,
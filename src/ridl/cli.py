@@ -85,6 +85,13 @@ def main ():
                             'file is available to retrieve the data from ' +
                             'this step.')
 
+    parser.add_argument('--convert_pkl',
+                        type=str, dest='convertPklFiles', nargs='+',
+                        metavar='PKLFILE', default=[],
+                        help='Convert per-dataset _data.pkl files from an ' +
+                            'earlier RIDL run into the columnar atom table ' +
+                            'format, written alongside each .pkl file.')
+
     parser.add_argument('-s',
                         dest='suppressOutput', action='store_const',
                         default=True, const=False,
@@ -111,6 +118,12 @@ def main ():
     # these are here so that they don't interfere with dependency checks
     from .rigidBodyRefine import reRefine
     from .runRIDL_class import process
+    from .savevariables import convertPklToAtomTable
+
+    # convert per-dataset .pkl files to columnar atom tables
+    for pklFile in args.convertPklFiles:
+        print('Converted {} to {}'.format(
+            pklFile, convertPklToAtomTable(fileName=pklFile)))
 
     # create a template input file to be filled in manually by the user
     if args.template != 0:
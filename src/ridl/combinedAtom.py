@@ -1,7 +1,14 @@
 from classHolder import StructurePDB
+from metricStore import metricStore, metricInfo, shareMetricStore
 from scipy import stats
 import numpy as np
 
+# metrics for which larger negative difference map peaks give more
+# negative values, and so are multiplied by -1 (see getDensMetricInfo)
+SIGN_CHANGE_METRICS = ['loss', 'mean-negOnly',
+                       'density_weighted_mean_negOnly',
+                       'density_weighted_loss']
+
 
 class combinedAtom(StructurePDB):
 
@@ -18,8 +25,22 @@ class combinedAtom(StructurePDB):
                                            basetype, chaintype, X_coord,
                                            Y_coord, Z_coord, atomID)
 
-        # dictionary of density metrics to be filled
+        # dictionary of density metrics to be filled. The metric
+        # values are held in row 'row' of a metricStore, which is
+        # shared by all atoms of a combinedAtomList
         self.densMetric = {}
+        self.store = metricStore(numAtoms=1)
+        self.row = 0
+
+    def __setstate__(self, state):
+
+        # atoms pickled before the metricStore was introduced hold
+        # their metric values within plain nested dicts, which are
+        # moved into a store of their own once loaded
+
+        self.__dict__.update(state)
+        if 'store' not in state:
+            shareMetricStore(atoms=[self])
 
     def getPresentDatasets(self):
 
@@ -47,19 +68,26 @@ class combinedAtom(StructurePDB):
         # map peaks, however these are multipled by -1, such that
         # higher positive Dloss values indicate a larger negative
         # difference map peak
-        needSignChange = ['loss', 'mean-negOnly',
-                          'density_weighted_mean_negOnly',
-                          'density_weighted_loss']
-        if metric in needSignChange and normType == 'Standard':
-            values = list(-np.array(values))
+        if metric in SIGN_CHANGE_METRICS and normType == 'Standard':
+            values = -np.array(values)
+
+        self.addStoredMetric(metric=metric, normType=normType)
+        self.densMetric[metric][normType]['values'] = values
+
+    def addStoredMetric(self,
+                        metric='loss', normType='Standard'):
+
+        # add an (empty) entry to the dictionary of density metrics,
+        # whose values are those held for this atom in the metricStore
 
         try:
             self.densMetric[metric]
         except KeyError:
             self.densMetric[metric] = {}
 
-        self.densMetric[metric][normType] = {}
-        self.densMetric[metric][normType]['values'] = values
+        self.densMetric[metric][normType] = metricInfo(
+            store=self.store, row=self.row, metric=metric, normType=normType)
+        self.store.changed()
 
     def calcAvMetric(self,
                      type='Standard', densMetric='loss'):
@@ -199,13 +227,10 @@ class combinedAtom(StructurePDB):
         # is a net loss, gain or disordering of density associated
         # with a specific atom
 
-        self.getDensMetricInfo(metric='net', normType=normType, values=[])
-
-        for d in range(0, self.getNumDatasets()):
-            absMaxLoss = np.abs(self.densMetric['loss'][normType]['values'][d])
-            absMaxGain = np.abs(self.densMetric['gain'][normType]['values'][d])
-            metricVal = (absMaxLoss - absMaxGain)
-            self.densMetric['net'][normType]['values'].append(metricVal)
+        absMaxLoss = np.abs(self.densMetric['loss'][normType]['values'])
+        absMaxGain = np.abs(self.densMetric['gain'][normType]['values'])
+        self.getDensMetricInfo(metric='net', normType=normType,
+                               values=absMaxLoss - absMaxGain)
 
     def calcVectorWeightedMetric(self,
                                  metric='loss', normType='Standard',
@@ -4,12 +4,20 @@ from bioInfo import bioInfo
 from PDBFileManipulation import writePDBline_DamSite
 from matplotlib.gridspec import GridSpec
 from findMetricChange import findBchange
-from combinedAtom import combinedAtom
+from combinedAtom import combinedAtom, SIGN_CHANGE_METRICS
+from metricStore import metricStore, stackMetricValues, shareMetricStore
+from batchLinReg import batchLinRegress
+from batchHalfDose import fitHalfDoses
+from atomSpatialIndex import atomSpatialIndex, nearestAtoms
+from atomLookup import atomLookup, trackedList
+from groupStats import groupStats
+from atomRanking import rankTopN
 from metricNormalisation import metricNormalisation
 from pandas import DataFrame
 import string
 from scipy.stats import ttest_ind, skew, kurtosis, mstats, ks_2samp
 from scipy.stats import linregress, f, anderson_ksamp
+from collections import deque
 import numpy as np
 import operator
 import os
@@ -18,6 +26,34 @@ import sys
 import warnings
 warnings.filterwarnings('ignore')
 
+# per-atom attributes combined over datasets by getMultiDoseAtomList:
+# those fixed for an atom, those that vary with dose and those that
+# vary with dose and are only present when Fcalc maps were used
+SING_DIM_ATTRS = ['atomnum', 'residuenum', 'atomtype', 'basetype',
+                  'chaintype', 'X_coord', 'Y_coord', 'Z_coord']
+
+MULTI_DIM_ATTRS = ['Bfactor', 'Occupancy', 'meandensity', 'maxdensity',
+                   'mindensity', 'mediandensity', 'numvoxels',
+                   'stddensity', 'min90tile', 'max90tile', 'min95tile',
+                   'max95tile', 'meanNegOnly', 'meanPosOnly']
+
+FC_MULTI_DIM_ATTRS = ['fracOfMaxAtomDensAtMin', 'densityWeightedMean',
+                      'densityWeightedMin', 'densityWeightedMax',
+                      'densityWeightedMeanNegOnly',
+                      'densityWeightedMeanPosOnly']
+
+
+def gatherDatasetValues(dataset=[], attr='Bfactor', indices=[]):
+
+    # get the values of an attribute for the atoms of a dataset at
+    # positions 'indices', with nan where an index is -1 (for an
+    # atom that is not present in the dataset)
+
+    vals = np.array([getattr(atom, attr) for atom in dataset])
+    if np.any(indices == -1):
+        vals = np.append(vals.astype(float), np.nan)
+    return vals[indices]
+
 
 class combinedAtomList(object):
 
@@ -59,6 +95,27 @@ class combinedAtomList(object):
         bInfo = bioInfo()
         self.aminoAcids = bInfo.getAminoAcids()
 
+    def __setstate__(self, state):
+
+        # atom lists pickled before the metricStore was introduced
+        # have no store. Once loaded, the metric values of their
+        # atoms are moved into a single store shared by all atoms,
+        # as made by getMultiDoseAtomList
+
+        self.__dict__.update(state)
+        if 'store' in state or 'atomList' not in state:
+            return
+
+        self.atomList = state['atomList']
+        self.store = shareMetricStore(atoms=self.atomList,
+                                      numDatasets=len(self.doseList))
+        for attr in SING_DIM_ATTRS:
+            self.store.setColumn(
+                name=attr,
+                vals=[getattr(atom, attr) for atom in self.atomList])
+        self.store.setColumn(
+            name='atomID', vals=[atom.getAtomID() for atom in self.atomList])
+
     def getMultiDoseAtomList(self,
                              logFile=''):
 
@@ -93,84 +150,74 @@ class combinedAtomList(object):
         self.printOrWriteToLog(
             logFile=logFile, txt='Locating common atoms to ALL datasets...:')
 
-        singDimAttrs = ['atomnum', 'residuenum', 'atomtype', 'basetype',
-                        'chaintype', 'X_coord', 'Y_coord', 'Z_coord']
-
-        multiDimAttrs = ['Bfactor', 'Occupancy', 'meandensity', 'maxdensity',
-                         'mindensity', 'mediandensity', 'numvoxels',
-                         'stddensity', 'min90tile', 'max90tile', 'min95tile',
-                         'max95tile', 'meanNegOnly', 'meanPosOnly']
+        singDimAttrs = list(SING_DIM_ATTRS)
+        multiDimAttrs = list(MULTI_DIM_ATTRS)
 
         if self.inclFCderivedMetrics:
-            extraMetrics = ['fracOfMaxAtomDensAtMin', 'densityWeightedMean',
-                            'densityWeightedMin', 'densityWeightedMax',
-                            'densityWeightedMeanNegOnly',
-                            'densityWeightedMeanPosOnly']
-
-            for w in extraMetrics:
-                multiDimAttrs.append(w)
-
-        for atom in self.datasetList[0]:
-            atm_counter = 1
-            atomDict = {attr: getattr(atom, attr) for attr in singDimAttrs}.copy()
-            atomDict.update({attr: [getattr(atom, attr)] for attr in multiDimAttrs})
-
-            # list of index of same atom in each later dataset
-            indexindataset = []
-
-            # check whether atom in all datasets:
-            for dataset in self.datasetList[1:]:
-                found = False
-                k = -1
-                for otheratom in dataset:
-                    k += 1
-                    if atom.getAtomID() == otheratom.getAtomID():
-                        atm_counter += 1
-                        for attr in multiDimAttrs:
-                            atomDict[attr].append(getattr(otheratom, attr))
-                        indexindataset.append(k)
-                        found = True
-                        break
-                if not found:
-                    # if atom not in dataset, add dummy value
-                    indexindataset.append(-1)
-                    for attr in multiDimAttrs:
-                        atomDict[attr].append(np.nan)
-
-            # remove this located atom from the later dataset now
-            # that it has been located --> to make loop faster
-            for j in range(1, len(indexindataset)+1):
-                if indexindataset[j-1] != -1:
-                    self.datasetList[j].pop(indexindataset[j-1])
-
-            if atm_counter != len(self.datasetList) and not self.partialDatasets:
+            multiDimAttrs += FC_MULTI_DIM_ATTRS
+
+        # index of each atom of the first dataset within every dataset
+        # (-1 if absent), and the number of datasets containing each
+        atomIndices = self.matchAtomsAcrossDatasets()
+        atomCounts = np.count_nonzero(atomIndices != -1, axis=1)
+
+        # atoms of the first dataset to include in the atom list
+        included = []
+        for i, atom in enumerate(self.datasetList[0]):
+            if atomCounts[i] == len(self.datasetList):
+                included.append(i)
+                continue
+
+            numNotFoundAtoms += 1
+            if not self.partialDatasets:
                 self.printOrWriteToLog(
                     logFile=logFile,
                     txt='Atom "{}" not found in all'.format(atom.getAtomID()) +
                         ' datasets\n---> not including atom in atom list...')
-                numNotFoundAtoms += 1
-                continue
-
             else:
-                newatom = combinedAtom()
-                for attr in singDimAttrs+multiDimAttrs:
-                    if attr[0] != '_':
-                        if not isinstance(atomDict[attr], list):
-                            setattr(newatom, attr, atomDict[attr])
-                        else:
-                            metName = self.findMetricName(attr)
-                            newatom.getDensMetricInfo(
-                                metric=metName, normType='Standard',
-                                values=atomDict[attr])
-
-                if atm_counter != len(self.datasetList):
-                    self.printOrWriteToLog(
-                        logFile=logFile,
-                        txt='Atom "{}" not found in'.format(atom.getAtomID()) +
-                            ' all datasets\n---> including partial ' +
-                            'information in atom list...')
-                    numNotFoundAtoms += 1
-                PDBdoses.append(newatom)
+                self.printOrWriteToLog(
+                    logFile=logFile,
+                    txt='Atom "{}" not found in'.format(atom.getAtomID()) +
+                        ' all datasets\n---> including partial ' +
+                        'information in atom list...')
+                included.append(i)
+
+        atomIndices = atomIndices[included]
+        firstDataset = [self.datasetList[0][i] for i in included]
+
+        # the metric values of all included atoms are held in a single
+        # store (see metricStore class), filled an attribute at a time.
+        # If an atom is not in a dataset, a dummy (nan) value is added
+        self.store = metricStore(numAtoms=len(firstDataset),
+                                 numDatasets=len(self.datasetList))
+
+        for attr in singDimAttrs:
+            self.store.setColumn(
+                name=attr, vals=[getattr(atom, attr) for atom in firstDataset])
+        self.store.setColumn(
+            name='atomID', vals=[atom.getAtomID() for atom in firstDataset])
+
+        for attr in multiDimAttrs:
+            vals = np.column_stack(
+                [gatherDatasetValues(dataset=dataset, attr=attr,
+                                     indices=atomIndices[:, j])
+                 for j, dataset in enumerate(self.datasetList)])
+            metName = self.findMetricName(attr)
+            if metName in SIGN_CHANGE_METRICS:
+                vals = -vals
+            self.store.setValues(metric=metName, normType='Standard', vals=vals)
+
+        for row, atom in enumerate(firstDataset):
+            newatom = combinedAtom()
+            for attr in singDimAttrs:
+                setattr(newatom, attr, getattr(atom, attr))
+
+            newatom.store = self.store
+            newatom.row = row
+            for attr in multiDimAttrs:
+                newatom.addStoredMetric(
+                    metric=self.findMetricName(attr), normType='Standard')
+            PDBdoses.append(newatom)
 
         if self.partialDatasets:
             self.printOrWriteToLog(
@@ -186,6 +233,31 @@ class combinedAtomList(object):
 
         self.atomList = PDBdoses
 
+    def matchAtomsAcrossDatasets(self):
+
+        # for each atom of the first dataset, find the index of the
+        # same atom (by atom ID) within each dataset, or -1 where the
+        # atom is not present. Each dataset is keyed by atom ID once.
+        # If an atom ID is repeated, repeats are matched in order
+
+        firstDataset = self.datasetList[0]
+        atomIndices = np.full((len(firstDataset), len(self.datasetList)),
+                              -1, dtype=int)
+        atomIndices[:, 0] = np.arange(len(firstDataset))
+
+        atomIDs = [atom.getAtomID() for atom in firstDataset]
+        for j, dataset in enumerate(self.datasetList[1:], 1):
+            positions = {}
+            for k, otheratom in enumerate(dataset):
+                positions.setdefault(otheratom.getAtomID(), deque()).append(k)
+
+            for i, atomID in enumerate(atomIDs):
+                found = positions.get(atomID)
+                if found:
+                    atomIndices[i, j] = found.popleft()
+
+        return atomIndices
+
     def printOrWriteToLog(self, logFile='', txt=''):
 
         # print to command line or write to log file
@@ -237,23 +309,131 @@ class combinedAtomList(object):
 
         # get structure-wide average of selected density metric
 
-        densList = [atom.densMetric[densMet][normType]['values'] for atom in self.atomList]
-        densMean = np.nanmean(densList, 0)
-        densStd = np.nanstd(densList, 0)
-        return densMean, densStd
+        def calcAverage():
+            densList = self.getMetricValues(metric=densMet, normType=normType)
+            densMean = np.nanmean(densList, 0)
+            densStd = np.nanstd(densList, 0)
+
+            # the cached arrays are shared by all callers
+            densMean.setflags(write=False)
+            densStd.setflags(write=False)
+            return densMean, densStd
+
+        return self.getCachedStat(
+            key=('average', densMet, normType), calcFunc=calcAverage)
+
+    def getStatsCacheToken(self):
+
+        # the state of the atom list and metric store that cached
+        # statistics were computed from (None if there is no store)
+
+        try:
+            storeVersion = self.store.version
+        except AttributeError:
+            return None
+        return (storeVersion, id(self.atomList),
+                getattr(self.atomList, 'version', 0))
+
+    def getCachedStat(self,
+                      key=(), calcFunc=None):
+
+        # get a statistic (identified by 'key', e.g. a tuple of the
+        # method name, metric, normType and dataset) from the cache of
+        # statistics, calculating it with 'calcFunc' if not yet held.
+        # The cache is emptied whenever the metric store or atom list
+        # has changed since its statistics were calculated, for
+        # example once a metric is added or calcAdditionalMetrics
+        # has written new values
+
+        token = self.getStatsCacheToken()
+        try:
+            if self.statsCacheToken != token:
+                self.statsCache = {}
+                self.statsCacheToken = token
+        except AttributeError:
+            self.clearStatsCache()
+
+        if token is not None and key in self.statsCache:
+            self.statsCacheHits += 1
+            return self.statsCache[key]
+
+        self.statsCacheMisses += 1
+        stat = calcFunc()
+        if token is None:
+            return stat
+
+        # 'calcFunc' may itself have written metric values, in which
+        # case all other cached statistics are out of date
+        newToken = self.getStatsCacheToken()
+        if newToken != token:
+            self.statsCache = {}
+            self.statsCacheToken = newToken
+        self.statsCache[key] = stat
+        return stat
+
+    def clearStatsCache(self):
+
+        # empty the cache of statistics and reset its hit/miss counters
+
+        self.statsCache = {}
+        self.statsCacheToken = self.getStatsCacheToken()
+        self.statsCacheHits = 0
+        self.statsCacheMisses = 0
+
+    def getStatsCacheInfo(self):
+
+        # the number of cache hits, misses and cached statistics
+
+        try:
+            return {'hits': self.statsCacheHits,
+                    'misses': self.statsCacheMisses,
+                    'size': len(self.statsCache)}
+        except AttributeError:
+            return {'hits': 0, 'misses': 0, 'size': 0}
+
+    def getMetricValues(self,
+                        metric='loss', normType='Standard'):
+
+        # get the values of a metric for all atoms in the atom list,
+        # as an array of shape (atoms, datasets) in atom list order
+
+        return stackMetricValues(
+            atoms=self.atomList, metric=metric, normType=normType)
+
+    @property
+    def atomList(self):
+        return self.__dict__['atomList']
+
+    @atomList.setter
+    def atomList(self, atoms):
+
+        # the atom list is held as a trackedList, so that indices over
+        # it (see getAtomLookup and getSpatialIndex) are rebuilt once
+        # it is changed
+
+        self.__dict__['atomList'] = trackedList(atoms)
+
+    def getAtomLookup(self):
+
+        # get the index of the atoms by chain, residue and atom type
+        # (see atomLookup class), built on first use and rebuilt if
+        # the atom list has since been changed
+
+        try:
+            if self.lookupIndex.isCurrent(self.atomList):
+                return self.lookupIndex
+        except AttributeError:
+            pass
+        self.lookupIndex = atomLookup(self.atomList)
+        return self.lookupIndex
 
     def getAtom(self, chain='', restype='', resnum='',
                 atomtype='', printOutput=False):
 
         # get atom(s) matching specified description if found
 
-        foundAtoms = []
-        for atom in self.atomList:
-            if atom.chaintype == chain or chain == '':
-                if atom.residuenum == resnum or resnum == '':
-                    if atom.basetype == restype or restype == '':
-                        if atom.atomtype == atomtype or atomtype == '':
-                            foundAtoms.append(atom)
+        foundAtoms = self.getAtomLookup().find(
+            chain=chain, restype=restype, resnum=resnum, atomtype=atomtype)
         if len(foundAtoms) != 0:
             if printOutput:
                 print('Found {} atom(s) matching description'.format(
@@ -404,52 +584,89 @@ class combinedAtomList(object):
                     self.atomList, normaliseTo=normalisationSet)
             self.metricNormWeights.calculateWeights(metric)
 
-        if newMetric == 'standardised':
-            data = [atm.densMetric[metric]['Standard']['values'] for atm in self.atomList]
+        # the new metric is calculated for all atoms at once, from the
+        # (atoms, datasets) array of values of the metric it derives from
+        if newMetric in ('Calpha normalised', 'X-normalised'):
+            try:
+                weight1 = self.metricNormWeights.meanweight[metric]
+                weight2 = self.metricNormWeights.stdweight[metric]
+            except (AttributeError, KeyError):
+                print('Normalisation weights not yet calculated for metric' +
+                      ' "{}"\n'.format(metric))
+                return
+            metVals = self.getMetricValues(metric=metric, normType='Standard')
+            self.setMetricValues(
+                metric=metric, normType=newMetric,
+                vals=np.sign(weight1)*np.divide(metVals-weight1, weight2))
+
+        elif newMetric == 'lin reg':
+            # regression over the first numLigRegDatasets-1 datasets,
+            # for all atoms at once (see combinedAtom.calcLinReg)
+            x = np.array(range(2, self.numLigRegDatasets+1))
+            y = self.getMetricValues(metric=metric, normType='Standard')
+            if y.shape[1] == 0:
+                return
+            linRegRslts = batchLinRegress(x=x, y=y[:, 0:len(x)])
+
+            statsLbls = ['slope', 'intercept', 'r_squared',
+                         'p_value', 'std_err']
+            for i, atom in enumerate(self.atomList):
+                atom.densMetric[metric]['Standard']['lin reg'] = {
+                    v1: v2[i] for v1, v2 in zip(statsLbls, linRegRslts)}
+
+        elif newMetric == 'net':
+            absMaxLoss = np.abs(self.getMetricValues(metric='loss'))
+            absMaxGain = np.abs(self.getMetricValues(metric='gain'))
+            self.setMetricValues(metric='net', normType='Standard',
+                                 vals=absMaxLoss - absMaxGain)
+
+        elif newMetric == 'dataset 1 subtracted':
+            mVals = self.getMetricValues(metric=metric, normType='Standard')
+            self.setMetricValues(metric=metric, normType=newMetric,
+                                 vals=mVals - mVals[:, :1])
+
+        elif newMetric == 'average':
+            densVals = self.getMetricValues(metric=metric, normType=normType)
+            averages = np.nanmean(densVals, 1)
+            for atom, average in zip(self.atomList, averages):
+                atom.densMetric[metric][normType]['average'] = average
+
+        elif newMetric in ('vector weighted', 'vector subtracted'):
+            metricVals = self.getMetricValues(
+                metric=metric, normType='Standard')
+            if len(vector) != metricVals.shape[1]:
+                print('Incompatible metric and per-dataset ' +
+                      'scale vector lengths')
+                return
+            if newMetric == 'vector weighted':
+                self.setMetricValues(
+                    metric=metric, normType='vector-weighted',
+                    vals=metricVals/np.array(vector))
+            else:
+                self.setMetricValues(
+                    metric=metric, normType='vector-subtracted',
+                    vals=metricVals - np.array(vector))
+
+        elif newMetric == 'Standardised':
+            data = self.getMetricValues(metric=metric, normType='Standard')
             meand = np.nanmean(data, 0)
             stdd = np.nanstd(data, 0)
+            self.setMetricValues(metric=metric, normType=newMetric,
+                                 vals=(data-meand)/stdd)
 
-        # loop over all atoms in list and calculate additional
-        # metrics for each atom in atomList
-        for atom in self.atomList:
-
-            if newMetric == 'Calpha normalised':
-                atom.calcNormalisedMetric(
-                    normWeights=self.metricNormWeights, metric=metric,
-                    normSet='Calpha')
-
-            if newMetric in 'X-normalised':
-                atom.calcNormalisedMetric(
-                    normWeights=self.metricNormWeights, metric=metric,
-                    normSet='Custom')
-
-            elif newMetric == 'lin reg':
-                atom.calcLinReg(
-                    numLinRegDsets=self.numLigRegDatasets,
-                    normType='Standard', metric=metric)
-
-            elif newMetric == 'net':
-                atom.calcNetChangeMetric(normType='Standard')
+    def setMetricValues(self,
+                        metric='loss', normType='Standard', vals=[]):
 
-            elif newMetric == 'dataset 1 subtracted':
-                atom.calcFirstDatasetSubtractedMetric(
-                    normType='Standard', metric=metric)
+        # set the values of a metric for all atoms in the atom list at
+        # once. 'vals' is an array of shape (atoms, datasets) in atom
+        # list order. No sign change is applied to the values here
+        # (see combinedAtom.getDensMetricInfo)
 
-            elif newMetric == 'average':
-                atom.calcAvMetric(normType, metric)
-
-            elif newMetric == 'vector weighted':
-                atom.calcVectorWeightedMetric(
-                    metric=metric, normType='Standard', vector=vector)
-
-            elif newMetric == 'vector subtracted':
-                atom.calcVectorSubtractedMetric(
-                    metric=metric, normType='Standard', vector=vector)
-
-            elif newMetric == 'Standardised':
-                atom.calcStandardisedMetric(
-                    metric=metric, normType='Standard',
-                    meanOfDistn=meand, stdOfDistn=stdd)
+        rows = [atom.row for atom in self.atomList]
+        self.store.setValues(metric=metric, normType=normType,
+                             vals=vals, rows=rows)
+        for atom in self.atomList:
+            atom.addStoredMetric(metric=metric, normType=normType)
 
     def writeMetric2File(self,
                          where='./', groupBy='none', metric='loss',
@@ -484,36 +701,31 @@ class combinedAtomList(object):
 
         # retrieve metric stats depending on groupBy
         if groupBy != 'none':
-            # create dictionary for stats over datasets
-            if groupBy == 'atomtype':
-                TypeDic = self.groupByAtmType()
-            elif groupBy == 'residue':
-                TypeDic = self.groupByResType()
-            statDic = {k: [] for k in list(TypeDic.keys())}
-
-            for d in range(metricLength):
-                if groupBy == 'atomtype':
-                    a, b = self.getPerAtmtypeStats(
-                        metric=metric, normType=normType, dataset=d, n=1)
-                elif groupBy == 'residue':
-                    a, b = self.getPerResidueStats(
-                        metric=metric, normType=normType, dataset=d, n=1)
-                for key in list(b.keys()):
-                    statDic[key].append(b[key]['mean'])
-                    statDic[key].append(b[key]['std'])
-
-            for i, k in enumerate(statDic.keys()):
-                roundedVals = [round(v, numDP) for v in statDic[k]]
+            # stats for every group and dataset, with nan for any
+            # group that has no atoms within a dataset
+            stats = self.getGroupStats(
+                metric=metric, normType=normType, groupBy=groupBy)
+
+            means = stats.getStatArray(stat='mean')
+            stds = stats.getStatArray(stat='std')
+
+            for i, k in enumerate(stats.groups):
+                statVals = np.column_stack([means[i], stds[i]]).ravel()
+                roundedVals = [round(v, numDP) for v in statVals]
                 csvfile.write(
                     '{},{},{}\n'.format(i, k, ','.join(map(str, roundedVals))))
         else:
-            # sort atom list by atom number or damage metric
+            # order atoms by atom number or damage metric (atoms
+            # with no value in the first dataset are written last),
+            # without reordering the atom list itself
             if sortby == 'atomnum':
-                self.atomList.sort(key=lambda x: x.atomnum)
+                order = np.argsort([atom.atomnum for atom in self.atomList],
+                                   kind='stable')
             else:
-                self.atomList.sort(
-                    key=lambda x: x.densMetric[metric][normType]['values'][0], reverse=True)
-            for atom in self.atomList:
+                vals = self.getMetricValues(metric=metric, normType=normType)
+                order = rankTopN(vals=vals[:, 0], n='all')[0]
+                order = np.append(order, np.flatnonzero(np.isnan(vals[:, 0])))
+            for atom in [self.atomList[i] for i in order]:
                 csvfile.write('{},{},'.format(atom.atomnum, atom.getAtomID()))
                 roundedVals = [round(v, numDP) for v in atom.densMetric[metric][normType]['values']]
                 csvfile.write(','.join(map(str, roundedVals)))
@@ -875,47 +1087,88 @@ class combinedAtomList(object):
 
     def getTopNAtoms(self,
                      metric='loss', normType='Standard',
-                     dataset=0, n=25, topOrBot='top'):
+                     dataset=0, n=25, topOrBot='top',
+                     residues=[], atomtypes=[], keepTies=False):
 
         # for a given metric type, determine top
         # n damage sites. 'n' is integer or 'all'.
-
-        # decide whether to take top or least damaged atoms
-        if topOrBot == 'top':
-            r = True
-        else:
-            r = False
+        # For dataset='all', the atom IDs of the top atoms over all
+        # datasets are returned instead. See getTopNAtomIndices for
+        # the remaining inputs. The ranking is cached (see
+        # getCachedStat) and the atom list is not reordered
+
+        topN = self.getCachedStat(
+            key=('topN', metric, normType, dataset, n, topOrBot,
+                 tuple(residues), tuple(atomtypes), keepTies),
+            calcFunc=lambda: self.calcTopNAtoms(
+                metric=metric, normType=normType, dataset=dataset,
+                n=n, topOrBot=topOrBot, residues=residues,
+                atomtypes=atomtypes, keepTies=keepTies))
+        return list(topN)
+
+    def calcTopNAtoms(self,
+                      metric='loss', normType='Standard',
+                      dataset=0, n=25, topOrBot='top',
+                      residues=[], atomtypes=[], keepTies=False):
+
+        # calculate the ranking for getTopNAtoms
 
         if dataset != 'all':
-            atomList = self.getAtomListWithoutPartialAtoms(dataset=dataset)
-            atomList.sort(key=lambda x: x.densMetric[metric][normType]['values'][dataset], reverse=r)
-
-            if n != 'all':
-                return atomList[:int(n)]
-            else:
-                return atomList
-
-        else:
-            # rank with respect to all datasets
-            ranks = {}
-            for d in self.getDsetList():
-
-                atomList = self.getAtomListWithoutPartialAtoms(dataset=d)
-                atomList.sort(key=lambda x: x.densMetric[metric][normType]['values'][d], reverse=False)
+            topInds = self.getTopNAtomIndices(
+                metric=metric, normType=normType, datasets=[dataset],
+                n=n, topOrBot=topOrBot, residues=residues,
+                atomtypes=atomtypes, keepTies=keepTies)[dataset]
+            return [self.atomList[i] for i in topInds]
+
+        # rank with respect to all datasets, by the product of the
+        # (ascending) rank of each atom within each dataset in which
+        # it is present. Atoms not present in the first dataset are
+        # not ranked, and equal products are ordered by first dataset
+        ascending = self.getTopNAtomIndices(
+            metric=metric, normType=normType, n='all', topOrBot='bottom',
+            residues=residues, atomtypes=atomtypes)
+
+        ranks = np.ones(self.getNumAtoms())
+        for d in self.getDsetList():
+            ranks[ascending[d]] *= np.arange(1, len(ascending[d])+1)
 
-                for i, atom in enumerate(atomList):
-                    if d == 0:
-                        ranks[atom.getAtomID()] = [i+1]
-                    else:
-                        ranks[atom.getAtomID()].append(i+1)
+        order = ascending[0]
+        top = rankTopN(vals=ranks[order], n=n, largest=topOrBot == 'top',
+                       keepTies=keepTies)[0]
+        return [self.atomList[i].getAtomID() for i in order[top]]
 
-            overallRank = {}
-            for k in list(ranks.keys()):
-                overallRank[k] = np.product(list(map(float, ranks[k])))
+    def getTopNAtomIndices(self,
+                           metric='loss', normType='Standard',
+                           datasets='all', n=25, topOrBot='top',
+                           residues=[], atomtypes=[], keepTies=False):
+
+        # for each dataset in 'datasets' (a list, or 'all'), get the
+        # positions within the atom list of the top (or bottom, if
+        # topOrBot='bottom') n atoms for a given metric, best first.
+        # Only atoms present within a dataset (and with a metric value)
+        # are ranked, optionally only those with residue types in
+        # 'residues' and atom types in 'atomtypes'. Equal values are
+        # in atom list order, and if 'keepTies' all atoms tied with the
+        # nth are included. Returns a dictionary of dataset --> array
+        # of positions
+
+        if datasets == 'all':
+            datasets = self.getDsetList()
 
-            top = sorted(iter(overallRank.items()), key=operator.itemgetter(1), reverse=r)[:n]
-            atomList = [t[0] for t in top]
-            return atomList
+        vals = self.getMetricValues(metric=metric, normType=normType)
+        include = ~np.isnan(self.getMetricValues(
+            metric='loss', normType='Standard'))
+        if residues != []:
+            include &= np.isin([atm.basetype for atm in self.atomList],
+                               residues)[:, None]
+        if atomtypes != []:
+            include &= np.isin([atm.atomtype for atm in self.atomList],
+                               atomtypes)[:, None]
+
+        topInds = rankTopN(vals=vals[:, datasets], n=n,
+                           largest=topOrBot == 'top',
+                           include=include[:, datasets], keepTies=keepTies)
+        return dict(zip(datasets, topInds))
 
     def getTopNAtomsPDBfile(self,
                             metric='loss', normType='Standard', dataset=0,
@@ -1330,10 +1583,9 @@ class combinedAtomList(object):
         # for a given metric type, determine per-atom-type
         # statistics on the distribution of damage
 
-        atmtypeDict = self.groupByAtmType(dataset=dataset)
-
-        statsDic = self.getStats(metric=metric, normType=normType,
-                                 dataset=dataset, dic=atmtypeDict)
+        statsDic = self.getGroupStats(
+            metric=metric, normType=normType,
+            groupBy='atomtype').getStatsDic(dataset=dataset)
 
         statsString = self.reportStats(
             stats=statsDic, name='Type', sortby=sortby,
@@ -1348,11 +1600,9 @@ class combinedAtomList(object):
         # for a given metric type, determine per-residue
         # statistics on the distribution of damage
 
-        # group atoms by residue type
-        resDict = self.groupByResType(dataset=dataset)
-
-        statsDic = self.getStats(
-            metric=metric, normType=normType,  dataset=dataset, dic=resDict)
+        statsDic = self.getGroupStats(
+            metric=metric, normType=normType,
+            groupBy='residue').getStatsDic(dataset=dataset)
 
         statsString = self.reportStats(
             stats=statsDic, name='Residue', sortby=sortby,
@@ -1367,11 +1617,9 @@ class combinedAtomList(object):
         # for a given metric type, determine per-chain
         # statistics on the distribution of damage
 
-        # group atoms by chain type
-        chainDict = self.groupByChainType(dataset=dataset)
-
-        statsDic = self.getStats(
-            metric=metric, normType=normType, dataset=dataset, dic=chainDict)
+        statsDic = self.getGroupStats(
+            metric=metric, normType=normType,
+            groupBy='chain').getStatsDic(dataset=dataset)
 
         statsString = self.reportStats(
             stats=statsDic, name='Chain', sortby=sortby,
@@ -1386,15 +1634,59 @@ class combinedAtomList(object):
         # for a given metric type, determine per-chain
         # statistics on the distribution of damage
 
-        statsDic = self.getStats(
+        statsDic = self.getGroupStats(
             metric=metric, normType=normType,
-            dataset=dataset, dic={'Structure': self.atomList})
+            groupBy='structure').getStatsDic(dataset=dataset)
 
         statsString = self.reportStats(
             stats=statsDic, name='Structure', normType=normType, n=1)
 
         return statsString, statsDic
 
+    def getGroupStats(self,
+                      metric='loss', normType='Standard',
+                      groupBy='atomtype'):
+
+        # distribution stats of a metric for every group of atoms
+        # and every dataset at once (see groupStats class). 'groupBy'
+        # takes values 'atomtype', 'residue', 'chain' or 'structure'.
+        # Atoms are only counted within the datasets in which they are
+        # present (see combinedAtom.getPresentDatasets), except for
+        # structure-wide stats, which are over all atoms. The result
+        # is cached (see getCachedStat)
+
+        return self.getCachedStat(
+            key=('groupStats', metric, normType, groupBy),
+            calcFunc=lambda: self.calcGroupStats(
+                metric=metric, normType=normType, groupBy=groupBy))
+
+    def calcGroupStats(self,
+                       metric='loss', normType='Standard',
+                       groupBy='atomtype'):
+
+        # calculate the stats for getGroupStats
+
+        if groupBy == 'atomtype':
+            keys = ['-'.join([atm.basetype, atm.atomtype])
+                    for atm in self.atomList]
+        elif groupBy == 'residue':
+            keys = [atm.basetype for atm in self.atomList]
+        elif groupBy == 'chain':
+            keys = [atm.chaintype for atm in self.atomList]
+        elif groupBy == 'structure':
+            keys = ['Structure']*self.getNumAtoms()
+        else:
+            sys.exit('Unknown atom grouping "{}" specified'.format(groupBy))
+
+        vals = self.getMetricValues(metric=metric, normType=normType)
+        if groupBy == 'structure':
+            present = np.ones(vals.shape, dtype=bool)
+        else:
+            present = ~np.isnan(self.getMetricValues(
+                metric='loss', normType='Standard'))
+
+        return groupStats(vals=vals, present=present, keys=keys)
+
     def getStats(self,
                  metric='loss', normType='Standard',
                  dataset=0, dic={}):
@@ -1402,30 +1694,15 @@ class combinedAtomList(object):
         # output distribution stats for each element
         # in dictionary dic as a new dictionary
 
-        getStatsPerKey = {}
+        keys, atoms = [], []
         for k in list(dic.keys()):
-            metricList = [atom.densMetric[metric][normType]['values'][dataset] for atom in dic[k]]
-            statsDic = {}
-            m = metricList
-            statsDic['#atoms'] = len(m)
-            statsDic['mean'] = np.mean(m)
-            statsDic['std'] = np.std(m)
-            statsDic['skew'] = self.calculateSkew(metricList=m)
-            statsDic['kurtosis'] = self.calculateKurtosis(metricList=m)
-            # statsDic['ratio'] = self.calcNetRatio(metricList=m)
-            # statsDic['zero-asym1'] = self.calcAsymmetryAboutZero(vals=m, method=1)
-            statsDic['asymmetry score'] = self.calcAsymmetryAboutZero(vals=m)
-
-            statsDic['outliers'] = self.calcNumOutliers(
-                metricList=m, metric=metric, normType=normType)
-            statsDic['normality'] = self.testForNormality(metricList=m)
-
-            statsDic['returnOrder'] = ['mean', 'std', '#atoms', 'outliers',
-                                       'skew', 'kurtosis', 'asymmetry score']
-
-            getStatsPerKey[k] = statsDic
+            keys += [k]*len(dic[k])
+            atoms += dic[k]
+        vals = stackMetricValues(
+            atoms=atoms, metric=metric, normType=normType)[:, [dataset]]
+        stats = groupStats(vals=vals, present=np.ones(vals.shape), keys=keys)
 
-        return getStatsPerKey
+        return stats.getStatsDic(dataset=0)
 
     def reportStats(self,
                     stats={}, name='Residue', sortby='mean',
@@ -1480,18 +1757,20 @@ class combinedAtomList(object):
         if not isinstance(stat, list):
             stat = [stat]
 
+        resStats = self.getGroupStats(
+            metric=metric, normType=normType, groupBy='residue')
+
         statPerDset = {s: {} for s in stat}
         for i in self.getDsetList():
-            stats = self.getPerResidueStats(
-                metric=metric, normType=normType, dataset=i, n='all')
+            stats = resStats.getStatsDic(dataset=i)
             if i == 0:
-                for k in list(stats[1].keys()):
+                for k in list(stats.keys()):
                     for s in stat:
-                        statPerDset[s][k] = [stats[1][k][s]]
+                        statPerDset[s][k] = [stats[k][s]]
             else:
-                for k in list(stats[1].keys()):
+                for k in list(stats.keys()):
                     for s in stat:
-                        statPerDset[s][k].append(stats[1][k][s])
+                        statPerDset[s][k].append(stats[k][s])
 
         if not inclPartialAtms:
             # only include residue types that are present within
@@ -2842,45 +3121,64 @@ class combinedAtomList(object):
                      densMet='loss', normType='Standard', shift=True,
                      offset=True):
 
-        # call the external halfDoseCalc class to calculate a rough half
-        # dose decay value for a specified atom. 'shift' (Bool) determines
-        # whether half dose is dose for density to reach half of initial
-        # density (=False) or half dose is dose for density to reach
-        # av(initial density,end density limit (=True). 'offset' (Bool)
-        # determines whether exponential decay function is allowed
-        # a non-zero end density value
-
-        try:
-            halfDoseApprox
-        except NameError:
-            from halfDoseCalc import halfDoseApprox
+        # calculate a rough half dose decay value for a specified atom.
+        # 'shift' (Bool) determines whether half dose is dose for
+        # density to reach half of initial density (=False) or half
+        # dose is dose for density to reach av(initial density,end
+        # density limit (=True). 'offset' (Bool) determines whether
+        # exponential decay function is allowed a non-zero end density
+        # value. See calcHalfDoses to fit many atoms at once
 
         atom = self.getAtom(
             chain=chain, restype=restype,
             resnum=resnum, atomtype=atomtype)
 
-        atom = atom[0]
+        return self.calcHalfDoses(
+            atoms=atom[:1], densMet=densMet, normType=normType,
+            shift=shift, offset=offset)
+
+    def calcHalfDoses(self,
+                      atoms=[], densMet='loss', normType='Standard',
+                      shift=True, offset=True, globalScaling=False):
+
+        # fit an exponential decay of density metric with dose for all
+        # atoms in 'atoms' at once (see batchHalfDose) and save the
+        # half-dose statistics for each atom. 'shift' and 'offset' are
+        # as for calcHalfDose. If 'globalScaling' the values are
+        # first divided by the structure-wide average per dataset
+
         if len(self.doseList) != self.getNumDatasets():
             return 'need to specify doses list as class attribute before this can be calculated'
-        halfDoseApprox(
-            atom=atom, atoms=self.atomList, doses=self.doseList,
-            densityMetric=densMet, normType=normType,  plotDir=self.outputDir,
-            shiftedHalfDose=shift, zeroOffset=offset)
+        if len(atoms) == 0:
+            return
+
+        vals = stackMetricValues(atoms=atoms, metric=densMet,
+                                 normType=normType)
+        if globalScaling:
+            vals = vals/np.mean(self.getMetricValues(
+                metric=densMet, normType=normType), 0)
+
+        halfDoses = fitHalfDoses(
+            doses=self.doseList, values=vals, shiftedHalfDose=shift,
+            zeroOffset='y' if offset else 0)
+
+        statsLbls = ['Half-dose', 'Residuals', 'Certainty',
+                     'Initial density', 'End density', 'init decay rate']
+        for i, atom in enumerate(atoms):
+            atom.densMetric[densMet][normType]['Half-dose'] = {
+                lbl: halfDoses[lbl][i] for lbl in statsLbls}
 
     def calcHalfDoseForAtomtype(self,
                                 restype='', atomtype='', densMet='loss',
                                 normType='Standard', shift=True, offset=True,
                                 n=1, fileType='.svg'):
 
-        # call the above calcHalfDose method for instances
-        # of restype and atomtype
+        # calculate the half-dose (as for calcHalfDose method)
+        # for all instances of restype and atomtype
 
         atoms = self.getAtom(restype=restype, atomtype=atomtype)
-        for atom in atoms:
-            self.calcHalfDose(chain=atom.chaintype, restype=restype,
-                              resnum=atom.residuenum, atomtype=atomtype,
-                              densMet=densMet, normType=normType,
-                              shift=shift, offset=offset)
+        self.calcHalfDoses(atoms=atoms, densMet=densMet, normType=normType,
+                           shift=shift, offset=offset)
 
         print('--------------------')
         print('Summary here of run:')
@@ -3251,23 +3549,11 @@ class combinedAtomList(object):
             resnum=resNum1, atomtype=atomType1)
 
         atms2 = self.getAtom(restype=resType2, atomtype=atomType2)
+        if atms2 == []:
+            return [], 1e6
 
-        minAtm = []
-        minDist = 1e6
-        for atm2 in atms2:
-            dist = self.getDistanceBetweenAtoms(atom1=atm1[0], atom2=atm2)
-            try:
-                minDist
-            except NameError:
-                minDist = dist
-                minAtm = atm2
-                continue
-
-            if minDist > dist:
-                minDist = dist
-                minAtm = atm2
-
-        return minAtm, minDist
+        inds, dists = nearestAtoms(atoms=atm1[:1], otherAtoms=atms2)
+        return atms2[inds[0]], dists[0]
 
     def scatterAtmsByDistToOtherAtms(
         self, atomType1='OH', resType1='TYR', atomType2='CB', resType2='CYS',
@@ -3278,16 +3564,15 @@ class combinedAtomList(object):
         # (e.g. CYS-SG) and make scatter plot
 
         atms1 = self.getAtom(restype=resType1, atomtype=atomType1)
+        atms2 = self.getAtom(restype=resType2, atomtype=atomType2)
 
-        xVals = []
-        yVals = []
-        for atm1 in atms1:
-            info = self.getMinDistToAtomType(
-                atomType1=atm1.atomtype, resType1=atm1.basetype,
-                resNum1=atm1.residuenum, chainType1=atm1.chaintype,
-                atomType2=atomType2, resType2=resType2)
-            xVals.append(info[1])
-            yVals.append(atm1.densMetric[metric][normType]['values'])
+        # min distance from each atom 1 to an atom of type 2, found
+        # for all atoms 1 at once (see getMinDistToAtomType)
+        if atms2 == []:
+            xVals = [1e6]*len(atms1)
+        else:
+            xVals = list(nearestAtoms(atoms=atms1, otherAtoms=atms2)[1])
+        yVals = [atm1.densMetric[metric][normType]['values'] for atm1 in atms1]
 
         for d in self.getDsetList():
             Rsquared = self.plotScatterPlot(
@@ -3302,6 +3587,20 @@ class combinedAtomList(object):
 
             print('Dataset {} --> R^2 = {}'.format(d+1, round(Rsquared, 4)))
 
+    def getSpatialIndex(self):
+
+        # get the spatial index over the coordinates of the atoms
+        # (see atomSpatialIndex class), built on first use and
+        # rebuilt if the atom list has since been changed
+
+        try:
+            if self.spatialIndex.isCurrent(self.atomList):
+                return self.spatialIndex
+        except AttributeError:
+            pass
+        self.spatialIndex = atomSpatialIndex(self.atomList)
+        return self.spatialIndex
+
     def getAtomsWithinDist(self,
                            atom='', distLimMax=4, distLimMin=0,
                            printText=False, ignoreSame='res'):
@@ -3310,20 +3609,13 @@ class combinedAtomList(object):
         # of selected atomtype. Disregards atoms of
         # same exact residue by default
 
-        nearAtmDic = {'atoms': [], 'distances': []}
+        index = self.getSpatialIndex()
+        inds, dists = index.withinDist(
+            atom=atom, distLimMax=distLimMax, distLimMin=distLimMin,
+            ignoreSame=ignoreSame)
 
-        for otheratom in self.atomList:
-            if ignoreSame == 'res':
-                if (otheratom.getAtomID()).split('-')[:-1] == (atom.getAtomID()).split('-')[:-1]:
-                    continue
-            elif ignoreSame == 'atom':
-                if otheratom.getAtomID() == atom.getAtomID():
-                    continue
-            dist = self.getDistanceBetweenAtoms(atom1=atom, atom2=otheratom)
-            if dist < distLimMax:
-                if dist > distLimMin:
-                    nearAtmDic['atoms'].append(otheratom)
-                    nearAtmDic['distances'].append(dist)
+        nearAtmDic = {'atoms': [index.atoms[i] for i in inds],
+                      'distances': list(dists)}
         if printText:
             print('{} in total within {}-{} Angstrom of {}'.format(
                 len(nearAtmDic['atoms']), round(distLimMin, 2),
@@ -3347,11 +3639,7 @@ class combinedAtomList(object):
 
         # find max distance away from atom
         keyAtm = atm[0]
-        maxDist = 0
-        for othAtm in self.atomList:
-            dist = self.getDistanceBetweenAtoms(atom1=keyAtm, atom2=othAtm)
-            if dist > maxDist:
-                maxDist = dist
+        maxDist = self.getSpatialIndex().maxDist(atom=keyAtm)
 
         foundAtms = self.getAtomsWithinDist(atom=keyAtm, distLimMax=maxDist+1)
 
@@ -3931,11 +4219,15 @@ class combinedAtomList(object):
         # for a specified metric calculate the average
         # over dose range if not already calculated
 
-        try:
-            self.atomList[0].densMetric[metric][normType]['average']
-        except KeyError:
-            self.calcAdditionalMetrics(
-                metric=metric, normType=normType, newMetric='average')
+        def calcAverage():
+            try:
+                self.atomList[0].densMetric[metric][normType]['average']
+            except KeyError:
+                self.calcAdditionalMetrics(
+                    metric=metric, normType=normType, newMetric='average')
+
+        self.getCachedStat(
+            key=('averageOverDoses', metric, normType), calcFunc=calcAverage)
 
     def findProbHighNeighbourGivenHighAtom(self,
                                            distance=5, densMet='loss',
@@ -3968,31 +4260,28 @@ class combinedAtomList(object):
             except ValueError:
                 print('Unexpected assignment of "criteria" parameter')
 
-        numHighAtoms = 0
-        numHighNearAtoms = 0
-        for atm in self.atomList:
-            atmMetric = atm.densMetric[densMet][normType]['values'][dataset]
-            if sign == 'above':
-                if atmMetric <= thres:
-                    continue
-            elif sign == 'below':
-                if atmMetric >= thres:
-                    continue
-            else:
-                print('"sign" parameter must take either "above" or "below"')
-                return
-            numHighAtoms += 1
-            nearAtms = self.getAtomsWithinDist(atom=atm, distLimMax=distance)
-            for nearAtm in nearAtms['atoms']:
-                nearAtmMetric = nearAtm.densMetric[densMet][normType]['values'][dataset]
-                if sign == 'above':
-                    if nearAtmMetric > thres:
-                        numHighNearAtoms += 1
-                        break
-                else:
-                    if nearAtmMetric < thres:
-                        numHighNearAtoms += 1
-                        break
+        # all pairs of neighbouring atoms (not in the same residue)
+        # are found at once and tested against the threshold together
+        index = self.getSpatialIndex()
+        vals = stackMetricValues(
+            atoms=index.atoms, metric=densMet, normType=normType)[:, dataset]
+        if sign == 'above':
+            highAtoms = ~(vals <= thres)
+            highNeighbours = vals > thres
+        elif sign == 'below':
+            highAtoms = ~(vals >= thres)
+            highNeighbours = vals < thres
+        else:
+            print('"sign" parameter must take either "above" or "below"')
+            return
+
+        pairs = index.pairsWithinDist(distLimMax=distance)[0]
+        hasHighNeighbour = np.zeros(len(vals), dtype=bool)
+        hasHighNeighbour[pairs[highNeighbours[pairs[:, 1]], 0]] = True
+        hasHighNeighbour[pairs[highNeighbours[pairs[:, 0]], 1]] = True
+
+        numHighAtoms = np.count_nonzero(highAtoms)
+        numHighNearAtoms = np.count_nonzero(highAtoms & hasHighNeighbour)
         probHighAtom = float(numHighAtoms)/self.getNumAtoms()
         probHighNeighbourAndHighAtom = float(numHighNearAtoms)/self.getNumAtoms()
         probHighNeighGivenHighAtom = probHighNeighbourAndHighAtom/probHighAtom
@@ -0,0 +1,237 @@
+from voxelGrouping import getSegments
+from scipy.stats import chi2
+from pandas import DataFrame
+import numpy as np
+
+# the statistics calculated per group, in the order they are reported
+STATS_ORDER = ['mean', 'std', '#atoms', 'outliers',
+               'skew', 'kurtosis', 'asymmetry score']
+
+# number of histogram bins used to find the mode of each group
+NUM_MODE_BINS = 100
+
+
+def getGroupCodes(keys=[]):
+
+    # an integer code per key (equal for equal keys), and the list of
+    # distinct keys in order of first appearance
+
+    codes = {}
+    groupCodes = np.array([codes.setdefault(k, len(codes)) for k in keys],
+                          dtype=int)
+    return groupCodes, list(codes)
+
+
+def segmentedHistogramMode(vals=[], starts=[], mins=[], maxs=[]):
+
+    # the mode of a 100-bin histogram of each segment of 'vals' (sorted
+    # by segment), taken as the centre of the fullest bin, with bins
+    # assigned as by np.histogram (see calcDiscreteDistMode)
+
+    counts = np.diff(np.append(starts, len(vals)))
+    seg = np.repeat(np.arange(len(starts)), counts)
+
+    first, last = mins.astype(float), maxs.astype(float)
+    same = first == last
+    first[same] -= 0.5
+    last[same] += 0.5
+    step = (last - first)/NUM_MODE_BINS
+
+    def edge(i):
+        return np.where(i == NUM_MODE_BINS, last[seg], i*step[seg] + first[seg])
+
+    with np.errstate(invalid='ignore'):
+        f = ((vals - first[seg])/(last[seg] - first[seg]))*NUM_MODE_BINS
+        inds = np.nan_to_num(f).astype(np.intp)
+    inds[inds == NUM_MODE_BINS] -= 1
+    inds[vals < edge(inds)] -= 1
+    inds[(vals >= edge(inds + 1)) & (inds != NUM_MODE_BINS - 1)] += 1
+
+    hist = np.bincount(seg*NUM_MODE_BINS + np.clip(inds, 0, NUM_MODE_BINS-1),
+                       minlength=len(starts)*NUM_MODE_BINS)
+    modeBin = np.argmax(hist.reshape(-1, NUM_MODE_BINS), 1)
+
+    lower = modeBin*step + first
+    upper = np.where(modeBin + 1 == NUM_MODE_BINS, last,
+                     (modeBin + 1)*step + first)
+    return (lower + upper)/2
+
+
+class groupStats(object):
+
+    # distribution statistics of a metric for groups of atoms (e.g. by
+    # atom type, residue type or chain), for every group and every
+    # dataset in one vectorised pass. 'vals' is an array of shape
+    # (atoms, datasets), 'present' marks the datasets in which each
+    # atom is to be counted, and each atom belongs to the group of its
+    # key in 'keys'. The results are held as a table with one row per
+    # (group, dataset) pair that holds at least one atom
+
+    def __init__(self,
+                 vals=[], present=[], keys=[]):
+
+        vals = np.asarray(vals, dtype=float)
+        present = np.asarray(present, dtype=bool)
+        codes, self.groups = getGroupCodes(keys)
+        self.numDatasets = numDatasets = vals.shape[1]
+
+        # each (atom, dataset) value is tagged with its (group, dataset)
+        # and the values sorted so that each pair is a contiguous run
+        atomInds, dsets = np.nonzero(present)
+        pairs = codes[atomInds]*numDatasets + dsets
+        order = np.argsort(pairs, kind='stable')
+        x = vals[atomInds, dsets][order]
+        firstAtoms = atomInds[order]
+        starts, pairs, counts = getSegments(pairs[order])
+
+        self.groupCodes = pairs // numDatasets
+        self.table = {'group': [self.groups[c] for c in self.groupCodes],
+                      'dataset': pairs % numDatasets,
+                      '#atoms': counts,
+                      'first atom': firstAtoms[starts]}
+        if len(x) == 0:
+            for stat in STATS_ORDER[:2] + STATS_ORDER[3:] + ['normality',
+                                                             'asymmetry defined']:
+                self.table[stat] = np.zeros(0)
+            return
+
+        seg = np.repeat(np.arange(len(starts)), counts)
+        with np.errstate(all='ignore'):
+            mean = np.add.reduceat(x, starts)/counts
+            dev = x - mean[seg]
+            m2 = np.add.reduceat(dev**2, starts)/counts
+            m3 = np.add.reduceat(dev**3, starts)/counts
+            m4 = np.add.reduceat(dev**4, starts)/counts
+
+            # as scipy.stats skew and kurtosis (biased, Fisher)
+            zero = m2 <= (np.finfo(float).eps*mean)**2
+            skew = np.where(zero, np.nan, m3/m2**1.5)
+            kurt = np.where(zero, np.nan, m4/m2**2.0) - 3
+
+            # sum of positive values over sum of magnitudes of others.
+            # This is undefined if there are no other values
+            aboveSum = np.add.reduceat(np.where(x > 0, x, 0), starts)
+            belowSum = np.add.reduceat(np.where(x > 0, 0, np.abs(x)), starts)
+            asymDefined = np.add.reduceat((~(x > 0)).astype(int), starts) > 0
+            asym = np.where(asymDefined, aboveSum/belowSum, np.nan)
+
+            # number of values above the mode plus the distance
+            # from the mode to the minimum (see calcNumOutliers)
+            mins = np.minimum.reduceat(x, starts)
+            maxs = np.maximum.reduceat(x, starts)
+            distMode = segmentedHistogramMode(
+                vals=x, starts=starts, mins=mins, maxs=maxs)
+            sudoMax = distMode + np.abs(mins - distMode)
+            outliers = np.add.reduceat((x > sudoMax[seg]).astype(int), starts)
+
+            # the normality test (as scipy.stats.mstats) instead takes
+            # a zero skew and kurtosis for groups of equal values
+            mZero = m2 <= (np.finfo(float).resolution*mean)**2
+            normality = self.normalTest(
+                n=counts, skew=np.where(mZero, 0, m3/m2**1.5),
+                kurt=np.where(mZero, 0, m4/m2**2.0) - 3)
+
+        self.table.update({'mean': mean,
+                           'std': np.sqrt(m2),
+                           'skew': skew,
+                           'kurtosis': kurt,
+                           'asymmetry score': asym,
+                           'asymmetry defined': asymDefined,
+                           'outliers': outliers,
+                           'normality': normality})
+
+    def normalTest(self,
+                   n=[], skew=[], kurt=[]):
+
+        # p-value of the D'Agostino-Pearson test of normality for each
+        # group (as scipy.stats.mstats.normaltest), from the number of
+        # values and the skewness and (Fisher) kurtosis of each group
+
+        n = n.astype(float)
+
+        y = skew*np.sqrt(((n+1)*(n+3))/(6.0*(n-2)))
+        beta2 = (3.0*(n*n+27*n-70)*(n+1)*(n+3))/((n-2.0)*(n+5)*(n+7)*(n+9))
+        W2 = -1 + np.sqrt(2*(beta2-1))
+        delta = 1/np.sqrt(0.5*np.log(W2))
+        alpha = np.sqrt(2.0/(W2-1))
+        y = np.where(y == 0, 1, y)
+        Zskew = delta*np.log(y/alpha + np.sqrt((y/alpha)**2+1))
+
+        E = 3.0*(n-1)/(n+1)
+        varb2 = 24.0*n*(n-2.)*(n-3)/((n+1)*(n+1.)*(n+3)*(n+5))
+        x = (kurt + 3 - E)/np.sqrt(varb2)
+        sqrtbeta1 = 6.0*(n*n-5*n+2)/((n+7)*(n+9))*np.sqrt(
+            (6.0*(n+3)*(n+5))/(n*(n-2)*(n-3)))
+        A = 6.0 + 8.0/sqrtbeta1*(2.0/sqrtbeta1 + np.sqrt(1+4.0/(sqrtbeta1**2)))
+        term1 = 1 - 2./(9.0*A)
+        denom = 1 + x*np.sqrt(2/(A-4.0))
+        term2 = np.where(denom > 0, np.power((1-2.0/A)/denom, 1/3.0),
+                         -np.power(-(1-2.0/A)/denom, 1/3.0))
+        term2[denom == 0] = np.nan
+        Zkurt = (term1 - term2)/np.sqrt(2/(9.0*A))
+
+        return chi2.sf(Zskew**2 + Zkurt**2, 2)
+
+    def getStatsDic(self,
+                    dataset=0):
+
+        # the statistics for each group with atoms in 'dataset', as a
+        # dictionary of group --> dictionary of statistics (in the
+        # form returned by combinedAtomList.getStats). Groups are in
+        # order of their first atom present within the dataset
+
+        rows = np.flatnonzero(self.table['dataset'] == dataset)
+        rows = rows[np.argsort(self.table['first atom'][rows], kind='stable')]
+
+        statsPerGroup = {}
+        for r in rows:
+            statsDic = {'#atoms': int(self.table['#atoms'][r])}
+            for stat in ('mean', 'std', 'skew', 'kurtosis'):
+                statsDic[stat] = self.table[stat][r]
+            statsDic['outliers'] = int(self.table['outliers'][r])
+
+            if self.table['asymmetry defined'][r]:
+                statsDic['asymmetry score'] = self.table['asymmetry score'][r]
+            else:
+                statsDic['asymmetry score'] = 'N/A'
+
+            if statsDic['#atoms'] < 20:
+                statsDic['normality'] = 'n/a'
+            else:
+                statsDic['normality'] = self.table['normality'][r]
+
+            statsDic['returnOrder'] = list(STATS_ORDER)
+            statsPerGroup[self.table['group'][r]] = statsDic
+
+        return statsPerGroup
+
+    def getStatArray(self,
+                     stat='mean'):
+
+        # a statistic for every group and dataset, as an array of
+        # shape (groups, datasets) with groups in the order of
+        # self.groups, and nan where a group has no atoms in a dataset
+
+        statArray = np.full((len(self.groups), self.numDatasets), np.nan)
+        statArray[self.groupCodes, self.table['dataset']] = self.table[stat]
+        return statArray
+
+    def getDataFrame(self):
+
+        # the table of statistics as a pandas DataFrame, with one row
+        # per (group, dataset) pair holding at least one atom
+
+        columns = ['group', 'dataset'] + STATS_ORDER + ['normality']
+        return DataFrame({c: self.table[c] for c in columns}, columns=columns)
+
+    def getStat(self,
+                stat='mean', group='', dataset=0):
+
+        # a single statistic for a group within a dataset (nan if
+        # the group has no atoms within the dataset)
+
+        rows = np.flatnonzero((self.table['dataset'] == dataset) &
+                              [g == group for g in self.table['group']])
+        if len(rows) == 0:
+            return np.nan
+        return self.table[stat][rows[0]]
@@ -717,10 +717,9 @@ class makeMapsFromMTZs():
         # the grid dimensions/filtering are the same and the ordering
         # of the fast, medium, and slow axes are identical.
 
+        # only the map headers are read here, not the map data
         fftMap = mapTools(self.densityMap)
-        fftMap.readHeader()
         sfallMap = mapTools(self.atomTaggedMap)
-        sfallMap.readHeader()
 
         self.runLog.writeToLog(
             str='Checking that atom map (SFALL) and density ' +
@@ -0,0 +1,84 @@
+from classHolder import MapInfo
+from errors import error
+import numpy as np
+
+# size (in bytes) of the fixed part of a CCP4 .map file header
+HEADER_SIZE = 1024
+
+# layout of the fixed 256-word CCP4 .map file header. Byte order
+# is left unspecified here and set per file (see headerDtype below)
+HEADER_FIELDS = [('nx', 'i4'), ('ny', 'i4'), ('nz', 'i4'),
+                 ('mode', 'i4'),
+                 ('nxstart', 'i4'), ('nystart', 'i4'), ('nzstart', 'i4'),
+                 ('mx', 'i4'), ('my', 'i4'), ('mz', 'i4'),
+                 ('cell', 'f4', (6,)),
+                 ('mapc', 'i4'), ('mapr', 'i4'), ('maps', 'i4'),
+                 ('dmin', 'f4'), ('dmax', 'f4'), ('dmean', 'f4'),
+                 ('ispg', 'i4'), ('nsymbt', 'i4'), ('lskflg', 'i4'),
+                 ('skwmat', 'f4', (9,)), ('skwtrn', 'f4', (3,)),
+                 ('future', 'i4', (15,)),
+                 ('map', 'S4'), ('machst', 'u1', (4,)),
+                 ('rms', 'f4'), ('nlabl', 'i4'),
+                 ('labels', 'S80', (10,))]
+
+# map modes that are understood by RIDL, and the data type
+# of each voxel value within the map data block for each mode
+MODE_DTYPES = {0: 'i1', 1: 'i2', 2: 'f4', 12: 'f2'}
+
+
+def headerDtype(byteOrder='<'):
+
+    # structured numpy dtype describing the fixed map header,
+    # for either little ('<') or big ('>') endian files
+
+    fields = []
+    for field in HEADER_FIELDS:
+        fields.append((field[0], byteOrder + field[1]) + field[2:])
+    return np.dtype(fields)
+
+
+def getByteOrder(rawHeader=b''):
+
+    # determine the byte order of a map file from the machine
+    # stamp (header word 54). Older files may not have a valid
+    # stamp, in which case the order that gives a sensible map
+    # mode (header word 4) is taken
+
+    stamp = bytearray(rawHeader[212:216])
+    if stamp[0] == 0x44:
+        return '<'
+    elif stamp[0] == 0x11:
+        return '>'
+
+    for byteOrder in ('<', '>'):
+        mode = np.frombuffer(rawHeader[12:16], dtype=byteOrder + 'i4')[0]
+        if mode in MODE_DTYPES:
+            return byteOrder
+    return '<'
+
+
+def readMapHeader(mapName='untitled.map', log=''):
+
+    # read the header and symmetry records of a .map file in a single
+    # pass, without touching the map data block. A MapInfo object
+    # is returned, filled with the map header information
+
+    with open(mapName, 'rb') as f:
+        rawHeader = f.read(HEADER_SIZE)
+        if len(rawHeader) != HEADER_SIZE:
+            error(text='Map file "{}" too short to '.format(mapName) +
+                       'contain a full header', log=log, type='error')
+
+        byteOrder = getByteOrder(rawHeader)
+        header = np.frombuffer(rawHeader, dtype=headerDtype(byteOrder))[0]
+        symBytes = f.read(max(int(header['nsymbt']), 0))
+
+    # symmetry operations are stored as 80 character records
+    symOps = [symBytes[i:i+80].decode('utf-8')
+              for i in range(0, len(symBytes) - len(symBytes) % 80, 80)]
+
+    rho = MapInfo()
+    rho.setHeaderInfo(header=header, byteOrder=byteOrder)
+    rho.curateSymOps(symOps)
+
+    return rho
@@ -0,0 +1,103 @@
+import threading
+import queue
+
+
+class deferredLog(object):
+
+    # stands in for a log file (see logFile class) within a map
+    # reading task on a background thread. Lines written to it are
+    # held back, and written to the log file itself by the calling
+    # thread once it takes the task's map (see mapPrefetcher), so
+    # that they are not interleaved with the log of the current map
+
+    def __init__(self,
+                 log='', lines=[]):
+
+        # 'lines' are any held lines to start from (e.g. those
+        # returned from a worker process, see calcDatasetMetrics)
+        self.log = log
+        self.lines = list(lines)
+
+    def __getattr__(self, name):
+        return getattr(self.log, name)
+
+    def writeToLog(self, *args, **kwargs):
+        self.lines.append((args, kwargs))
+
+    def flush(self):
+
+        # write the held lines to the log file (calling thread)
+
+        for args, kwargs in self.lines:
+            self.log.writeToLog(*args, **kwargs)
+        self.lines = []
+
+
+class mapPrefetcher(object):
+
+    # run a series of map reading tasks in order on a background
+    # thread, so that the next map(s) can be read from disk while
+    # metrics are calculated for the current one. At most 'depth'
+    # maps are read ahead of the one currently in use, so memory
+    # stays capped at depth+1 datasets. Iterating over this object
+    # returns each task's result in order, re-raising (in the calling
+    # thread) any exception that was raised by a task. If a log file
+    # 'log' is given, each task is called with a deferredLog in its
+    # place, and the task's log lines are written as its result is
+    # taken
+
+    def __init__(self,
+                 tasks=[], depth=1, log=''):
+
+        self.numTasks = len(tasks)
+        self.log = log
+        self.results = queue.Queue(maxsize=depth)
+
+        # a slot is taken before each read, and handed back once
+        # the calling thread has taken the previous map, so that
+        # a finished read cannot sit waiting beside a new one
+        self.slots = threading.Semaphore(depth)
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self.run, args=(tasks,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self,
+            tasks=[]):
+
+        # read each map in turn (background thread)
+
+        for task in tasks:
+            self.slots.acquire()
+            if self.stopped.is_set():
+                return
+            taskLog = None
+            try:
+                if self.log != '':
+                    taskLog = deferredLog(log=self.log)
+                    result = (task(log=taskLog), None, taskLog)
+                else:
+                    result = (task(), None, taskLog)
+            except BaseException as e:
+                self.results.put((None, e, taskLog))
+                return
+            self.results.put(result)
+
+    def __iter__(self):
+
+        for i in range(self.numTasks):
+            result, exception, taskLog = self.results.get()
+            self.slots.release()
+            if taskLog is not None:
+                taskLog.flush()
+            if exception is not None:
+                raise exception
+            yield result
+
+    def stop(self):
+
+        # stop reading ahead (e.g. if the caller stops early)
+
+        self.stopped.set()
+        self.slots.release()
@@ -1,4 +1,4 @@
-import struct
+from mapHeader import readMapHeader
 
 
 class mapTools():
@@ -17,27 +17,25 @@ class mapTools():
         # parse all header information from a
         # map file and dump to command line
 
-        binaryMapFile = open(self.mapName, 'rb')
-        for i in range(0, 30):
-            print(self.get4Bytes(binaryMapFile))
+        header = readMapHeader(mapName=self.mapName, log=self.log).header
+        for field in header.dtype.names:
+            print('{}: {}'.format(field, header[field]))
 
     def readHeader(self):
 
-        # parse specific information from map header
-
-        binaryMapFile = open(self.mapName, 'rb')
-        self.numCols = self.get4Bytes(binaryMapFile)
-        self.numRows = self.get4Bytes(binaryMapFile)
-        self.numSecs = self.get4Bytes(binaryMapFile)
-        binaryMapFile.seek(7*4, 0)
-        self.gridsamp1 = self.get4Bytes(binaryMapFile)
-        self.gridsamp2 = self.get4Bytes(binaryMapFile)
-        self.gridsamp3 = self.get4Bytes(binaryMapFile)
-        binaryMapFile.seek(16*4, 0)
-        self.fastaxis = self.get4Bytes(binaryMapFile)
-        self.medaxis = self.get4Bytes(binaryMapFile)
-        self.slowaxis = self.get4Bytes(binaryMapFile)
-        binaryMapFile.close()
+        # parse specific information from map header. Only the
+        # header is read, the map data block is not touched
+
+        self.mapInfo = readMapHeader(mapName=self.mapName, log=self.log)
+        self.numCols = self.mapInfo.nxyz['nx']
+        self.numRows = self.mapInfo.nxyz['ny']
+        self.numSecs = self.mapInfo.nxyz['nz']
+        self.gridsamp1 = self.mapInfo.gridsamp['1']
+        self.gridsamp2 = self.mapInfo.gridsamp['2']
+        self.gridsamp3 = self.mapInfo.gridsamp['3']
+        self.fastaxis = self.mapInfo.axis['fast']
+        self.medaxis = self.mapInfo.axis['med']
+        self.slowaxis = self.mapInfo.axis['slow']
 
     def getMapSize(self):
 
@@ -46,13 +44,6 @@ class mapTools():
         numVoxels = self.numCols*self.numRows*self.numSecs
         return numVoxels
 
-    def get4Bytes(self, binaryMapFile):
-
-        # get next 4 bytes within a map file
-
-        info = struct.unpack('=l', binaryMapFile.read(4))[0]
-        return info
-
     def printMapInfo(self):
 
         # print summary map info to log file or
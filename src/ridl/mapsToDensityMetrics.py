@@ -2,7 +2,16 @@ from __future__ import division
 from vxlsPerAtmAnalysisPlots import plotVxlsPerAtm, plotDensForAtm
 from densityAnalysisPlots import edens_scatter
 from PDBFileManipulation import PDBtoList
-from readMap import readMap
+from readMap import readMap, checkAtomTagRange
+from atomMapCache import loadAtomMapCache, saveAtomMapCache
+from slabDensMetrics import slabDensAccumulator, iterMapSlabs
+from voxelGrouping import voxelGrouping, groupedValues
+from batchDensMetrics import calcBatchDensMetrics, calcBatchFCMetrics
+from mapHeader import readMapHeader
+from parallelDensMetrics import sharedArrays, calcDatasetMetrics
+from concurrent.futures import ProcessPoolExecutor
+from mapPrefetcher import mapPrefetcher, deferredLog
+from functools import partial
 import matplotlib.pyplot as plt
 from errors import error
 import numpy as np
@@ -26,7 +35,10 @@ class maps2DensMetrics(object):
                  filesIn='', filesOut='', pdbName='', atomTagMap='',
                  densityMap='', FCmap='',  plotScatter=False, plotHist=False,
                  logFile='./untitled.log', calcFCmap=True,
-                 doXYZanalysis=False):
+                 doXYZanalysis=False, compactDensity=False,
+                 verifyCompact=False, useAtomMapCache=True,
+                 streamMaps=False, sectionsPerSlab=10,
+                 slabQuantiles='exact', numThreads=1, atomTagScale=100):
 
         # the input directory
         self.filesIn = filesIn
@@ -61,6 +73,32 @@ class maps2DensMetrics(object):
         # whether to do analysis based on xyz of each voxel
         self.doXYZanalysis = doXYZanalysis
 
+        # (bool) hold density and FC map values as float16 to save
+        # memory, and whether to check these against the full
+        # precision values as each map is read
+        self.compactDensity = compactDensity
+        self.verifyCompact = verifyCompact
+
+        # (bool) reuse a cached voxel index for the atom-tagged map
+        # from a previous run, if the map has not changed since
+        self.useAtomMapCache = useAtomMapCache
+
+        # (bool) stream the maps a slab of sections at a time rather
+        # than reading them into memory (for very large unit cells),
+        # the number of map sections per slab, and whether per-atom
+        # percentiles are 'exact' or estimated from a 'sketch'
+        self.streamMaps = streamMaps
+        self.sectionsPerSlab = sectionsPerSlab
+        self.slabQuantiles = slabQuantiles
+
+        # number of threads over which to shard the atoms (by
+        # contiguous ranges of atom number) when calculating metrics
+        self.numThreads = numThreads
+
+        # factor by which atom numbers are scaled to give the voxel
+        # values of the atom-tagged map (100 for SFALL atom-tagged maps)
+        self.atomTagScale = atomTagScale
+
     def maps2atmdensity(self,
                         mapsAlreadyRead=False):
 
@@ -70,6 +108,10 @@ class maps2DensMetrics(object):
         # describing the density map behaviour in the vicinity of each refined
         # atom can be calculated
 
+        if self.streamMaps:
+            self.streamMaps2atmdensity(mapsAlreadyRead)
+            return
+
         if not mapsAlreadyRead:
             self.readPDBfile()
             self.readAtomMap()
@@ -91,6 +133,251 @@ class maps2DensMetrics(object):
         if self.plotScatter:
             self.plotDensScatterPlots()
 
+    def pipelinedMaps2atmdensity(self,
+                                 densMapList=[], prefetchDepth=1):
+
+        # as for maps2atmdensity, for a series of density maps that
+        # share the same atom-tagged map (and Fcalc map). Density maps
+        # are read on a background thread (at most prefetchDepth maps
+        # ahead) while per-atom metrics are calculated for the current
+        # map, so that map reading and calculation overlap. Yields the
+        # list of atoms (with metrics set) for each density map in turn
+
+        self.readPDBfile()
+        self.readAtomMap()
+        if self.calcFCmap:
+            self.readFCMap()
+            self.reportDensMapInfo(mapType='calc')
+
+        prefetcher = mapPrefetcher(
+            tasks=[partial(self.loadDensityMap, mapName=densMapName)
+                   for densMapName in densMapList],
+            depth=prefetchDepth, log=self.log)
+
+        # each map is taken after its step is logged (as in
+        # readDensityMap), since the log lines from reading the map
+        # are written as it is taken. The timer then covers any wait
+        # for the map to finish being read
+        densMaps = iter(prefetcher)
+        try:
+            for densMapName in densMapList:
+                self.densMapIn = densMapName
+                self.printStepNumber()
+                self.startTimer()
+                self.lgwrite(ln='Reading density map file...\n' +
+                                'Density map name: {}'.format(self.densMapIn))
+                self.densmap = next(densMaps)
+                self.stopTimer()
+
+                self.reportDensMapInfo()
+                self.checkMapCompatibility()
+                self.createVoxelList()
+
+                if self.plotHist:
+                    self.plotDensHistPlots()
+
+                self.calcDensMetrics(showProgress=False)
+
+                if self.plotScatter:
+                    self.plotDensScatterPlots()
+
+                yield self.PDBarray
+        finally:
+            prefetcher.stop()
+
+    def parallelMaps2atmdensity(self,
+                                densMapList=[], numProcesses=2):
+
+        # as for maps2atmdensity, for a series of density maps that
+        # share the same atom-tagged map (and Fcalc map). The atom-tagged
+        # voxel grouping (and grouped Fcalc map values) are placed in
+        # shared memory, and the density maps are then fanned out to a
+        # pool of worker processes, each reading one density map and
+        # calculating per-atom metrics for every atom. Yields the list
+        # of atoms (with metrics set) for each density map in turn, in
+        # the order of densMapList
+
+        self.readPDBfile()
+        self.readAtomMap()
+        maxAtomNum = max(atom.atomnum for atom in self.PDBarray)
+
+        toShare = {'groupedIndices': self.groupedIndices,
+                   'starts': self.grouping.starts,
+                   'atoms': self.grouping.atoms,
+                   'counts': self.grouping.counts}
+        if self.calcFCmap:
+            self.readFCMap()
+            self.reportDensMapInfo(mapType='calc')
+            toShare['FCvals'] = self.FCmap.vxls_val
+
+        # the map headers are checked before any workers are started
+        densMapHeaders = []
+        for densMapName in densMapList:
+            self.densmap = readMapHeader(
+                mapName=self.filesIn + densMapName, log=self.log)
+            self.checkMapCompatibility(reportNumVxls=False)
+            densMapHeaders.append(self.densmap)
+
+        self.printStepNumber()
+        self.lgwrite(
+            ln='Calculating electron density statistics per atom for ' +
+               '{} density maps over {} processes...'.format(
+                len(densMapList), numProcesses))
+
+        shared = sharedArrays(arrays=toShare)
+        try:
+            with ProcessPoolExecutor(max_workers=numProcesses) as pool:
+                jobs = [pool.submit(
+                    calcDatasetMetrics, specs=shared.specs,
+                    dirIn=self.filesIn, dirOut=self.filesOut,
+                    densMapName=densMapName, maxAtomNum=maxAtomNum,
+                    compact=self.compactDensity, log=self.log)
+                    for densMapName in densMapList]
+
+                for i, job in enumerate(jobs):
+                    stats, metrics, logLines = job.result()
+
+                    # the log lines of each worker are written here,
+                    # so that they follow the order of densMapList
+                    self.densMapIn = densMapList[i]
+                    self.densmap = densMapHeaders[i]
+                    self.lgwrite(
+                        ln='\nDensity map name: {}'.format(self.densMapIn))
+                    deferredLog(log=self.log, lines=logLines).flush()
+                    if stats is None:
+                        sys.exit()
+
+                    self.reportDensMapInfo(stats=stats)
+                    self.setAtomMetrics(metrics=metrics)
+
+                    yield self.PDBarray
+        finally:
+            shared.close()
+
+    def streamMaps2atmdensity(self,
+                              mapsAlreadyRead=False):
+
+        # as for maps2atmdensity, but the atom-tagged, density and
+        # Fcalc maps are walked through together a slab of map
+        # sections at a time, accumulating per-atom summary metrics
+        # as they go. Memory use is then independent of map size
+
+        if not mapsAlreadyRead:
+            self.readPDBfile()
+
+        mapNames = {'atom': self.filesIn + self.atomMapIn,
+                    'density': self.filesIn + self.densMapIn}
+        self.atmmap = readMapHeader(mapName=mapNames['atom'], log=self.log)
+        self.densmap = readMapHeader(
+            mapName=mapNames['density'], log=self.log)
+        if self.calcFCmap:
+            mapNames['calc'] = self.filesIn + self.FCmapIn
+            self.FCmap = readMapHeader(
+                mapName=mapNames['calc'], log=self.log)
+            if self.FCmap.nxyz != self.atmmap.nxyz:
+                error(text='Incompatible atom-tagged and Fcalc map ' +
+                           'dimensions', log=self.log, type='error')
+
+        self.checkMapCompatibility(reportNumVxls=False)
+        maxAtomNum = max(atom.atomnum for atom in self.PDBarray)
+        checkAtomTagRange(mapInfo=self.atmmap, maxAtomNum=maxAtomNum,
+                          atomTagScale=self.atomTagScale, log=self.log)
+
+        self.startTimer()
+        self.printStepNumber()
+        self.lgwrite(
+            ln='Streaming maps {} sections at a time '.format(
+                self.sectionsPerSlab) +
+               'to calculate electron density statistics per atom...')
+
+        accumulator = slabDensAccumulator(
+            maxAtomNum=maxAtomNum, calcFCmap=self.calcFCmap,
+            quantiles=self.slabQuantiles, atomTagScale=self.atomTagScale)
+
+        slabs = [iterMapSlabs(mapName=mapNames['atom'], mapInfo=self.atmmap,
+                              sectionsPerSlab=self.sectionsPerSlab,
+                              log=self.log),
+                 iterMapSlabs(mapName=mapNames['density'],
+                              mapInfo=self.densmap,
+                              sectionsPerSlab=self.sectionsPerSlab,
+                              log=self.log)]
+        if self.calcFCmap:
+            slabs.append(iterMapSlabs(mapName=mapNames['calc'],
+                                      mapInfo=self.FCmap,
+                                      sectionsPerSlab=self.sectionsPerSlab,
+                                      log=self.log))
+        for slab in zip(*slabs):
+            accumulator.addSlab(*[vals for start, vals in slab])
+
+        if self.slabQuantiles != 'exact':
+            # per-atom histograms require a second pass
+            self.lgwrite(
+                ln='Per-atom median and percentile metrics are ' +
+                   'approximate, estimated from {}-bin '.format(
+                    accumulator.numBins) +
+                   'per-atom density histograms (second pass of maps)')
+            accumulator.startSketch()
+            for (s1, atomVals), (s2, densVals) in zip(
+                iterMapSlabs(mapName=mapNames['atom'], mapInfo=self.atmmap,
+                             sectionsPerSlab=self.sectionsPerSlab,
+                             log=self.log),
+                iterMapSlabs(mapName=mapNames['density'],
+                             mapInfo=self.densmap,
+                             sectionsPerSlab=self.sectionsPerSlab,
+                             log=self.log)):
+                accumulator.addSlabToSketch(atomVals, densVals)
+
+        # as in readMap, check that the atom map has been read correctly
+        if accumulator.maxTagVal != self.atmmap.density['max']:
+            error(text='Calculated max voxel value:{} does NOT '.format(
+                       accumulator.maxTagVal) +
+                       'match value stated in file header:{}'.format(
+                       self.atmmap.density['max']),
+                  log=self.log, type='error')
+
+        self.lgwrite(
+            ln='# voxels in total : {}\n'.format(accumulator.numVoxels) +
+               'Total number of voxels assigned to atoms: {}'.format(
+                accumulator.numTagged))
+        self.success()
+        self.stopTimer()
+
+        self.reportDensMapInfo(stats=accumulator.getTotalsStats('density'))
+        if self.calcFCmap:
+            self.reportDensMapInfo(
+                mapType='calc', stats=accumulator.getTotalsStats('calc'))
+
+        self.setAtomMetrics(metrics=accumulator.getMetrics())
+
+        if self.plotScatter:
+            self.plotDensScatterPlots()
+
+    def setAtomMetrics(self,
+                       metrics={}):
+
+        # set per-atom density metrics as attributes of each atom
+        # in the structure. 'metrics' maps attribute names to arrays
+        # of per-atom values, indexed by atom number
+
+        for atom in self.PDBarray:
+            if metrics['numvoxels'][atom.atomnum] == 0:
+                # as calcDensMetricsForAtom, for an atom with no voxels
+                error(
+                    text='No voxels assigned to an atom. Consider ' +
+                         'increasing per-atom search radius parameter in ' +
+                         'RIDL input .txt file.',
+                    log=self.log, type='warning')
+                for name in metrics:
+                    setattr(atom, name, np.nan)
+                atom.numvoxels = 1
+                atom.meanPosOnly = 0
+                atom.meanNegOnly = 0
+            else:
+                for name, vals in metrics.items():
+                    setattr(atom, name, vals[atom.atomnum])
+                atom.numvoxels = int(atom.numvoxels)
+            atom.getAdditionalMetrics()
+
     def readPDBfile(self):
 
         # read in pdb file info here. A list of atom objects
@@ -119,23 +406,54 @@ class maps2DensMetrics(object):
         self.lgwrite(ln='Reading atom-tagged map file...\n' +
                         'Atom map name: {}'.format(self.atomMapIn))
 
-        self.atmmap, self.atomIndices = readMap(
-            dirIn=self.filesIn, dirOut=self.filesOut, mapName=self.atomMapIn,
-            mapType='atom_map', log=self.log)
+        atomMapName = self.filesIn + self.atomMapIn
+        # the map itself is read when its atom numbers are to be
+        # verified, rather than taking them from the cache
+        cached = None
+        if self.useAtomMapCache and not self.verifyCompact:
+            cached = loadAtomMapCache(mapName=atomMapName,
+                                      atomTagScale=self.atomTagScale,
+                                      log=self.log)
+
+        if cached is not None:
+            self.atmmap, self.atomIndices, order = cached
+        else:
+            self.atmmap, self.atomIndices = readMap(
+                dirIn=self.filesIn, dirOut=self.filesOut,
+                mapName=self.atomMapIn, mapType='atom_map', log=self.log,
+                verifyCompact=self.verifyCompact,
+                atomTagScale=self.atomTagScale)
+
+            if self.useAtomMapCache:
+                order = saveAtomMapCache(
+                    mapName=atomMapName, atomMap=self.atmmap,
+                    atomInds=self.atomIndices,
+                    atomTagScale=self.atomTagScale, log=self.log)
+            else:
+                order = None
+
+        checkAtomTagRange(
+            mapInfo=self.atmmap,
+            maxAtomNum=max(atom.atomnum for atom in self.PDBarray),
+            atomTagScale=self.atomTagScale, log=self.log)
+
+        # group the atom-tagged voxels by atom number. This is done
+        # once per atom-tagged map, after which each density map is
+        # read directly in grouped order (see readDensityMap)
+        self.grouping = voxelGrouping(atomNums=self.atmmap.vxls_val,
+                                      order=order)
+        self.groupedIndices = self.grouping.group(self.atomIndices)
         self.stopTimer()
 
         # find number of atoms in structure
         numAtms = len(self.PDBarray)
 
         # find atom numbers present in list (repeated atom numbers removed)
-        seen = set()
-        seenAdd = seen.add
-        uniqAtms = [x for x in self.atmmap.vxls_val if not
-                    (x in seen or seenAdd(x))]
+        uniqAtms = np.unique(self.atmmap.vxls_val)
 
         # find set of atoms numbers not present
         # (i.e atoms not assigned to voxels)
-        AtmsNotPres = set(range(1, numAtms+1)) - set(uniqAtms)
+        AtmsNotPres = set(range(1, numAtms+1)) - set(uniqAtms.tolist())
         self.lgwrite(
             ln='Number of atoms not assigned to voxels: ' +
                '{}'.format(len(AtmsNotPres)))
@@ -149,11 +467,26 @@ class maps2DensMetrics(object):
         self.lgwrite(ln='Reading density map file...\n' +
                         'Density map name: {}'.format(self.densMapIn))
 
-        self.densmap = readMap(dirIn=self.filesIn, dirOut=self.filesOut,
-                               mapName=self.densMapIn, mapType='density_map',
-                               atomInds=self.atomIndices, log=self.log)
+        self.densmap = self.loadDensityMap(mapName=self.densMapIn)
         self.stopTimer()
 
+    def loadDensityMap(self,
+                       mapName='', log=''):
+
+        # read the atom-tagged voxels of a density map, in grouped
+        # order. Log lines are written to 'log' (the log file of the
+        # run if not specified). From a background thread, 'log'
+        # should be a deferredLog (see mapPrefetcher class)
+
+        if log == '':
+            log = self.log
+
+        return readMap(dirIn=self.filesIn, dirOut=self.filesOut,
+                       mapName=mapName, mapType='density_map',
+                       atomInds=self.groupedIndices, log=log,
+                       compact=self.compactDensity,
+                       verifyCompact=self.verifyCompact)
+
     def readFCMap(self):
 
         # read in the FC (calculated structure factor) density map.
@@ -167,24 +500,36 @@ class maps2DensMetrics(object):
 
         self.FCmap = readMap(dirIn=self.filesIn, dirOut=self.filesOut,
                              mapName=self.FCmapIn, mapType='density_map',
-                             atomInds=self.atomIndices, log=self.log)
+                             atomInds=self.groupedIndices, log=self.log,
+                             compact=self.compactDensity,
+                             verifyCompact=self.verifyCompact)
 
         self.stopTimer()
 
     def reportDensMapInfo(self,
-                          numSfs=4, mapType='density'):
+                          numSfs=4, mapType='density', stats=None):
 
-        # report the density map summary information to a log file
+        # report the density map summary information to a log file.
+        # Summary 'stats' of the atom-tagged voxels (mean, min, max,
+        # std and count) can be supplied, if the voxel values
+        # themselves are not held in memory
 
         if mapType == 'density':
             mp = self.densmap
         elif mapType == 'calc':
             mp = self.FCmap
 
-        totalNumVxls = np.product(list(self.atmmap.nxyz.values()))
-        structureNumVxls = len(mp.vxls_val)
+        if stats is None:
+            stats = {'mean': np.mean(mp.vxls_val),
+                     'min': np.min(mp.vxls_val),
+                     'max': np.max(mp.vxls_val),
+                     'std': np.std(mp.vxls_val),
+                     'count': len(mp.vxls_val)}
+
+        totalNumVxls = np.prod(list(self.atmmap.nxyz.values()))
+        structureNumVxls = stats['count']
         totalMean = mp.density['mean']
-        structureMean = np.mean(mp.vxls_val)
+        structureMean = stats['mean']
         solvNumVxls = totalNumVxls - structureNumVxls
         solvMean = (totalNumVxls*totalMean -
                     structureNumVxls*structureMean)/solvNumVxls
@@ -194,18 +539,19 @@ class maps2DensMetrics(object):
                '\tmean structure density : {}\n'.format(
                 round(structureMean, numSfs)) +
                '\tmax structure density : {}\n'.format(
-                round(max(mp.vxls_val), numSfs)) +
+                round(stats['max'], numSfs)) +
                '\tmin structure density : {}\n'.format(
-                round(min(mp.vxls_val), numSfs)) +
+                round(stats['min'], numSfs)) +
                '\tstd structure density : {}\n'.format(
-                round(np.std(mp.vxls_val), numSfs)) +
+                round(stats['std'], numSfs)) +
                '\t# voxels included : {}\n'.format(structureNumVxls) +
                '\nFor voxels assigned to solvent:\n' +
                '\tmean solvent-region density : {}\n'.format(
                 round(solvMean), numSfs) +
                '\t# voxels included : {}'.format(solvNumVxls))
 
-    def checkMapCompatibility(self):
+    def checkMapCompatibility(self,
+                              reportNumVxls=True):
 
         # check that atom-tagged and density map
         # can be combined successfully. This
@@ -213,7 +559,9 @@ class maps2DensMetrics(object):
         # the same map header information. Grid
         # dimensions are permitted to deviate
         # between the two maps, however this is
-        # flagged at run time
+        # flagged at run time. The map modes may
+        # differ (e.g. an int16 atom-tagged map
+        # with a float32 density map)
 
         self.printStepNumber()
         self.lgwrite(
@@ -224,8 +572,7 @@ class maps2DensMetrics(object):
         if (self.atmmap.axis != self.densmap.axis or
             self.atmmap.gridsamp != self.densmap.gridsamp or
             self.atmmap.start != self.densmap.start or
-            self.atmmap.nxyz != self.densmap.nxyz or
-                self.atmmap.type != self.densmap.type):
+                self.atmmap.nxyz != self.densmap.nxyz):
 
             error(text='Incompatible map properties',
                   log=self.log, type='error')
@@ -258,26 +605,27 @@ class maps2DensMetrics(object):
                 ln='The atom and density map are of compatible format!')
         self.stopTimer()
 
-        self.lgwrite(
-            ln='Total number of voxels assigned to atoms: {}'.format(
-                len(self.atmmap.vxls_val)))
+        if reportNumVxls:
+            self.lgwrite(
+                ln='Total number of voxels assigned to atoms: {}'.format(
+                    len(self.atmmap.vxls_val)))
 
     def createVoxelList(self,
                         inclOnlyGluAsp=False):
 
-        # create dictionary of voxels with atom numbers as keys
+        # index the density map voxels by atom number. The maps are
+        # read in grouped order (see readAtomMap), so that the voxels
+        # for each atom are a contiguous slice of a single array,
+        # accessed through vxlsPerAtom (and FCperAtom) with atom
+        # numbers as keys
 
         self.startTimer()
         self.printStepNumber()
         self.lgwrite(ln='Combining voxel density and atom values...')
         self.success()
-        vxlDic = {atm: [] for atm in self.atmmap.vxls_val}
-        xyzDic = {atm: [] for atm in self.atmmap.vxls_val}
 
-        self.densmap.reshape1dTo3d()
-        self.densmap.abs2xyz_params()
-        for atm, dens in zip(self.atmmap.vxls_val, self.densmap.vxls_val):
-            vxlDic[atm].append(dens)
+        vxlDic = groupedValues(grouping=self.grouping,
+                               vals=self.densmap.vxls_val, grouped=True)
 
         self.vxlsPerAtom = vxlDic
 
@@ -287,12 +635,14 @@ class maps2DensMetrics(object):
             # call this extra module that is requried for XYZ analysis
             from perAtomClusterAnalysis import perAtomXYZAnalysis
 
+            self.densmap.reshape1dTo3d()
+            self.densmap.abs2xyz_params()
 
             xyz_list = self.densmap.getVoxXYZ(
-                self.atomIndices, coordType='fractional')
+                self.groupedIndices, coordType='fractional')
 
-            for atm, xyz in zip(self.atmmap.vxls_val, xyz_list):
-                xyzDic[atm].append(xyz)
+            xyzDic = groupedValues(grouping=self.grouping, vals=xyz_list,
+                                   grouped=True)
 
             # get the mid points for each atom from the set of voxels
             # per atom, whilst accounting for symmetry (the asym unit
@@ -320,10 +670,9 @@ class maps2DensMetrics(object):
                 self.xyzsPerAtom = xyzDic2
 
         if self.calcFCmap:
-            vxlDic2 = {atm: [] for atm in self.atmmap.vxls_val}
-            for atm, dens in zip(self.atmmap.vxls_val, self.FCmap.vxls_val):
-                vxlDic2[atm].append(dens)
-            self.FCperAtom = vxlDic2
+            self.FCperAtom = groupedValues(grouping=self.grouping,
+                                           vals=self.FCmap.vxls_val,
+                                           grouped=True)
 
         self.deleteMapsAttributes()
         self.stopTimer()
@@ -382,6 +731,10 @@ class maps2DensMetrics(object):
                 log=self.log, type='warning')
             atomVxls = [np.nan]
 
+        # metrics are always calculated at full precision,
+        # even if the map values are held in compact form
+        atomVxls = np.asarray(atomVxls, dtype=np.float64)
+
         if len(atomVxls) != 0:
             atom.meandensity = np.mean(atomVxls)
             atom.mediandensity = np.median(atomVxls)
@@ -407,73 +760,8 @@ class maps2DensMetrics(object):
                 atom.meanNegOnly = 0
 
             if self.calcFCmap:
-                # if the user has opted to calculate an Fcalc map in addition
-                # to the difference map, then additional metrics can be
-                # derived using this map. These metrics typically use the Fcalc
-                # map density at each voxel to weight the contribution that
-                # each voxel's difference map value should play when
-                # calculating damage metrics. Effectively, a voxel far from an
-                # atom (but still included in the search radius around that
-                # atom) should not contribute to a damage indicator as much as
-                # a voxel close to the atomic centre
-
-                atomFCvals = self.FCperAtom[atom.atomnum]
-                # NOTE: currently set all negative values to zero. This has
-                # effect of ignoring Fcalc density that is less than the map
-                # mean. This is implemented such that all per-voxel weights
-                # (see below) are positive and so therefore sensible
-                # weighted-means can be calculated. This may need to be
-                # reconsidered for future use!
-                atomFCvals = [v if v > 0 else 0 for v in atomFCvals]
-
-                atomFCvalsMaxNormed = np.array(atomFCvals)/max(atomFCvals)
-
-                minIndex = np.array(atomVxls).argmin()
-                weightedVxls = np.multiply(atomVxls, atomFCvalsMaxNormed)
-
-                atom.densityWeightedMean = np.mean(weightedVxls)
-                atom.densityWeightedMin = np.min(weightedVxls)
-                atom.densityWeightedMax = np.max(weightedVxls)
-
-                # the following attribute provides an indication of the
-                # fraction of the local maximum Fcalc map density around
-                # the current atom at the point where the minimum difference
-                # map value has been located to be. A higher value (closer to
-                # 1) indicates that the min density value is found at an
-                # electron density-rich region of space, whereas a lower
-                # value (closer to 0) indicates that the min density value is
-                # located away from where the majority of the electron density
-                # assigned to the atom is predicted to be.
-                atom.fracOfMaxAtomDensAtMin = atomFCvalsMaxNormed[minIndex]
-
-                posVals = [w for w in weightedVxls if w > 0]
-                negVals = [w for w in weightedVxls if w < 0]
-                posValsSum = np.sum(posVals)
-                negValsSum = np.sum(negVals)
-
-                posWeights = [v for v, w in zip(
-                    atomFCvalsMaxNormed, weightedVxls) if w > 0]
-                negWeights = [v for v, w in zip(
-                    atomFCvalsMaxNormed, weightedVxls) if w < 0]
-                posWeightsSum = np.sum(posWeights)
-                negWeightsSum = np.sum(negWeights)
-
-                if posVals != []:
-                    atom.densityWeightedMeanPosOnly = posValsSum/posWeightsSum
-                else:
-                    atom.densityWeightedMeanPosOnly = 0
-
-                if negVals != []:
-                    atom.densityWeightedMeanNegOnly = negValsSum/negWeightsSum
-                else:
-                    atom.densityWeightedMeanNegOnly = 0
-
-                if plotDistn:
-                    # typically only to be used for testing purposes
-                    self.plotFCdistnPlot(
-                        atomsToPlot=['GLU-CD', 'CYS-SG'], atomOfInterest=atom,
-                        atomFCvals=atomFCvals, FCatMin=atomFCvals[minIndex],
-                        atomFCvalsMaxNorm=atomFCvalsMaxNormed)
+                self.calcFCMetricsForAtom(
+                    atom=atom, atomVxls=atomVxls, plotDistn=plotDistn)
 
             if self.doXYZanalysis:
                 # provides the user with the option to also run
@@ -502,6 +790,78 @@ class maps2DensMetrics(object):
 
                 self.densByRegion.append(clustAnalysis.densByRegion)
 
+    def calcFCMetricsForAtom(self,
+                             atom=[], atomVxls=[], plotDistn=False):
+
+        # if the user has opted to calculate an Fcalc map in addition
+        # to the difference map, then additional metrics can be
+        # derived using this map. These metrics typically use the Fcalc
+        # map density at each voxel to weight the contribution that
+        # each voxel's difference map value should play when
+        # calculating damage metrics. Effectively, a voxel far from an
+        # atom (but still included in the search radius around that
+        # atom) should not contribute to a damage indicator as much as
+        # a voxel close to the atomic centre
+
+        atomFCvals = self.FCperAtom[atom.atomnum]
+        # NOTE: currently set all negative values to zero. This has
+        # effect of ignoring Fcalc density that is less than the map
+        # mean. This is implemented such that all per-voxel weights
+        # (see below) are positive and so therefore sensible
+        # weighted-means can be calculated. This may need to be
+        # reconsidered for future use!
+        atomFCvals = [v if v > 0 else 0 for v in
+                      np.asarray(atomFCvals, dtype=np.float64)]
+
+        atomFCvalsMaxNormed = np.array(atomFCvals)/max(atomFCvals)
+
+        minIndex = np.array(atomVxls).argmin()
+        weightedVxls = np.multiply(atomVxls, atomFCvalsMaxNormed)
+
+        atom.densityWeightedMean = np.mean(weightedVxls)
+        atom.densityWeightedMin = np.min(weightedVxls)
+        atom.densityWeightedMax = np.max(weightedVxls)
+
+        # the following attribute provides an indication of the
+        # fraction of the local maximum Fcalc map density around
+        # the current atom at the point where the minimum difference
+        # map value has been located to be. A higher value (closer to
+        # 1) indicates that the min density value is found at an
+        # electron density-rich region of space, whereas a lower
+        # value (closer to 0) indicates that the min density value is
+        # located away from where the majority of the electron density
+        # assigned to the atom is predicted to be.
+        atom.fracOfMaxAtomDensAtMin = atomFCvalsMaxNormed[minIndex]
+
+        posVals = [w for w in weightedVxls if w > 0]
+        negVals = [w for w in weightedVxls if w < 0]
+        posValsSum = np.sum(posVals)
+        negValsSum = np.sum(negVals)
+
+        posWeights = [v for v, w in zip(
+            atomFCvalsMaxNormed, weightedVxls) if w > 0]
+        negWeights = [v for v, w in zip(
+            atomFCvalsMaxNormed, weightedVxls) if w < 0]
+        posWeightsSum = np.sum(posWeights)
+        negWeightsSum = np.sum(negWeights)
+
+        if posVals != []:
+            atom.densityWeightedMeanPosOnly = posValsSum/posWeightsSum
+        else:
+            atom.densityWeightedMeanPosOnly = 0
+
+        if negVals != []:
+            atom.densityWeightedMeanNegOnly = negValsSum/negWeightsSum
+        else:
+            atom.densityWeightedMeanNegOnly = 0
+
+        if plotDistn:
+            # typically only to be used for testing purposes
+            self.plotFCdistnPlot(
+                atomsToPlot=['GLU-CD', 'CYS-SG'], atomOfInterest=atom,
+                atomFCvals=atomFCvals, FCatMin=atomFCvals[minIndex],
+                atomFCvalsMaxNorm=atomFCvalsMaxNormed)
+
     def calcDensMetrics(self,
                         plotDistn=False, showProgress=True, parallel=False,
                         makeTrainSet=False, inclOnlyGluAsp=False,
@@ -525,10 +885,35 @@ class maps2DensMetrics(object):
 
         total = len(self.PDBarray)
 
-        if parallel:
-            # TODO: this would be great to implement at some point
-            print('Parallel processing not currently implemented!')
-            pass
+        # with 'parallel', atoms are sharded by atom number over
+        # all available cores, unless a number of threads is set
+        numThreads = self.numThreads
+        if parallel and numThreads == 1:
+            numThreads = os.cpu_count() or 1
+
+        batch = not (plotDistn or inclOnlyGluAsp or doRandomSubset or
+                     self.doXYZanalysis)
+        if parallel and not batch:
+            error(text='Parallel processing is not available with ' +
+                       'per-atom testing options. Continuing in serial',
+                  log=self.log, type='warning')
+
+        if batch:
+            # in a standard run, the metrics for all atoms are
+            # calculated together from the grouped voxel values
+            maxAtomNum = max(atom.atomnum for atom in self.PDBarray)
+            metrics = calcBatchDensMetrics(
+                grouping=self.grouping, groupedVals=self.vxlsPerAtom.vals,
+                maxAtomNum=maxAtomNum, numThreads=numThreads)
+
+            if self.calcFCmap:
+                metrics.update(calcBatchFCMetrics(
+                    grouping=self.grouping,
+                    groupedVals=self.vxlsPerAtom.vals,
+                    groupedFCvals=self.FCperAtom.vals,
+                    maxAtomNum=maxAtomNum, numThreads=numThreads))
+
+            self.setAtomMetrics(metrics=metrics)
         else:
 
             self.densByRegion = []
@@ -1,4 +1,5 @@
 from errors import error
+from metricStore import stackMetricValues
 import numpy as np
 import sys
 
@@ -61,7 +62,8 @@ class metricNormalisation(object):
 
         # calculate the weighting for each dataset and
         # for each density metric individually here
-        vals = [a.densMetric[metric]['Standard']['values'] for a in normSet]
+        vals = stackMetricValues(
+            atoms=normSet, metric=metric, normType='Standard')
         self.meanweight[metric] = np.nanmean(vals, 0)
         self.stdweight[metric] = np.nanstd(vals, 0)
 
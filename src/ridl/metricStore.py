@@ -0,0 +1,199 @@
+from collections.abc import MutableMapping
+import numpy as np
+
+
+class metricStore(object):
+
+    # a column store of the density metrics for a list of atoms over a
+    # dose series. The values of each (metric, normalisation) pair are
+    # held in a single array of shape (atoms, datasets), with one row
+    # per atom, alongside per-atom identifier columns (atom number,
+    # residue, chain etc.), so that structure-wide statistics can be
+    # computed with a single array operation rather than by looping
+    # over atoms. See metricInfo for the per-atom accessor. The store
+    # counts the changes made to it, so that statistics computed from
+    # its values can tell whether they are out of date
+
+    version = 0
+
+    def __init__(self,
+                 numAtoms=0, numDatasets=0):
+
+        self.numAtoms = numAtoms
+        self.numDatasets = numDatasets
+
+        # identifier columns, of length numAtoms
+        self.columns = {}
+
+        # (metric, normType) --> array of shape (atoms, datasets)
+        self.arrays = {}
+
+    def changed(self):
+        self.version += 1
+
+    def setColumn(self,
+                  name='atomnum', vals=[]):
+
+        # set an identifier column (one value per atom)
+
+        self.columns[name] = np.asarray(vals)
+        self.changed()
+
+    def setValues(self,
+                  metric='loss', normType='Standard', vals=[], rows=None):
+
+        # set the values of a metric for the atoms in 'rows' (all
+        # atoms if not specified). 'vals' has one row per atom, or is
+        # a single row of values if a single row is given. The array
+        # for a metric is created on first use (and filled with nans
+        # for atoms that are not set), taking its number of columns
+        # from the first values given
+
+        self.changed()
+        key = (metric, normType)
+        vals = np.asarray(vals)
+        if key not in self.arrays:
+            if rows is None:
+                self.arrays[key] = vals.copy()
+                return
+            width = vals.shape[-1] if vals.ndim > 0 else 0
+            self.arrays[key] = np.full(
+                (self.numAtoms, width), np.nan,
+                dtype=np.result_type(vals.dtype, np.float64))
+
+        if rows is None:
+            self.arrays[key][:] = vals
+        else:
+            self.arrays[key][rows] = vals
+
+    def getValues(self,
+                  metric='loss', normType='Standard', rows=None):
+
+        # get the values of a metric as an array of shape (atoms,
+        # datasets), for the atoms in 'rows' (all atoms if not
+        # specified). A KeyError is raised for an unknown metric
+
+        arr = self.arrays[(metric, normType)]
+        if rows is None:
+            return arr
+        return arr[rows]
+
+    def getMetrics(self):
+
+        # list the [metric, normType] pairs currently in the store
+
+        return [list(key) for key in self.arrays]
+
+
+class metricInfo(MutableMapping):
+
+    # the information held for one atom for a (metric, normalisation)
+    # pair, as stored in combinedAtom.densMetric[metric][normType].
+    # Behaves as a dict, except that the 'values' entry is a read-only
+    # view onto the atom's row of the corresponding metricStore array.
+    # All other entries (e.g. 'average', 'lin reg') are held per atom,
+    # and any change to them is counted as a change to the store
+
+    def __init__(self,
+                 store=None, row=0, metric='loss', normType='Standard'):
+
+        self.store = store
+        self.row = row
+        self.key = (metric, normType)
+        self.info = {}
+
+    def __getitem__(self, name):
+        if name == 'values':
+            # a read-only view, so that values can only be changed
+            # through __setitem__ (which counts the change)
+            values = self.store.arrays[self.key][self.row]
+            values.setflags(write=False)
+            return values
+        return self.info[name]
+
+    def __setitem__(self, name, value):
+        if name == 'values':
+            self.store.setValues(*self.key, vals=value, rows=self.row)
+        else:
+            self.info[name] = value
+            self.store.changed()
+
+    def __delitem__(self, name):
+        if name == 'values':
+            raise KeyError('metric values cannot be removed from the store')
+        del self.info[name]
+        self.store.changed()
+
+    def __iter__(self):
+        yield 'values'
+        for name in self.info:
+            yield name
+
+    def __len__(self):
+        return len(self.info) + 1
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def stackMetricValues(atoms=[], metric='loss', normType='Standard'):
+
+    # get the values of a metric for a list of combinedAtom objects,
+    # as an array of shape (atoms, datasets). Where all atoms share a
+    # metricStore, this is a single gather from the store's array
+
+    stores = set(id(atom.store) for atom in atoms)
+    if len(stores) == 1:
+        rows = [atom.row for atom in atoms]
+        return atoms[0].store.getValues(metric, normType, rows)
+
+    return np.array(
+        [atom.densMetric[metric][normType]['values'] for atom in atoms])
+
+
+def shareMetricStore(atoms=[], numDatasets=0):
+
+    # hold the density metrics of a list of combinedAtom objects in a
+    # single new metricStore, one row per atom in list order, and point
+    # each atom's densMetric entries at it. The metrics may be held as
+    # plain nested dicts (as in atoms pickled before the store was
+    # introduced) or as metricInfo objects. Value lists of differing
+    # lengths, and metrics missing for an atom, are padded with nans.
+    # Returns the new store
+
+    store = metricStore(numAtoms=len(atoms), numDatasets=numDatasets)
+
+    entries = {}
+    for row, atom in enumerate(atoms):
+        for metric, normTypes in atom.densMetric.items():
+            for normType, info in normTypes.items():
+                entries.setdefault((metric, normType), []).append(
+                    (row, np.asarray(info['values'])))
+
+    for (metric, normType), rowVals in entries.items():
+        widths = [len(vals) for row, vals in rowVals]
+        width = max([numDatasets] + widths)
+        if len(rowVals) == len(atoms) and min(widths) == width:
+            # no padding needed, so the values keep their type
+            # (e.g. occupancies held as strings)
+            arr = np.array([vals for row, vals in rowVals])
+        else:
+            numeric = all(vals.dtype.kind in 'biuf' for row, vals in rowVals)
+            arr = np.full((len(atoms), width), np.nan,
+                          dtype=np.float64 if numeric else object)
+            for row, vals in rowVals:
+                arr[row, :len(vals)] = vals
+        store.setValues(metric=metric, normType=normType, vals=arr)
+
+    for row, atom in enumerate(atoms):
+        atom.store = store
+        atom.row = row
+        for metric, normTypes in atom.densMetric.items():
+            for normType, info in list(normTypes.items()):
+                stored = metricInfo(store=store, row=row, metric=metric,
+                                    normType=normType)
+                stored.info = {name: value for name, value in info.items()
+                               if name != 'values'}
+                normTypes[normType] = stored
+
+    return store
@@ -0,0 +1,111 @@
+from __future__ import division
+from batchDensMetrics import calcBatchDensMetrics, calcBatchFCMetrics
+from voxelGrouping import voxelGrouping
+from multiprocessing import shared_memory
+from mapPrefetcher import deferredLog
+from readMap import readMap
+import numpy as np
+
+
+class sharedArrays(object):
+
+    # a set of named numpy arrays copied into shared memory blocks,
+    # so that worker processes can attach to them by block name
+    # rather than having the arrays pickled and sent to each worker.
+    # The blocks must be released with close() once all workers have
+    # finished with them
+
+    def __init__(self,
+                 arrays={}):
+
+        self.blocks = []
+
+        # (shared memory block name, shape, dtype) for each array
+        self.specs = {}
+
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            block = shared_memory.SharedMemory(
+                create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[:] = arr
+            self.blocks.append(block)
+            self.specs[name] = (block.name, arr.shape, arr.dtype.str)
+
+    def close(self):
+
+        # release the shared memory blocks
+
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def attachSharedArrays(specs={}):
+
+    # attach to arrays held in shared memory (see sharedArrays),
+    # returning the arrays by name and the attached blocks, which
+    # must be closed once the arrays are no longer in use
+
+    arrays = {}
+    blocks = []
+    for name, (blockName, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=blockName)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        blocks.append(block)
+
+    return arrays, blocks
+
+
+def calcDatasetMetrics(specs={}, dirIn='./', dirOut='./', densMapName='',
+                       maxAtomNum=0, compact=False, log=''):
+
+    # worker process task: read the atom-tagged voxels of a single
+    # density map and calculate the per-atom density metrics (and
+    # Fcalc-weighted metrics, if grouped Fcalc values are shared)
+    # for every atom. The voxel grouping of the atom-tagged map is
+    # taken from shared memory. Returns summary statistics of the
+    # atom-tagged density map voxels and the per-atom metrics, as
+    # arrays indexed by atom number, along with the lines written to
+    # the log while reading the map. These are held back (see
+    # deferredLog class) for the parent process to write in dataset
+    # order. If a fatal error is met, the statistics and metrics are
+    # None, and the error message is among the returned log lines
+
+    taskLog = deferredLog(log=log)
+    shared, blocks = attachSharedArrays(specs)
+    try:
+        grouping = voxelGrouping(
+            segments=(shared['starts'], shared['atoms'], shared['counts']))
+
+        densmap = readMap(dirIn=dirIn, dirOut=dirOut, mapName=densMapName,
+                          mapType='density_map',
+                          atomInds=shared['groupedIndices'], log=taskLog,
+                          compact=compact)
+        vals = densmap.vxls_val
+
+        stats = {'mean': np.mean(vals),
+                 'min': np.min(vals),
+                 'max': np.max(vals),
+                 'std': np.std(vals),
+                 'count': len(vals)}
+
+        metrics = calcBatchDensMetrics(
+            grouping=grouping, groupedVals=vals, maxAtomNum=maxAtomNum)
+
+        if 'FCvals' in shared:
+            metrics.update(calcBatchFCMetrics(
+                grouping=grouping, groupedVals=vals,
+                groupedFCvals=shared['FCvals'], maxAtomNum=maxAtomNum))
+
+        # drop references into the shared blocks before detaching
+        del grouping
+    except SystemExit:
+        # raised by a fatal error (see errors class)
+        return None, None, taskLog.lines
+    finally:
+        shared.clear()
+        for block in blocks:
+            block.close()
+
+    return stats, metrics, taskLog.lines
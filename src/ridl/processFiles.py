@@ -11,6 +11,23 @@ import os
 import sys
 
 
+# optional input file properties that control how the density and
+# atom-tagged maps are processed during the metric calculation step
+# (see calculateMetrics class), along with their default values
+MAP_PROC_PROPS = ['numProcesses', 'numThreads', 'prefetchMaps',
+                  'streamMaps', 'compactMaps', 'verifyCompact',
+                  'writeCheckpoints', 'atomTagScale', 'slabQuantiles']
+
+MAP_PROC_DEFAULTS = [1, 1, 'true', 'false', 'false', 'false', 'false', 100,
+                     'exact']
+
+# those of the above that take positive integer values, or one
+# of a set of values (the rest take values 'true' or 'false')
+MAP_PROC_INT_PROPS = ['numProcesses', 'numThreads', 'atomTagScale']
+
+MAP_PROC_CHOICE_PROPS = {'slabQuantiles': ['exact', 'sketch']}
+
+
 class processFiles():
 
     def __init__(self,
@@ -248,7 +265,8 @@ class processFiles():
                              pklDataFile=self.pklDataFile,
                              pdbFileList=pdbFileList, normSet=self.normSet,
                              RIDLinputFile=self.inputFile,
-                             sepPDBperDataset=self.useSeparatePDBperDataset())
+                             sepPDBperDataset=self.useSeparatePDBperDataset(),
+                             **self.getMapProcessingOptions())
 
         # decide whether Fcalc data is present and should be used
         c.inclFCmets = self.includeFCmaps()
@@ -379,10 +397,11 @@ class processFiles():
         props = ['sfall_VDWR', 'mapResLimits', 'scaleType',
                  'densMapType', 'FFTmapWeight', 'calculateFCmaps',
                  'deleteIntermediateFiles', 'useLaterCellDims',
-                 'pklDataFile', 'normSet', 'ignoreSIGFs']
+                 'pklDataFile', 'normSet', 'ignoreSIGFs'] + MAP_PROC_PROPS
 
         defaults = [1, ',', 'anisotropic', 'DIFF',
-                    'false', 'true', 'true', 'false', '', 'CALPHA', 'false']
+                    'false', 'true', 'true', 'false', '', 'CALPHA',
+                    'false'] + MAP_PROC_DEFAULTS
 
         for i, prop in enumerate(props):
             try:
@@ -487,6 +506,29 @@ class processFiles():
                              'Currently for one batch, the "initial" and "later"' +
                              ' datasets are both called "{}".'.format(sameName))
 
+        # ensure that map processing options take suitable values
+        for prop in MAP_PROC_PROPS:
+            val = str(getattr(self, prop))
+            if prop in MAP_PROC_INT_PROPS:
+                if not val.isdigit() or int(val) < 1:
+                    self.writeError(
+                        text='"{}" input must be a positive '.format(prop) +
+                             'integer. Currently set as "{}"'.format(val) +
+                             ' in input file.')
+            elif prop in MAP_PROC_CHOICE_PROPS:
+                choices = MAP_PROC_CHOICE_PROPS[prop]
+                if val.lower() not in choices:
+                    self.writeError(
+                        text='"{}" input must take one of '.format(prop) +
+                             'values "{}". '.format('", "'.join(choices)) +
+                             'Currently set as "{}" in input file.'.format(
+                              val))
+            elif val.lower() not in ('true', 'false'):
+                self.writeError(
+                    text='"{}" input must take value "true" '.format(prop) +
+                         'or "false". Currently set as "{}"'.format(val) +
+                         ' in input file.')
+
         # ensure that initial dataset names of suitable lengths
         if not self.highDsetOnly:
             for n in self.name1.split(','):
@@ -1070,6 +1112,24 @@ class processFiles():
         else:
             return True
 
+    def getMapProcessingOptions(self):
+
+        # interpret from input file how the maps should be processed
+        # during the metric calculation step. Returns the options as
+        # keyword arguments for the calculateMetrics class
+
+        options = {}
+        for prop in MAP_PROC_PROPS:
+            val = str(getattr(self, prop))
+            if prop in MAP_PROC_INT_PROPS:
+                options[prop] = int(val)
+            elif prop in MAP_PROC_CHOICE_PROPS:
+                options[prop] = val.lower()
+            else:
+                options[prop] = val.lower() == 'true'
+
+        return options
+
     def whetherIgnoreSIGFs(self):
 
         # interpret from input file whether to use SIGF coefficients
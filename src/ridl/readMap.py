@@ -1,57 +1,29 @@
 from __future__ import division
-from struct import unpack, calcsize
-from classHolder import MapInfo
+from mapHeader import readMapHeader, MODE_DTYPES
 from errors import error
 import os
 import mmap
 import numpy as np
-from functools import reduce
 
 
 def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
             mapType='atom_map', atomInds=[], log='',
-            standardise=False, fixMaxMapVal=''):
+            standardise=False, fixMaxMapVal='', compact=False,
+            verifyCompact=False, atomTagScale=100):
 
-    # a function to read in a .map file of either density or atom-tagged type
-
-    # define 'rho' electron map object
-    rho = MapInfo()
+    # a function to read in a .map file of either density or atom-tagged type.
+    # Map modes 0 (int8), 1 (int16), 2 (float32) and 12 (float16) can be
+    # read. Atom numbers are returned as uint32 (the map value divided by
+    # 'atomTagScale', 100 for SFALL atom-tagged maps). If 'compact' is
+    # set, density values are held as float16 rather than float64, and
+    # 'verifyCompact' compares these against the full precision values
 
     mapName = dirIn + mapName
     filesize = os.path.getsize(mapName)
     log.writeToLog(str='Map file of size {} bytes to be read'.format(filesize))
 
-    # open electron density .map file here (bmf for binary map file)
-    if os.name != 'nt':
-        with open(mapName) as f:
-            bmf = mmap.mmap(
-                f.fileno(), 0, prot=mmap.PROT_READ, flags=mmap.MAP_PRIVATE)
-    else:
-        with open(mapName, "r+b") as f:
-            bmf = mmap.mmap(f.fileno(), 0)
-
-    # start adding header information into MapInfo class format.
-    # Note the unpacking of a struct for each byte, read as a long 'l'
-    for n in ('nx', 'ny', 'nz'):
-        rho.nxyz[n] = unpack('=l', bmf.read(4))[0]
-
-    rho.type = unpack('=l', bmf.read(4))[0]
-
-    for s in ('fast', 'med', 'slow'):
-        rho.start[s] = unpack('=l', bmf.read(4))[0]
-
-    for g in ('1', '2', '3'):
-        rho.gridsamp[g] = unpack('=l', bmf.read(4))[0]
-
-    for d in ('a', 'b', 'c', 'alpha', 'beta', 'gamma'):
-        # cell dims stored as float not long int
-        rho.celldims[d] = unpack('f', bmf.read(4))[0]
-
-    for a in ('fast', 'med', 'slow'):
-        rho.axis[a] = unpack('=l', bmf.read(4))[0]
-
-    for d in ('min', 'max', 'mean'):
-        rho.density[d] = unpack('f', bmf.read(4))[0]
+    # define 'rho' electron map object, filled from the map header
+    rho = readMapHeader(mapName=mapName, log=log)
 
     s = rho.getHeaderInfo(tab=True)
 
@@ -63,121 +35,60 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
     else:
         print(s)
 
-    # calculate the last nx*ny*nz bytes of file (corresponding to
-    # the position of the 3D electron density array). Note factor
-    # of 4 is included since 4-byte floats used for electron
-    # density array values.
+    mapStdev = round(rho.rms, 5)
 
-    densitystart = filesize - 4*(reduce(lambda x, y: x*y, list(rho.nxyz.values())))
+    # numpy data type of each voxel value, given the map mode
+    if rho.type not in MODE_DTYPES:
+        error(text='Unknown .map type --> {} (types '.format(rho.type) +
+                   '{} supported) - consult .map '.format(
+                    ', '.join(map(str, sorted(MODE_DTYPES)))) +
+                   'header in MAPDUMP(CCP4) to check', log=log, type='error')
+    voxelType = np.dtype(rho.byteOrder + MODE_DTYPES[rho.type])
 
-    # if sys.version_info[0] >= 3:
-    #     import functools
-    #     densitystart = filesize - 4*(functools.reduce(lambda x, y: x*y, list(rho.nxyz.values())))
-    # else:
-    #     densitystart = filesize - 4*(reduce(lambda x, y: x*y, list(rho.nxyz.values())))
+    # calculate the last nx*ny*nz voxels of file (corresponding to
+    # the position of the 3D electron density array)
 
-    # get symmetry operations from map header
-    for j in range(23, 58):
-        if j != 53 and j < 57:
+    numVoxels = rho.getNumVoxels()
+    densitystart = filesize - voxelType.itemsize*numVoxels
 
-            if j != 55:
-                val = unpack('=l', bmf.read(4))[0]
-            else:
-                val = unpack('=f', bmf.read(4))[0]
+    # open electron density .map file here (bmf for binary map file)
+    if os.name != 'nt':
+        with open(mapName) as f:
+            bmf = mmap.mmap(
+                f.fileno(), 0, prot=mmap.PROT_READ, flags=mmap.MAP_PRIVATE)
+    else:
+        with open(mapName, "r+b") as f:
+            bmf = mmap.mmap(f.fileno(), 0)
 
-            if j == 24:
-                numSymBytes = val
+    # view the density block of the file directly as an array
+    # of voxel values (no copy made), in the file's byte order
+    data = np.frombuffer(bmf, dtype=voxelType, count=numVoxels,
+                         offset=densitystart)
 
-            if j == 55:
-                mapStdev = round(val, 5)
+    if mapType in ('atom_map'):
+        # pick out the voxels that have been tagged with an atom
+        # number. A voxel value which truncates to 0 has no atom
+        # assigned to it
+        atomInds = np.nonzero((data >= 1) | (data <= -1))[0]
+        density = data[atomInds].astype(np.float64)
+        log.writeToLog(str='# voxels in total : {}'.format(numVoxels))
+
+    # efficient way to read through density map file
+    # using indices of atoms from atom map file above
+    elif mapType in ('density_map'):
 
-        elif j < 57:
-            for i in range(4):
-                val = unpack('c', bmf.read(1))[0]
-        else:
-            for i in range(10):
-                for k in range(80):
-                    char = unpack('c', bmf.read(1))[0]
-    symOps = []
-
-    for j in range(numSymBytes // 80):
-        line = ''
-        for k in range(80):
-            char = unpack('=c', bmf.read(1))[0].decode("utf-8")
-            line += char
-        symOps.append(line)
-    rho.curateSymOps(symOps)
-
-    # next seek start of electron density data
-    bmf.seek(densitystart, 0)
-
-    # if electron density written in shorts this is not
-    # currently expected, so program will halt
-    if rho.type == 1:
-        error(text='Untested .map type --> 1 (type 2 expected). ' +
-                   'Values read as int16 ("i2?") - consult .map header in ' +
-                   'MAPDUMP(CCP4) to check', log=log, type='error')
-
-    # if electron density written in floats (which is to be expected
-    # from FFT-CCP4 outputted .map file of electron density)
-    if rho.type == 2:
-
-        # the length of the each data chunk to read map voxels below
-        struct_fmt = '=f'
-        struct_len = calcsize(struct_fmt)
-        # should get struct_len = 4
-        if struct_len != 4:
-            error(text='Bad data chunk length assigned when reading map',
-                  log=log, type='error')
-
-        density = []
-        appenddens = density.append
-
-        if mapType in ('atom_map'):
-            atomInds = []
-            appendindex = atomInds.append
-            counter = -1
-            while True:
-                data = bmf.read(struct_len)
-                if not data:
-                    break
-                s = unpack(struct_fmt, data)[0]
-                counter += 1
-                if int(s) == 0:
-                    continue
-                else:
-                    appenddens(s)
-                    appendindex(counter)
-            log.writeToLog(str='# voxels in total : {}'.format(counter + 1))
-
-        # efficient way to read through density map file
-        # using indices of atoms from atom map file above
-        elif mapType in ('density_map'):
-
-            for i in range(0, len(atomInds)):
-                if i != 0:
-                    bmf.read(struct_len*(atomInds[i]-atomInds[i-1] - 1))
-                else:
-                    bmf.read(struct_len*(atomInds[0]))
-
-                data = bmf.read(struct_len)
-                s = unpack(struct_fmt, data)[0]
-                appenddens(s)
-
-            # check that resulting list of same length as atomInds
-            if len(density) != len(atomInds):
-                error(text='Failure to process the density map ' +
-                           'using atom-tagged map', log=log, type='error')
-
-            # UNCOMMENT TO INSTEAD READ IN ALL VOXELS
-            # while True:
-            #     data = bmf.read(struct_len)
-            #     if not data: break
-            #     s = unpack(struct_fmt,data)[0]
-            #     appenddens(s)
+        density = gatherVoxels(data, atomInds)
 
-        else:
-            error(text='Unknown map type!', log=log, type='error')
+        # check that resulting list of same length as atomInds
+        if len(density) != len(atomInds):
+            error(text='Failure to process the density map ' +
+                       'using atom-tagged map', log=log, type='error')
+
+    else:
+        error(text='Unknown map type!', log=log, type='error')
+
+    # the view must be released before the mmap can be closed
+    del data
     bmf.close()
 
     # as a check that file has been read correctly, check that the min
@@ -190,21 +101,37 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
     # guarantee that the max and min voxel values may be non atom voxels and
     # thus removed
     if mapType in ('atom_map'):
-        if max(density) == rho.density['max']:
+        if np.max(density) == rho.density['max']:
             log.writeToLog(
                 str='calculated max voxel value match value ' +
                     'stated in file header')
         else:
             error(
                 text='Calculated max voxel value:{} does NOT '.format(
-                    max(density)) +
+                    np.max(density)) +
                 'match value stated in file header:{}'.format(
                     rho.density['max']),
                 log=log, type='error')
 
     # if each voxel value is an atom number, then want to convert to integer
     if mapType in ('atom_map'):
-        density_final = [int(dens // 100) for dens in density]
+        density_final = np.floor_divide(density, atomTagScale)
+
+        # tags below 1 (e.g. from negative voxel values) name no atom
+        # and cannot be held as unsigned atom numbers, so are removed
+        tagged = density_final >= 1
+        atomNums = np.where(tagged, density_final, 0).astype(np.uint32)
+        if verifyCompact:
+            verifyCompactValues(compactVals=atomNums,
+                                fullVals=density_final, mapType=mapType,
+                                log=log)
+        if not tagged.all():
+            log.writeToLog(
+                str='# voxels with atom tags below 1 ignored : {}'.format(
+                    np.count_nonzero(~tagged)))
+            atomInds = atomInds[tagged]
+            atomNums = atomNums[tagged]
+        density_final = atomNums
     elif mapType in ('density_map'):
         density_final = density
     else:
@@ -212,7 +139,7 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
 
     # provide option to standardise density to map mean and standard deviation
     if standardise and mapType in ('density_map'):
-        density_final = (np.array(density_final)-rho.density['mean'])/mapStdev
+        density_final = (density_final-rho.density['mean'])/mapStdev
 
         if fixMaxMapVal != '':
             density_final /= np.max(np.absolute(density_final))
@@ -223,7 +150,14 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
                         fixMaxMapVal))
             density_final *= fixMaxMapVal
 
-        density_final = density_final.tolist()
+    # provide option to hold density values at reduced precision
+    if compact and mapType in ('density_map'):
+        compactVals = density_final.astype(np.float16)
+        if verifyCompact:
+            verifyCompactValues(compactVals=compactVals,
+                                fullVals=density_final, mapType=mapType,
+                                log=log)
+        density_final = compactVals
 
     rho.vxls_val = density_final
 
@@ -231,3 +165,89 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
         return rho, atomInds
     else:
         return rho
+
+
+def gatherVoxels(data, voxelInds):
+
+    # gather the values of a flattened map at a set of 1d voxel
+    # indices (typically the atom-tagged voxels from an atom map)
+    # in a single fancy-indexing operation. Indices lying outside
+    # of the map are dropped, so that a returned array shorter
+    # than the input indices flags incompatible maps
+
+    voxelInds = np.asarray(voxelInds, dtype=np.intp)
+    inMap = (voxelInds >= 0) & (voxelInds < len(data))
+    if not inMap.all():
+        voxelInds = voxelInds[inMap]
+
+    return data[voxelInds].astype(np.float64)
+
+
+def verifyCompactValues(compactVals=[], fullVals=[], mapType='density_map',
+                        log='', tolerance=1e-3):
+
+    # compare the compact in-memory representation of map values
+    # against the full precision values read from the map. Atom
+    # numbers must match exactly (and atom tags below 1 cannot be
+    # held as atom numbers), whereas densities must agree to within
+    # a relative tolerance of the float16 precision
+
+    fullVals = np.asarray(fullVals, dtype=np.float64)
+    diff = np.abs(compactVals.astype(np.float64) - fullVals)
+
+    if mapType in ('atom_map'):
+        numBelow1 = np.count_nonzero(fullVals < 1)
+        if numBelow1 != 0:
+            error(text='{} atom tags below 1 cannot be '.format(numBelow1) +
+                       'held as atom numbers', log=log, type='warning')
+        passed = not diff.any() and numBelow1 == 0
+        tolerance = 0
+    else:
+        scale = np.max(np.abs(fullVals)) if len(fullVals) != 0 else 0
+        passed = np.all(diff <= tolerance*scale)
+
+    maxDiff = np.max(diff) if len(diff) != 0 else 0
+    log.writeToLog(
+        str='Compact {} storage verified against full '.format(mapType) +
+            'precision values: max abs difference {}'.format(maxDiff))
+
+    if not passed:
+        error(text='Compact {} values differ from full '.format(mapType) +
+                   'precision values by more than a relative tolerance ' +
+                   'of {}'.format(tolerance), log=log, type='warning')
+
+    return passed
+
+
+def checkAtomTagRange(mapInfo=None, maxAtomNum=0, atomTagScale=100, log=''):
+
+    # check that the mode of an atom-tagged map can hold the voxel
+    # value tagging the highest atom number of the structure (atom
+    # number multiplied by 'atomTagScale'). Integer modes are limited
+    # by their largest value, and float modes by the largest integer
+    # held exactly. A map whose max voxel value sits at the limit of
+    # its mode is also rejected, since its tags have likely saturated
+
+    voxelType = np.dtype(MODE_DTYPES[mapInfo.type])
+    if voxelType.kind == 'i':
+        maxTag = np.iinfo(voxelType).max
+    else:
+        maxTag = 2**(np.finfo(voxelType).nmant + 1)
+
+    if maxAtomNum*atomTagScale > maxTag:
+        error(text='Atom-tagged map mode {} ({}) cannot '.format(
+                   mapInfo.type, voxelType.name) +
+                   'hold atom tags up to {} '.format(
+                   maxAtomNum*atomTagScale) +
+                   '(max atom number {} with tag scale {}). '.format(
+                   maxAtomNum, atomTagScale) +
+                   'Largest tag held is {}'.format(maxTag),
+              log=log, type='error')
+
+    if mapInfo.density['max'] >= maxTag:
+        error(text='Atom-tagged map max voxel value {} '.format(
+                   mapInfo.density['max']) +
+                   'reaches the limit of map mode {} ({}). '.format(
+                   mapInfo.type, voxelType.name) +
+                   'Atom tags have likely overflowed',
+              log=log, type='error')
@@ -1,6 +1,12 @@
 from future import standard_library
 standard_library.install_aliases()
 from progbar import progress
+from classHolder import singlePDB
+import numpy as np
+import numbers
+import struct
+import json
+import os
 
 import sys
 if sys.version_info[0] < 3:
@@ -12,6 +18,15 @@ else:
 # each dose level to save running time consuming scripts calculating
 # electron density values to each atom in structure
 
+# file name ending and leading bytes of a columnar atom table file
+# (see save_atomtable), and the version of the file layout
+ATOM_TABLE_SUFFIX = '_data.atomtable'
+ATOM_TABLE_MAGIC = b'RIDLATAB'
+ATOM_TABLE_VERSION = 1
+
+# byte alignment of each column within an atom table file
+ATOM_TABLE_ALIGN = 64
+
 
 def save_objectlist(PDBlist, pdbName):
     # to save current PDB list in a file:
@@ -88,3 +103,229 @@ def retrieveGenericObject(
     with open(fileName, 'rb') as input:
         obj = pickle.load(input)
     return obj
+
+
+def getColumn(PDBlist=[], attr=''):
+
+    # gather an attribute over a list of atom objects as a single
+    # array, or None if the attribute is not a scalar number or
+    # string for every atom (and so is not stored in atom tables)
+
+    vals = [getattr(atom, attr, None) for atom in PDBlist]
+    if all(isinstance(v, str) for v in vals):
+        return np.array(vals, dtype=str)
+    if not all(isinstance(v, numbers.Number) and not isinstance(v, bool)
+               for v in vals):
+        return None
+    if all(isinstance(v, numbers.Integral) for v in vals):
+        return np.array(vals, dtype=np.int64)
+    return np.array(vals, dtype=np.float64)
+
+
+def alignOffset(offset=0):
+
+    # round a file offset up to the atom table column alignment
+
+    return -(-offset // ATOM_TABLE_ALIGN)*ATOM_TABLE_ALIGN
+
+
+def getAtomColumns(PDBlist=[]):
+
+    # gather every scalar attribute over a list of atom objects
+    # into one array per attribute, ordered by atom number
+
+    PDBlist = sorted(PDBlist, key=lambda x: x.atomnum)
+
+    attrs = []
+    for atom in PDBlist[:1]:
+        attrs = sorted(vars(atom))
+
+    columns = {}
+    for attr in attrs:
+        col = getColumn(PDBlist, attr)
+        if col is not None:
+            columns[attr] = col
+
+    return columns
+
+
+def save_atomtable(PDBlist, pdbName, columns=None):
+
+    # save a list of atom objects as a columnar atom table file,
+    # holding one contiguous array per attribute (identifier fields
+    # and metrics) rather than a pickle of each atom. The file is a
+    # short header (the magic bytes, the header length, and a json
+    # description of each column) followed by the column arrays,
+    # each aligned so that they can be memory-mapped in place.
+    # The columns may be supplied if already gathered (see
+    # getAtomColumns)
+
+    if columns is None:
+        columns = getAtomColumns(PDBlist)
+
+    layout = []
+    offset = 0
+    for attr, col in columns.items():
+        col = col.astype(col.dtype.newbyteorder('<'))
+        layout.append((attr, col, offset))
+        offset = alignOffset(offset + col.nbytes)
+
+    numAtoms = len(PDBlist)
+    header = json.dumps(
+        {'version': ATOM_TABLE_VERSION,
+         'numAtoms': numAtoms,
+         'columns': [{'name': attr, 'dtype': col.dtype.str, 'offset': off}
+                     for attr, col, off in layout]}).encode('utf-8')
+
+    dataStart = alignOffset(len(ATOM_TABLE_MAGIC) + 4 + len(header))
+
+    filename = str(numAtoms)+'_'+pdbName+ATOM_TABLE_SUFFIX
+    with open(filename, 'wb') as output:
+        output.write(ATOM_TABLE_MAGIC)
+        output.write(struct.pack('<I', len(header)))
+        output.write(header)
+        for attr, col, off in layout:
+            output.seek(dataStart + off)
+            output.write(col.tobytes())
+    return filename
+
+
+class atomTable(object):
+
+    # a columnar atom table file (see save_atomtable), memory-mapped
+    # so that only the columns (identifier fields or metrics) that
+    # are used are read from disk. Columns are accessed by attribute
+    # name as read-only arrays, ordered by atom number. A table can
+    # instead be held in memory, from columns gathered by
+    # getAtomColumns, without being written to file
+
+    def __init__(self,
+                 fileName='untitled'+ATOM_TABLE_SUFFIX, columns=None):
+
+        self.fileName = fileName
+        self.columns = columns
+
+        if columns is not None:
+            self.fields = list(columns)
+            self.numAtoms = 0
+            for col in columns.values():
+                self.numAtoms = len(col)
+            return
+
+        with open(fileName, 'rb') as input:
+            magic = input.read(len(ATOM_TABLE_MAGIC))
+            if magic != ATOM_TABLE_MAGIC:
+                sys.exit('File {} is not a RIDL atom table'.format(fileName))
+            headerLength = struct.unpack('<I', input.read(4))[0]
+            header = json.loads(input.read(headerLength).decode('utf-8'))
+
+        if header['version'] != ATOM_TABLE_VERSION:
+            sys.exit('Atom table {} written by an '.format(fileName) +
+                     'incompatible version of RIDL')
+
+        self.numAtoms = header['numAtoms']
+        self.dataStart = alignOffset(
+            len(ATOM_TABLE_MAGIC) + 4 + headerLength)
+        self.columnInfo = {col['name']: col for col in header['columns']}
+        self.fields = [col['name'] for col in header['columns']]
+
+        if os.path.getsize(fileName) > self.dataStart:
+            self.buffer = np.memmap(fileName, dtype=np.uint8, mode='r')
+        else:
+            self.buffer = np.zeros(0, dtype=np.uint8)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def __len__(self):
+        return self.numAtoms
+
+    def __getitem__(self, field):
+
+        # the (memory-mapped) column for an attribute
+
+        if self.columns is not None:
+            return self.columns[field]
+
+        info = self.columnInfo[field]
+        dtype = np.dtype(info['dtype'])
+        start = self.dataStart + info['offset']
+        return self.buffer[start:start + dtype.itemsize*self.numAtoms].view(
+            dtype)
+
+    def getColumns(self,
+                   fields=[]):
+
+        # a subset of columns, by attribute name
+
+        return {field: self[field] for field in fields}
+
+    def toAtomList(self,
+                   fields=None):
+
+        # build a list of atom objects (as retrieve_objectlist) with
+        # only the chosen attributes set (all attributes by default)
+
+        if fields is None:
+            fields = self.fields
+        cols = [(f, self[f].tolist()) for f in fields if f in self]
+
+        atoms = []
+        for i in range(self.numAtoms):
+            atom = singlePDB()
+            for f, vals in cols:
+                setattr(atom, f, vals[i])
+            atoms.append(atom)
+        return atoms
+
+
+def retrieve_atomtable(fileName='untitled'+ATOM_TABLE_SUFFIX, logFile=''):
+
+    # open a columnar atom table file (see save_atomtable)
+
+    ln = 'Retrieving dataset from atom table file...'
+    if logFile != '':
+        logFile.writeToLog(str=ln)
+    else:
+        print(ln)
+
+    table = atomTable(fileName=fileName)
+
+    ln = 'Number of atoms in file: ' + str(table.numAtoms)
+    if logFile != '':
+        logFile.writeToLog(str=ln)
+    else:
+        print(ln)
+
+    return table
+
+
+def retrieveAtomDataset(fileName='', fields=None, logFile=''):
+
+    # retrieve a list of atom objects for a dataset, from either
+    # a columnar atom table file or an older per-atom .pkl file
+
+    if fileName.endswith(ATOM_TABLE_SUFFIX):
+        table = retrieve_atomtable(fileName=fileName, logFile=logFile)
+        return table.toAtomList(fields=fields)
+    return retrieve_objectlist(fileName=fileName, logFile=logFile)
+
+
+def convertPklToAtomTable(fileName='untitled_data.pkl', logFile=''):
+
+    # convert a per-atom .pkl file (from save_objectlist) into a
+    # columnar atom table file, written alongside the .pkl file.
+    # The name of the new file is returned
+
+    PDBlist = retrieve_objectlist(fileName=fileName, logFile=logFile)
+
+    # file name of form str(len(PDBlist))+'_'+pdbName+'_data.pkl'
+    baseName = os.path.basename(fileName)
+    pdbName = baseName.split('_', 1)[1][:-len('_data.pkl')]
+
+    tableName = save_atomtable(PDBlist, pdbName)
+    newName = os.path.join(os.path.dirname(fileName), tableName)
+    if newName != tableName:
+        os.replace(tableName, newName)
+
+    return newName
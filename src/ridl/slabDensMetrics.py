@@ -0,0 +1,360 @@
+from __future__ import division
+from mapHeader import MODE_DTYPES, HEADER_SIZE
+from voxelGrouping import getSegments
+from batchDensMetrics import segmentedPercentile, segmentedMedian
+from batchDensMetrics import PERCENTILES
+from errors import error
+import numpy as np
+import os
+
+
+def iterMapSlabs(mapName='', mapInfo=None, sectionsPerSlab=10, log=''):
+
+    # walk through the data block of a .map file a slab of sections
+    # (along the slow axis) at a time. The same bounded buffer is
+    # reused for every slab, so callers must copy any values they
+    # wish to keep. Yields the 1d index of the first voxel in each
+    # slab and the voxel values within the slab. A map file too
+    # short to hold all of its voxels is an error
+
+    voxelType = np.dtype(mapInfo.byteOrder + MODE_DTYPES[mapInfo.type])
+    numVoxels = mapInfo.getNumVoxels()
+    sectionSize = mapInfo.nxyz['nx']*mapInfo.nxyz['ny']
+    slabSize = sectionSize*max(int(sectionsPerSlab), 1)
+    dataStart = os.path.getsize(mapName) - voxelType.itemsize*numVoxels
+    if dataStart < HEADER_SIZE:
+        error(text='Map file "{}" too short to contain '.format(mapName) +
+                   'its {} voxels'.format(numVoxels), log=log, type='error')
+
+    buff = np.empty(min(slabSize, numVoxels), dtype=voxelType)
+    with open(mapName, 'rb') as f:
+        f.seek(dataStart)
+        for start in range(0, numVoxels, slabSize):
+            slab = buff[:min(slabSize, numVoxels - start)]
+            numRead = f.readinto(memoryview(slab).cast('B'))
+            if numRead != slab.nbytes:
+                error(text='Map file "{}" ended after '.format(mapName) +
+                           '{} of {} voxels'.format(
+                            start + numRead//voxelType.itemsize, numVoxels),
+                      log=log, type='error')
+            yield start, slab
+
+
+class slabDensAccumulator(object):
+
+    # accumulate per-atom density summary statistics from atom-tagged,
+    # density and (optionally) Fcalc maps, a slab of each map at a
+    # time. Running per-atom counts, means, sums of squared deviations
+    # (combined between slabs as for a parallel variance calculation),
+    # min/max and positive/negative partial sums are kept, so that all
+    # of the metrics of maps2DensMetrics.calcDensMetricsForAtom can be
+    # found without holding the maps in memory. Per-atom percentiles
+    # are either 'exact' or from a 'sketch'. For 'exact', the atom
+    # number and density of every atom-tagged voxel are kept (about 8
+    # bytes per voxel as the maps are walked, peaking at about 28
+    # bytes per voxel as the percentiles are found), so memory still
+    # scales with the number of atom-tagged voxels, and only the
+    # whole-map arrays of a full read are saved. For 'sketch', a
+    # per-atom histogram of numBins bins is filled on a second pass
+    # through the maps, so memory scales only with the number of
+    # atoms, and the median and percentile metrics are approximate
+
+    def __init__(self,
+                 maxAtomNum=0, calcFCmap=True, quantiles='exact',
+                 numBins=128, atomTagScale=100):
+
+        # atom numbers above maxAtomNum are ignored
+        self.maxAtomNum = maxAtomNum
+        self.calcFCmap = calcFCmap
+        self.quantiles = quantiles
+        self.numBins = numBins
+        self.atomTagScale = atomTagScale
+
+        n = maxAtomNum + 1
+        self.count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n)
+        self.M2 = np.zeros(n)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+        self.posSum = np.zeros(n)
+        self.posCount = np.zeros(n, dtype=np.int64)
+        self.negSum = np.zeros(n)
+        self.negCount = np.zeros(n, dtype=np.int64)
+
+        if calcFCmap:
+            # FC values are clipped at zero. Weighted sums are kept
+            # unscaled, and divided by the per-atom max FC at the end
+            self.FCmax = np.full(n, -np.inf)
+            self.FCatMin = np.zeros(n)
+            self.wSum = np.zeros(n)
+            self.wMin = np.full(n, np.inf)
+            self.wMax = np.full(n, -np.inf)
+            self.wPosSum = np.zeros(n)
+            self.wPosWeight = np.zeros(n)
+            self.wPosCount = np.zeros(n, dtype=np.int64)
+            self.wNegSum = np.zeros(n)
+            self.wNegWeight = np.zeros(n)
+            self.wNegCount = np.zeros(n, dtype=np.int64)
+
+        # kept values for exact percentiles
+        self.keptAtoms = []
+        self.keptDens = []
+
+        # summary over every atom-tagged voxel, for map reporting
+        self.numVoxels = 0
+        self.numTagged = 0
+        self.maxTagVal = -np.inf
+        self.mapTotals = {'density': self.newTotals()}
+        if calcFCmap:
+            self.mapTotals['calc'] = self.newTotals()
+
+    def newTotals(self):
+
+        # running totals over all atom-tagged voxels of a map
+
+        return {'count': 0, 'sum': 0., 'sumSq': 0.,
+                'min': np.inf, 'max': -np.inf}
+
+    def addToTotals(self,
+                    totals={}, vals=[]):
+
+        # add a slab of values to a map's running totals
+
+        if len(vals) == 0:
+            return
+        totals['count'] += len(vals)
+        totals['sum'] += np.sum(vals)
+        totals['sumSq'] += np.sum(vals**2)
+        totals['min'] = min(totals['min'], np.min(vals))
+        totals['max'] = max(totals['max'], np.max(vals))
+
+    def getTotalsStats(self,
+                       mapType='density'):
+
+        # mean, min, max, std and number of atom-tagged
+        # voxels for a map, from the running totals
+
+        t = self.mapTotals[mapType]
+        mean = t['sum']/t['count']
+        std = np.sqrt(max(t['sumSq']/t['count'] - mean**2, 0))
+        return {'mean': mean, 'min': t['min'], 'max': t['max'],
+                'std': std, 'count': t['count']}
+
+    def getTaggedVoxels(self,
+                        atomVals=[], firstPass=True):
+
+        # find the atom-tagged voxels within a slab of the atom map,
+        # and the atom number assigned to each, as in readMap
+
+        tagged = np.nonzero((atomVals >= 1) | (atomVals <= -1))[0]
+        tagVals = atomVals[tagged].astype(np.float64)
+        if firstPass:
+            if len(tagVals) != 0:
+                self.maxTagVal = max(self.maxTagVal, np.max(tagVals))
+            self.numTagged += len(tagged)
+
+        atomNums = np.floor_divide(tagVals, self.atomTagScale)
+        keep = (atomNums >= 1) & (atomNums <= self.maxAtomNum)
+
+        return tagged[keep], atomNums[keep].astype(np.intp)
+
+    def addSlab(self,
+                atomVals=[], densVals=[], FCvals=None):
+
+        # add a single slab of the atom-tagged, density
+        # and Fcalc maps to the running per-atom statistics
+
+        self.numVoxels += len(atomVals)
+        tagged, atomNums = self.getTaggedVoxels(atomVals)
+
+        allDens = densVals[tagged].astype(np.float64)
+        self.addToTotals(self.mapTotals['density'], allDens)
+
+        # sort the slab voxels by atom, and then by density. The
+        # sort is stable, so the first voxel for each atom is
+        # the first occurrence of that atom's min density
+        order = np.lexsort((allDens, atomNums))
+        atomNums = atomNums[order]
+        dens = allDens[order]
+        starts, atoms, counts = getSegments(atomNums)
+        if len(atoms) == 0:
+            return
+
+        ends = starts + counts - 1
+        sums = np.add.reduceat(dens, starts)
+        slabMean = sums/counts
+        slabM2 = np.add.reduceat(
+            (dens - np.repeat(slabMean, counts))**2, starts)
+
+        # combine slab mean and squared deviations with previous slabs
+        prevCount = self.count[atoms]
+        newCount = prevCount + counts
+        delta = slabMean - self.mean[atoms]
+        self.mean[atoms] += delta*counts/newCount
+        self.M2[atoms] += slabM2 + delta**2*prevCount*counts/newCount
+        self.count[atoms] = newCount
+
+        slabMin = dens[starts]
+        newMin = slabMin < self.min[atoms]
+        self.min[atoms[newMin]] = slabMin[newMin]
+        self.max[atoms] = np.maximum(self.max[atoms], dens[ends])
+
+        pos = dens > 0
+        neg = dens < 0
+        self.posSum[atoms] += np.add.reduceat(np.where(pos, dens, 0), starts)
+        self.posCount[atoms] += np.add.reduceat(pos.astype(np.int64), starts)
+        self.negSum[atoms] += np.add.reduceat(np.where(neg, dens, 0), starts)
+        self.negCount[atoms] += np.add.reduceat(neg.astype(np.int64), starts)
+
+        if self.calcFCmap:
+            allFC = FCvals[tagged].astype(np.float64)
+            self.addToTotals(self.mapTotals['calc'], allFC)
+
+            FC = np.clip(allFC[order], 0, None)
+            self.FCmax[atoms] = np.maximum(
+                self.FCmax[atoms], np.maximum.reduceat(FC, starts))
+            self.FCatMin[atoms[newMin]] = FC[starts][newMin]
+
+            w = dens*FC
+            self.wSum[atoms] += np.add.reduceat(w, starts)
+            self.wMin[atoms] = np.minimum(
+                self.wMin[atoms], np.minimum.reduceat(w, starts))
+            self.wMax[atoms] = np.maximum(
+                self.wMax[atoms], np.maximum.reduceat(w, starts))
+
+            wPos = w > 0
+            wNeg = w < 0
+            self.wPosSum[atoms] += np.add.reduceat(
+                np.where(wPos, w, 0), starts)
+            self.wPosWeight[atoms] += np.add.reduceat(
+                np.where(wPos, FC, 0), starts)
+            self.wPosCount[atoms] += np.add.reduceat(
+                wPos.astype(np.int64), starts)
+            self.wNegSum[atoms] += np.add.reduceat(
+                np.where(wNeg, w, 0), starts)
+            self.wNegWeight[atoms] += np.add.reduceat(
+                np.where(wNeg, FC, 0), starts)
+            self.wNegCount[atoms] += np.add.reduceat(
+                wNeg.astype(np.int64), starts)
+
+        if self.quantiles == 'exact':
+            self.keptAtoms.append(atomNums.astype(np.uint32))
+            self.keptDens.append(densVals[tagged][order])
+
+    def startSketch(self):
+
+        # set up the per-atom histograms, once per-atom
+        # min and max densities are known from a first pass
+
+        self.hist = np.zeros((self.maxAtomNum + 1, self.numBins),
+                             dtype=np.uint32)
+        width = (self.max - self.min)/self.numBins
+        self.binWidth = np.where(width > 0, width, 1)
+
+    def addSlabToSketch(self,
+                        atomVals=[], densVals=[]):
+
+        # add a single slab of the atom-tagged and density
+        # maps to the per-atom histograms (second pass)
+
+        tagged, atomNums = self.getTaggedVoxels(atomVals, firstPass=False)
+        dens = densVals[tagged].astype(np.float64)
+
+        bins = np.floor((dens - self.min[atomNums])/self.binWidth[atomNums])
+        bins = np.clip(np.nan_to_num(bins), 0, self.numBins - 1)
+        np.add.at(self.hist, (atomNums, bins.astype(np.intp)), 1)
+
+    def sketchPercentile(self,
+                         atoms=[], q=50):
+
+        # estimate the q-th percentile of each atom's density values
+        # from its histogram, assuming values spread evenly within bins
+
+        hist = self.hist[atoms]
+        cumHist = np.cumsum(hist, axis=1)
+        rank = (self.count[atoms] - 1)*(q/100)
+
+        bins = np.argmax(cumHist > rank[:, None], axis=1)
+        rows = np.arange(len(atoms))
+        inBin = hist[rows, bins]
+        below = cumHist[rows, bins] - inBin
+        frac = (rank - below + 0.5)/np.maximum(inBin, 1)
+
+        vals = self.min[atoms] + (bins + frac)*self.binWidth[atoms]
+        return np.clip(vals, self.min[atoms], self.max[atoms])
+
+    def getMetrics(self):
+
+        # per-atom metrics, as arrays indexed by atom number. Atoms
+        # with no assigned voxels are left as NaN, with numvoxels 0
+
+        n = self.maxAtomNum + 1
+        present = self.count > 0
+        atoms = np.flatnonzero(present)
+        counts = self.count[atoms]
+
+        def fill(vals, dtype=np.float64, default=np.nan):
+            arr = np.full(n, default, dtype=dtype)
+            arr[atoms] = vals
+            return arr
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            metrics = {
+                'meandensity': fill(self.mean[atoms]),
+                'mindensity': fill(self.min[atoms]),
+                'maxdensity': fill(self.max[atoms]),
+                'stddensity': fill(np.sqrt(self.M2[atoms]/counts)),
+                'numvoxels': fill(counts, dtype=np.int64, default=0),
+                'meanPosOnly': fill(np.where(
+                    self.posCount[atoms] > 0,
+                    self.posSum[atoms]/self.posCount[atoms], 0)),
+                'meanNegOnly': fill(np.where(
+                    self.negCount[atoms] > 0,
+                    self.negSum[atoms]/self.negCount[atoms], 0))}
+
+            if self.quantiles == 'exact':
+                # the kept slabs are released as soon as they have
+                # been joined, to keep the peak memory use down
+                if len(self.keptAtoms) != 0:
+                    keptAtoms = np.concatenate(self.keptAtoms)
+                    self.keptAtoms = []
+                    keptDens = np.concatenate(self.keptDens)
+                    self.keptDens = []
+                    keptDens = keptDens.astype(np.float64)
+                else:
+                    keptAtoms = np.zeros(0, dtype=np.uint32)
+                    keptDens = np.zeros(0)
+
+                order = np.lexsort((keptDens, keptAtoms))
+                keptDens = keptDens[order]
+                starts = getSegments(keptAtoms[order])[0]
+                del keptAtoms, order
+
+                metrics['mediandensity'] = fill(
+                    segmentedMedian(keptDens, starts, counts))
+                for name, q in PERCENTILES:
+                    metrics[name] = fill(
+                        segmentedPercentile(keptDens, starts, counts, q))
+            else:
+                metrics['mediandensity'] = fill(
+                    self.sketchPercentile(atoms, 50))
+                for name, q in PERCENTILES:
+                    metrics[name] = fill(self.sketchPercentile(atoms, q))
+
+            if self.calcFCmap:
+                FCmax = self.FCmax[atoms]
+                metrics.update({
+                    'densityWeightedMean': fill(
+                        self.wSum[atoms]/FCmax/counts),
+                    'densityWeightedMin': fill(self.wMin[atoms]/FCmax),
+                    'densityWeightedMax': fill(self.wMax[atoms]/FCmax),
+                    'fracOfMaxAtomDensAtMin': fill(
+                        self.FCatMin[atoms]/FCmax),
+                    'densityWeightedMeanPosOnly': fill(np.where(
+                        self.wPosCount[atoms] > 0,
+                        self.wPosSum[atoms]/self.wPosWeight[atoms], 0)),
+                    'densityWeightedMeanNegOnly': fill(np.where(
+                        self.wNegCount[atoms] > 0,
+                        self.wNegSum[atoms]/self.wNegWeight[atoms], 0))})
+
+        return metrics
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+def getSegments(sortedKeys=[]):
+
+    # for an array sorted by key, find the start offset of each run
+    # of equal keys, the key of each run and the length of each run
+
+    sortedKeys = np.asarray(sortedKeys)
+    if len(sortedKeys) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, sortedKeys[:0], empty
+
+    starts = np.flatnonzero(
+        np.concatenate(([True], sortedKeys[1:] != sortedKeys[:-1])))
+    counts = np.diff(np.append(starts, len(sortedKeys)))
+    return starts, sortedKeys[starts], counts
+
+
+class voxelGrouping(object):
+
+    # group the atom-tagged voxels of a map by atom number. The atom
+    # number array is argsorted once (stably, so voxels for each atom
+    # stay in map order) giving a permutation and the offset and
+    # length of each atom's run of voxels, so that the values for
+    # any atom are a contiguous slice of a single grouped array
+
+    def __init__(self,
+                 atomNums=[], order=None, segments=None):
+
+        if segments is not None:
+            # the (starts, atoms, counts) of an existing grouping, for
+            # values that are already in grouped order (e.g. shared
+            # with a worker process). Values cannot then be regrouped
+            self.order = None
+            self.starts, self.atoms, self.counts = segments
+            self.numVoxels = int(np.sum(self.counts))
+        else:
+            # the atom number of each atom-tagged voxel
+            atomNums = np.asarray(atomNums)
+
+            # permutation that sorts voxels by atom number. This may
+            # be supplied if already known (e.g. from a cached index)
+            if order is None:
+                order = np.argsort(atomNums, kind='stable')
+            self.order = order
+
+            self.starts, self.atoms, self.counts = getSegments(
+                atomNums[order])
+            self.numVoxels = len(atomNums)
+
+        # position of each atom number within self.atoms
+        self.atomPosn = dict(zip(self.atoms.tolist(),
+                                 range(len(self.atoms))))
+
+    def group(self,
+              vals=[]):
+
+        # reorder per-voxel values (in map order) so that the
+        # values for each atom are contiguous
+
+        return np.asarray(vals)[self.order]
+
+    def getSlice(self,
+                 atomNum=0):
+
+        # the slice of a grouped array holding the values for
+        # an atom. A KeyError is raised for an atom with no voxels
+
+        i = self.atomPosn[atomNum]
+        return slice(self.starts[i], self.starts[i] + self.counts[i])
+
+
+class groupedValues(object):
+
+    # per-voxel values grouped by atom number, accessed like a dict
+    # mapping atom number to that atom's values. Each lookup returns
+    # a view onto the single grouped array, not a copy. 'vals' are
+    # given in map order, or already in grouped order if 'grouped'
+
+    def __init__(self,
+                 grouping=None, vals=[], grouped=False):
+
+        self.grouping = grouping
+        if grouped:
+            self.vals = np.asarray(vals)
+        else:
+            self.vals = grouping.group(vals)
+
+    def __getitem__(self, atomNum):
+        return self.vals[self.grouping.getSlice(atomNum)]
+
+    def __contains__(self, atomNum):
+        return atomNum in self.grouping.atomPosn
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.grouping.atoms)
+
+    def keys(self):
+        return self.grouping.atoms.tolist()
+
+    def values(self):
+        return [self[atm] for atm in self.keys()]
+
+    def items(self):
+        return [(atm, self[atm]) for atm in self.keys()]
@@ -0,0 +1,39 @@
+import numpy as np
+
+from combinedAtom import combinedAtom
+from combinedAtomList import combinedAtomList
+from metricStore import metricStore
+
+RES_TYPES = ['ALA', 'GLU', 'ASP', 'CYS', 'MET', 'LYS']
+ATOM_TYPES = ['N', 'CA', 'C', 'O', 'CB', 'CG']
+
+
+def makeAtomList(values=[], doses=[]):
+
+    # a combinedAtomList whose atoms share a metricStore, as made by
+    # getMultiDoseAtomList, with 'values' (shape (atoms, datasets))
+    # as the 'loss' metric. Atoms cycle through the residue and atom
+    # types above, six atoms to a residue
+
+    values = np.asarray(values, dtype=float)
+    numAtoms, numDatasets = values.shape
+    if len(doses) == 0:
+        doses = list(range(1, numDatasets + 1))
+
+    atoms = combinedAtomList(doseList=list(doses), seriesName='test')
+    atoms.store = metricStore(numAtoms=numAtoms, numDatasets=numDatasets)
+    atoms.store.setValues(metric='loss', normType='Standard', vals=values)
+
+    atomList = []
+    for row in range(numAtoms):
+        atom = combinedAtom(
+            atomnum=row + 1, residuenum=row//6 + 1,
+            atomtype=ATOM_TYPES[row % 6],
+            basetype=RES_TYPES[(row//6) % len(RES_TYPES)], chaintype='A')
+        atom.store = atoms.store
+        atom.row = row
+        atom.addStoredMetric(metric='loss', normType='Standard')
+        atomList.append(atom)
+    atoms.atomList = atomList
+
+    return atoms
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# the RIDL modules import each other by module name
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'src', 'ridl'))
+
+from logFile import logFile  # noqa: E402
+from mapUtils import makeMapSet  # noqa: E402
+
+
+@pytest.fixture
+def log(tmp_path):
+
+    # a log file for a single test, not printed to screen
+
+    return logFile(fileName=str(tmp_path / 'test.log'),
+                   fileDir=str(tmp_path), printToScreenMajor=False)
+
+
+@pytest.fixture
+def mapDir(tmp_path):
+
+    # a directory holding a small synthetic atom-tagged map,
+    # two density maps, an Fcalc map and a matching pdb file
+
+    dirName = str(tmp_path / 'maps') + '/'
+    os.makedirs(dirName)
+    makeMapSet(dirName=dirName)
+    return dirName
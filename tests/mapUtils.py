@@ -0,0 +1,116 @@
+import struct
+
+import numpy as np
+
+from mapsToDensityMetrics import maps2DensMetrics
+
+MODE_DTYPES = {0: 'i1', 1: 'i2', 2: 'f4', 12: 'f2'}
+
+# per-atom attributes set from the density (and Fcalc) maps
+METRIC_ATTRS = ['meandensity', 'maxdensity', 'mindensity', 'mediandensity',
+                'numvoxels', 'stddensity', 'min90tile', 'max90tile',
+                'min95tile', 'max95tile', 'meanNegOnly', 'meanPosOnly',
+                'fracOfMaxAtomDensAtMin', 'densityWeightedMean',
+                'densityWeightedMin', 'densityWeightedMax',
+                'densityWeightedMeanNegOnly', 'densityWeightedMeanPosOnly']
+
+RES_TYPES = ['ALA', 'GLU', 'ASP', 'CYS', 'MET', 'LYS']
+ATOM_TYPES = ['N', 'CA', 'C', 'O', 'CB', 'CG']
+
+DENS_MAPS = ['test_density.map', 'test2_density.map']
+
+
+def writeMap(fileName='', data=[], mode=2,
+             cell=(40., 50., 60., 90., 90., 90.)):
+
+    # write a 3d array as a CCP4 format map (little endian),
+    # in the given map mode
+
+    nz, ny, nx = data.shape
+    flat = data.ravel()
+    symops = b''.join(s.ljust(80).encode() for s in ('X,Y,Z',))
+
+    header = struct.pack('<10i', nx, ny, nz, mode, 0, 0, 0, nx, ny, nz)
+    header += struct.pack('<6f', *cell)
+    header += struct.pack('<3i', 1, 2, 3)
+    header += struct.pack('<3f', float(flat.min()), float(flat.max()),
+                          float(flat.mean()))
+    header += struct.pack('<3i', 1, len(symops), 0)
+    header += b'\x00'*(27*4) + b'MAP ' + b'\x44\x41\x00\x00'
+    header += struct.pack('<f', float(flat.std())) + struct.pack('<i', 0)
+    header += b' '*800
+
+    with open(fileName, 'wb') as f:
+        f.write(header + symops +
+                flat.astype('<' + MODE_DTYPES[mode]).tobytes())
+
+
+def writePDB(fileName='', numAtoms=60, seed=1):
+
+    # write a pdb file of atoms at random positions
+
+    rng = np.random.default_rng(seed)
+    with open(fileName, 'w') as f:
+        for i in range(1, numAtoms+1):
+            resNum = (i-1)//6 + 1
+            atomType = ATOM_TYPES[(i-1) % 6]
+            x, y, z = rng.uniform(0, 40, 3)
+            f.write('ATOM  {:5d} {:<4s} {:>3s} {}{:4d}    '.format(
+                        i, atomType, RES_TYPES[resNum % 6], 'A', resNum) +
+                    '{:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}'.format(
+                        x, y, z, 1.0, rng.uniform(10, 40)) +
+                    '          {:>2s}  \n'.format(atomType[0]))
+
+
+def makeMapSet(dirName='./', shape=(10, 12, 14), numAtoms=60,
+               atomMapMode=2, atomTagScale=100, seed=0):
+
+    # write an atom-tagged map (about 40% of voxels tagged with an
+    # atom number), two density maps, an Fcalc map and a pdb file
+
+    rng = np.random.default_rng(seed)
+    atomNums = np.zeros(shape)
+    tagged = rng.random(shape) < 0.4
+    atomNums[tagged] = rng.integers(1, numAtoms + 1, np.count_nonzero(tagged))
+
+    writeMap(fileName=dirName + 'test_atoms.map',
+             data=atomNums*atomTagScale, mode=atomMapMode)
+    for mapName in DENS_MAPS:
+        writeMap(fileName=dirName + mapName, data=rng.normal(0, 1, shape))
+    writeMap(fileName=dirName + 'test_FC.map',
+             data=rng.normal(0.5, 1, shape))
+    writePDB(fileName=dirName + 'test.pdb', numAtoms=numAtoms)
+
+
+def makeMetricsCalc(mapDir='./', log='', **kwargs):
+
+    # a maps2DensMetrics object for the maps of makeMapSet
+
+    return maps2DensMetrics(
+        filesIn=mapDir, filesOut=mapDir, pdbName='test.pdb',
+        atomTagMap='test_atoms.map', densityMap=DENS_MAPS[0],
+        FCmap='test_FC.map', logFile=log, **kwargs)
+
+
+def getAtomMetrics(atoms=[]):
+
+    # the per-atom metrics of a list of atoms, as an array of
+    # shape (atoms, metrics) in atom number order
+
+    atoms = sorted(atoms, key=lambda atom: atom.atomnum)
+    return np.array([[getattr(atom, attr) for attr in METRIC_ATTRS]
+                     for atom in atoms], dtype=float)
+
+
+def batchMetrics(mapDir='./', log='', **kwargs):
+
+    # the per-atom metrics of each density map of makeMapSet, found
+    # by reading the maps in full (see maps2atmdensity)
+
+    calc = makeMetricsCalc(mapDir=mapDir, log=log, **kwargs)
+    metrics = []
+    for i, densMapName in enumerate(DENS_MAPS):
+        calc.densMapIn = densMapName
+        calc.maps2atmdensity(mapsAlreadyRead=i > 0)
+        metrics.append(getAtomMetrics(calc.PDBarray))
+    return metrics
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from atomRanking import selectTopN
+from atomUtils import makeAtomList
+
+
+def fullSort(vals=[], n=25, largest=True, include=None):
+
+    # the positions of the top n values by a full stable sort,
+    # leaving out nans (and values not included)
+
+    vals = np.asarray(vals, dtype=float)
+    rows = np.flatnonzero(~np.isnan(vals))
+    if include is not None:
+        rows = rows[np.asarray(include)[rows]]
+    key = -vals[rows] if largest else vals[rows]
+    ranked = rows[np.argsort(key, kind='stable')]
+    return ranked if n == 'all' else ranked[:n]
+
+
+def makeValues(numAtoms=120, numDatasets=3, seed=0):
+
+    # rounded values (so that there are ties) with some nans
+
+    rng = np.random.default_rng(seed)
+    vals = np.round(rng.normal(0, 1, (numAtoms, numDatasets)), 1)
+    vals[rng.random(vals.shape) < 0.1] = np.nan
+    return vals
+
+
+@pytest.mark.parametrize('n', [1, 10, 25, 200, 'all'])
+@pytest.mark.parametrize('largest', [True, False])
+def test_select_matches_full_sort(n, largest):
+    vals = makeValues()[:, 0]
+    np.testing.assert_array_equal(
+        selectTopN(vals=vals, n=n, largest=largest),
+        fullSort(vals=vals, n=n, largest=largest))
+
+
+def test_keep_ties():
+    vals = np.array([3., 1., 2., 2., 2., 0., np.nan])
+    assert selectTopN(vals=vals, n=2).tolist() == [0, 2]
+    assert selectTopN(vals=vals, n=2, keepTies=True).tolist() == [0, 2, 3, 4]
+
+
+@pytest.mark.parametrize('topOrBot', ['top', 'bottom'])
+def test_top_atoms_match_full_sort(topOrBot):
+    vals = makeValues()
+    atoms = makeAtomList(values=vals)
+    order = list(atoms.atomList)
+
+    for dataset in range(vals.shape[1]):
+        found = atoms.getTopNAtoms(metric='loss', dataset=dataset, n=25,
+                                   topOrBot=topOrBot)
+        expected = fullSort(vals=vals[:, dataset], n=25,
+                            largest=topOrBot == 'top')
+        assert found == [order[i] for i in expected]
+
+    # the atom list itself is not reordered
+    assert list(atoms.atomList) == order
+
+
+def test_top_atoms_of_residue_types():
+    vals = makeValues()
+    atoms = makeAtomList(values=vals)
+    include = np.isin([atom.basetype for atom in atoms.atomList],
+                      ['GLU', 'ASP'])
+
+    found = atoms.getTopNAtoms(metric='loss', dataset=1, n=10,
+                               residues=['GLU', 'ASP'])
+    expected = fullSort(vals=vals[:, 1], n=10, include=include)
+    assert found == [atoms.atomList[i] for i in expected]
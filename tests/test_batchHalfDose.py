@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from scipy.optimize import curve_fit
+
+from batchHalfDose import fitHalfDoses
+
+
+def makeDecays(numAtoms=40, fitOffset=True, seed=0):
+
+    # noisy exponential decays of density with dose, to an end
+    # density of 0 unless 'fitOffset'
+
+    rng = np.random.default_rng(seed)
+    doses = np.linspace(1, 12, 6)
+    a = rng.uniform(1, 3, (numAtoms, 1))
+    k = rng.uniform(0.1, 0.5, (numAtoms, 1))
+    c = rng.uniform(-0.5, 0.5, (numAtoms, 1))*fitOffset
+    values = a*np.exp(-k*doses) + c + rng.normal(0, 0.02, (numAtoms, 6))
+    return doses, values
+
+
+def curveFitAtom(doses=[], values=[], zeroOffset='y'):
+
+    # the per-atom fit of the same model with scipy's curve_fit,
+    # from the same initial guesses as fitHalfDoses
+
+    a = values[0]
+    k = (values[1] - values[0])/(a*(doses[0] - doses[1]))
+    if zeroOffset == 'y':
+        func = lambda x, a, k, c: a*np.exp(-k*x) + c
+        p0 = [a, k, 0]
+    else:
+        func = lambda x, a, k: a*np.exp(-k*x) + zeroOffset
+        p0 = [a, k]
+
+    params, cov = curve_fit(func, doses, values, p0)
+    ssr = np.sum((func(doses, *params) - values)**2)
+    return params, np.sqrt(np.diag(cov)), ssr
+
+
+@pytest.mark.parametrize('zeroOffset', ['y', 0])
+def test_matches_curve_fit(zeroOffset):
+    doses, values = makeDecays(fitOffset=zeroOffset == 'y')
+    fits = fitHalfDoses(doses=doses, values=values, zeroOffset=zeroOffset)
+
+    assert fits['converged'].all()
+    for i, row in enumerate(values):
+        params, errors, ssr = curveFitAtom(doses, row, zeroOffset)
+
+        np.testing.assert_allclose(fits['Initial density'][i], params[0],
+                                   rtol=1e-5)
+        np.testing.assert_allclose(fits['Residuals'][i], ssr, rtol=1e-5,
+                                   atol=1e-12)
+        np.testing.assert_allclose(fits['Certainty'][i],
+                                   np.prod(params/errors), rtol=1e-4)
+        np.testing.assert_allclose(fits['Half-dose'][i],
+                                   np.round(-np.log(0.5)/params[1], 2),
+                                   atol=0.011)
+        if zeroOffset == 'y':
+            np.testing.assert_allclose(fits['End density'][i], params[2],
+                                       rtol=1e-5, atol=1e-7)
+
+
+def test_missing_values_not_fitted():
+    doses, values = makeDecays(numAtoms=3)
+    values[1, 2] = np.nan
+
+    fits = fitHalfDoses(doses=doses, values=values)
+    assert fits['converged'].tolist() == [True, False, True]
+    assert np.isnan(fits['Half-dose'][1])
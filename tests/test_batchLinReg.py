@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from scipy.stats import linregress
+
+from batchLinReg import batchLinRegress
+
+
+@pytest.mark.parametrize('numPoints', [2, 3, 6])
+def test_matches_linregress(numPoints):
+    rng = np.random.default_rng(numPoints)
+    x = np.sort(rng.uniform(0, 10, numPoints))
+    y = rng.normal(0, 1, (50, numPoints)) + rng.normal(0, 2, (50, 1))*x
+
+    # perfect fits and constant rows are included
+    y[0] = 2*x + 1
+    y[1] = 3.
+
+    # (p values and standard errors of perfect fits are only
+    # zero to within round-off)
+    results = batchLinRegress(x=x, y=y)
+    for i, row in enumerate(y):
+        expected = linregress(x, row)
+        for found, e in zip(results, expected):
+            np.testing.assert_allclose(found[i], e, rtol=1e-9, atol=1e-7,
+                                       equal_nan=True)
+
+
+def test_missing_values_give_nan():
+    x = np.arange(4.)
+    y = np.array([[1., 2., np.nan, 4.], [1., 2., 3., 5.]])
+
+    results = batchLinRegress(x=x, y=y)
+    assert all(np.isnan(result[0]) for result in results)
+    np.testing.assert_allclose(results[0][1], linregress(x, y[1]).slope)
+
+
+def test_identical_x_values():
+    with pytest.raises(ValueError):
+        batchLinRegress(x=[1., 1., 1.], y=[[1., 2., 3.]])
@@ -0,0 +1,79 @@
+import threading
+
+import numpy as np
+import pytest
+
+from mapPrefetcher import mapPrefetcher
+from mapUtils import makeMetricsCalc, batchMetrics, getAtomMetrics, DENS_MAPS
+
+
+def test_pipelined_matches_batch(mapDir, log):
+
+    # density maps read ahead on a background thread give the
+    # same metrics, in dataset order, as reading each map in turn
+
+    expected = batchMetrics(mapDir=mapDir, log=log)
+
+    calc = makeMetricsCalc(mapDir=mapDir, log=log)
+    found = [getAtomMetrics(atoms) for atoms in
+             calc.pipelinedMaps2atmdensity(densMapList=DENS_MAPS)]
+
+    assert len(found) == len(expected)
+    for e, f in zip(expected, found):
+        np.testing.assert_allclose(f, e, rtol=1e-12, equal_nan=True)
+
+
+def test_pipelined_log_order(mapDir, log):
+
+    # each density map is logged as a step of its own, with the
+    # lines from reading the map following the map's name
+
+    calc = makeMetricsCalc(mapDir=mapDir, log=log)
+    for atoms in calc.pipelinedMaps2atmdensity(densMapList=DENS_MAPS):
+        pass
+
+    with open(log.logFile) as f:
+        lines = f.read().split('\n')
+
+    names = [i for i, ln in enumerate(lines)
+             if ln.startswith('Density map name: ') and
+             ln.split(': ')[1] in DENS_MAPS]
+    assert [lines[i].split(': ')[1] for i in names] == DENS_MAPS
+    for i in names:
+        assert lines[i-1] == 'Reading density map file...'
+        assert lines[i-2].startswith('STEP ')
+        assert lines[i+1].startswith('Map file of size')
+
+
+def test_prefetcher_order_and_depth():
+
+    # results are returned in task order, with at most 'depth'
+    # tasks run ahead of the result currently in use
+
+    started = []
+    lock = threading.Lock()
+
+    def task(i):
+        with lock:
+            started.append(i)
+        return i
+
+    tasks = [lambda i=i: task(i) for i in range(6)]
+    prefetcher = mapPrefetcher(tasks=tasks, depth=1)
+    for i, result in enumerate(prefetcher):
+        assert result == i
+        prefetcher.thread.join(0.05)
+        assert len(started) <= i + 2
+    assert started == list(range(6))
+
+
+def test_prefetcher_reraises():
+
+    def fail():
+        raise ValueError('unreadable map')
+
+    prefetcher = mapPrefetcher(tasks=[lambda: 1, fail, lambda: 3])
+    results = iter(prefetcher)
+    assert next(results) == 1
+    with pytest.raises(ValueError):
+        next(results)
@@ -0,0 +1,92 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from atomUtils import makeAtomList
+from combinedAtom import combinedAtom
+from combinedAtomList import combinedAtomList
+
+
+def makeLegacyAtom(atomnum=1, densMetric={}):
+
+    # a combinedAtom as pickled before the metricStore was introduced,
+    # with its metrics held in plain nested dicts
+
+    atom = combinedAtom(atomnum=atomnum, residuenum=1, atomtype='CA',
+                        basetype='GLU', chaintype='A')
+    del atom.store, atom.row
+    atom.densMetric = densMetric
+    return atom
+
+
+def test_metric_values_are_rows_of_store():
+    vals = np.arange(12.).reshape(4, 3)
+    atoms = makeAtomList(values=vals)
+
+    for row, atom in enumerate(atoms.atomList):
+        np.testing.assert_array_equal(
+            atom.densMetric['loss']['Standard']['values'], vals[row])
+        assert atom.store is atoms.store
+
+    np.testing.assert_array_equal(
+        atoms.getMetricValues(metric='loss', normType='Standard'), vals)
+
+
+def test_values_are_read_only():
+    atoms = makeAtomList(values=np.ones((3, 2)))
+    info = atoms.atomList[1].densMetric['loss']['Standard']
+    version = atoms.store.version
+
+    with pytest.raises(ValueError):
+        info['values'][0] = 5
+    info['values'] = [5, 6]
+
+    assert atoms.store.version > version
+    np.testing.assert_array_equal(atoms.store.getValues('loss')[1], [5, 6])
+
+
+def test_legacy_atom_pickle():
+    atom = makeLegacyAtom(densMetric={
+        'loss': {'Standard': {'values': [1., 2.], 'average': 1.5}},
+        'occupancy': {'Standard': {'values': ['1.00', '0.50']}}})
+
+    loaded = pickle.loads(pickle.dumps(atom))
+
+    assert loaded.row == 0
+    np.testing.assert_array_equal(
+        loaded.densMetric['loss']['Standard']['values'], [1., 2.])
+    assert loaded.densMetric['loss']['Standard']['average'] == 1.5
+    assert list(loaded.densMetric['occupancy']['Standard']['values']) == [
+        '1.00', '0.50']
+
+
+def test_legacy_atom_list_pickle():
+    vals = np.array([[1., 2., 3.], [4., np.nan, 6.], [7., 8., 9.]])
+    atoms = combinedAtomList(doseList=[1., 2., 3.], seriesName='test')
+    atoms.__dict__['atomList'] = [
+        makeLegacyAtom(atomnum=i + 1, densMetric={
+            'loss': {'Standard': {'values': list(v), 'average': v[0]}}})
+        for i, v in enumerate(vals)]
+
+    loaded = pickle.loads(pickle.dumps(atoms))
+
+    assert all(atom.store is loaded.store for atom in loaded.atomList)
+    assert [atom.row for atom in loaded.atomList] == [0, 1, 2]
+    np.testing.assert_array_equal(
+        loaded.getMetricValues(metric='loss', normType='Standard'), vals)
+    assert loaded.atomList[2].densMetric['loss']['Standard'][
+        'average'] == 7.
+    np.testing.assert_allclose(
+        loaded.getAverageMetricVals(densMet='loss')[0],
+        np.nanmean(vals, 0))
+
+
+def test_current_pickle_keeps_shared_store():
+    atoms = makeAtomList(values=np.arange(6.).reshape(3, 2))
+    loaded = pickle.loads(pickle.dumps(atoms))
+
+    assert all(atom.store is loaded.store for atom in loaded.atomList)
+    np.testing.assert_array_equal(
+        loaded.getMetricValues(metric='loss', normType='Standard'),
+        atoms.getMetricValues(metric='loss', normType='Standard'))
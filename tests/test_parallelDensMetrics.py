@@ -0,0 +1,40 @@
+import numpy as np
+
+from mapUtils import makeMetricsCalc, batchMetrics, getAtomMetrics, DENS_MAPS
+
+
+def test_process_pool_matches_batch(mapDir, log):
+
+    # density maps fanned out to worker processes give the same
+    # metrics, in dataset order, as reading each map in turn
+
+    expected = batchMetrics(mapDir=mapDir, log=log)
+
+    calc = makeMetricsCalc(mapDir=mapDir, log=log)
+    found = [getAtomMetrics(atoms) for atoms in calc.parallelMaps2atmdensity(
+        densMapList=DENS_MAPS, numProcesses=2)]
+
+    assert len(found) == len(expected)
+    for e, f in zip(expected, found):
+        np.testing.assert_allclose(f, e, rtol=1e-12, equal_nan=True)
+
+
+def test_worker_log_order(mapDir, log):
+
+    # the log lines from reading each density map follow that
+    # map's name, in dataset order
+
+    calc = makeMetricsCalc(mapDir=mapDir, log=log)
+    for atoms in calc.parallelMaps2atmdensity(densMapList=DENS_MAPS,
+                                              numProcesses=2):
+        pass
+
+    with open(log.logFile) as f:
+        lines = f.read().split('\n')
+
+    names = [i for i, ln in enumerate(lines)
+             if ln.startswith('Density map name: ') and
+             ln.split(': ')[1] in DENS_MAPS]
+    assert [lines[i].split(': ')[1] for i in names] == DENS_MAPS
+    for i in names:
+        assert lines[i+1].startswith('Map file of size')
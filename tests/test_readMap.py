@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from mapUtils import makeMapSet, makeMetricsCalc, batchMetrics, writeMap
+from readMap import readMap
+
+
+@pytest.mark.parametrize('atomMapMode, atomTagScale', [(1, 10), (0, 2)])
+def test_integer_atom_map_modes(mapDir, log, tmp_path, atomMapMode,
+                                atomTagScale):
+
+    # int16 and int8 atom-tagged maps (with float32 density maps)
+    # give the same metrics as a float32 atom-tagged map
+
+    intDir = str(tmp_path / 'int') + '/'
+    tmp_path.joinpath('int').mkdir()
+    makeMapSet(dirName=intDir, atomMapMode=atomMapMode,
+               atomTagScale=atomTagScale)
+
+    expected = batchMetrics(mapDir=mapDir, log=log)
+    found = batchMetrics(mapDir=intDir, log=log, atomTagScale=atomTagScale)
+    for e, f in zip(expected, found):
+        np.testing.assert_allclose(f, e, rtol=1e-12, equal_nan=True)
+
+
+def test_atom_tag_overflow(tmp_path, log):
+
+    # an int8 atom-tagged map cannot hold tags of 100 per atom
+
+    dirName = str(tmp_path) + '/'
+    makeMapSet(dirName=dirName, atomMapMode=0, atomTagScale=1)
+    calc = makeMetricsCalc(mapDir=dirName, log=log, atomTagScale=100)
+    with pytest.raises(SystemExit):
+        calc.maps2atmdensity()
+
+
+def test_compact_density(mapDir, log):
+
+    # density values held as float16 agree with the full
+    # precision metrics to within the float16 precision
+
+    expected = batchMetrics(mapDir=mapDir, log=log)
+    found = batchMetrics(mapDir=mapDir, log=log, compactDensity=True,
+                         verifyCompact=True)
+    for e, f in zip(expected, found):
+        np.testing.assert_allclose(f, e, rtol=1e-2, atol=1e-2,
+                                   equal_nan=True)
+
+
+def test_atom_tags_below_one_ignored(tmp_path, log):
+
+    # voxels with negative atom tags are not assigned to any atom
+
+    dirName = str(tmp_path) + '/'
+    atomNums = np.zeros((4, 5, 6))
+    atomNums.flat[[3, 10, 20]] = [200, -300, 100]
+    writeMap(fileName=dirName + 'test_atoms.map', data=atomNums)
+
+    atomMap, atomInds = readMap(dirIn=dirName, dirOut=dirName,
+                                mapName='test_atoms.map', log=log)
+    assert atomInds.tolist() == [3, 20]
+    assert atomMap.vxls_val.tolist() == [2, 1]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from mapUtils import (makeMapSet, makeMetricsCalc, batchMetrics,
+                      getAtomMetrics, METRIC_ATTRS, DENS_MAPS)
+
+PERCENTILE_ATTRS = ['mediandensity', 'min90tile', 'max90tile',
+                    'min95tile', 'max95tile']
+
+
+def streamMetrics(mapDir='./', log='', **kwargs):
+
+    # the per-atom metrics of each density map, found by streaming
+    # the maps a few sections at a time
+
+    calc = makeMetricsCalc(mapDir=mapDir, log=log, streamMaps=True,
+                           sectionsPerSlab=3, **kwargs)
+    metrics = []
+    for i, densMapName in enumerate(DENS_MAPS):
+        calc.densMapIn = densMapName
+        calc.maps2atmdensity(mapsAlreadyRead=i > 0)
+        metrics.append(getAtomMetrics(calc.PDBarray))
+    return metrics
+
+
+def test_stream_matches_batch(mapDir, log):
+    expected = batchMetrics(mapDir=mapDir, log=log)
+    found = streamMetrics(mapDir=mapDir, log=log)
+    for e, f in zip(expected, found):
+        np.testing.assert_allclose(f, e, rtol=1e-9, atol=1e-12,
+                                   equal_nan=True)
+
+
+@pytest.mark.parametrize('sectionsPerSlab', [1, 4, 100])
+def test_slab_size_independent(mapDir, log, sectionsPerSlab):
+    expected = batchMetrics(mapDir=mapDir, log=log)
+    calc = makeMetricsCalc(mapDir=mapDir, log=log, streamMaps=True,
+                           sectionsPerSlab=sectionsPerSlab)
+    calc.maps2atmdensity()
+    np.testing.assert_allclose(getAtomMetrics(calc.PDBarray), expected[0],
+                               rtol=1e-9, atol=1e-12, equal_nan=True)
+
+
+def test_sketch_percentiles(tmp_path, log):
+
+    # with a per-atom histogram sketch, all but the percentile metrics
+    # are exact, and the percentiles lie within a few bins of the
+    # exact values (for atoms with many voxels each)
+
+    mapDir = str(tmp_path) + '/'
+    makeMapSet(dirName=mapDir, numAtoms=4)
+    expected = batchMetrics(mapDir=mapDir, log=log)
+    found = streamMetrics(mapDir=mapDir, log=log, slabQuantiles='sketch')
+
+    exact = [METRIC_ATTRS.index(a) for a in METRIC_ATTRS
+             if a not in PERCENTILE_ATTRS]
+    approx = [METRIC_ATTRS.index(a) for a in PERCENTILE_ATTRS]
+    binWidth = (expected[0][:, METRIC_ATTRS.index('maxdensity')] -
+                expected[0][:, METRIC_ATTRS.index('mindensity')])/128
+
+    np.testing.assert_allclose(found[0][:, exact], expected[0][:, exact],
+                               rtol=1e-9, atol=1e-12, equal_nan=True)
+    assert np.all(np.abs(found[0][:, approx] - expected[0][:, approx]) <=
+                  3*binWidth[:, None])
+
+    with open(log.logFile) as f:
+        assert 'approximate' in f.read()